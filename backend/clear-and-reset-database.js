@@ -69,7 +69,7 @@ async function clearAndResetDatabase() {
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
-        UNIQUE(student_id)
+        UNIQUE(student_id, model_name, photo_hash)
       );
 
       -- Attendance records
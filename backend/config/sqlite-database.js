@@ -56,7 +56,7 @@ const initDatabase = async () => {
         created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
-        UNIQUE(student_id)
+        UNIQUE(student_id, model_name, photo_hash)
       );
 
       CREATE TABLE IF NOT EXISTS attendance (
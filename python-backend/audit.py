@@ -0,0 +1,188 @@
+"""Gallery-wide audit for the same face enrolled under different students.
+
+Scores every pair of a model's gallery embeddings in bounded-memory tiles
+(gallery.similarity_blocks) and reports each cross-student pair at or above a
+similarity threshold. Pairs are written as NDJSON while the scan runs, so a
+report can be read before the audit finishes, and the scan itself never holds
+more than one tile of scores.
+
+Run standalone (report on stdout):
+    python audit.py --model Facenet512 --threshold 0.8 > duplicates.ndjson
+or start it from the API via POST /api/face/admin/audit.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, Optional, TextIO
+
+import numpy as np
+
+from gallery import GalleryView, PAIRWISE_BLOCK_COLS, PAIRWISE_BLOCK_ROWS, SharedGallery, run_inline, similarity_blocks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_PATH = "../backend/database/attendance.db"
+DEFAULT_GALLERY_DIR = "gallery"
+DEFAULT_THRESHOLD = 0.8
+AUDIT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+STATUS_INTERVAL = 2.0  # Seconds between status file updates while scanning
+
+
+def tile_count(count: int) -> int:
+    """Number of tiles similarity_blocks yields for count rows"""
+    return sum(math.ceil((count - row_start) / PAIRWISE_BLOCK_COLS) for row_start in range(0, count, PAIRWISE_BLOCK_ROWS))
+
+
+def cross_student_pairs(view: GalleryView, threshold: float,
+                        progress: Optional[Callable[[int], None]] = None,
+                        runner: Callable[..., Any] = run_inline) -> Iterator[Dict[str, Any]]:
+    """Yield every pair of rows from different students with similarity >= threshold"""
+    _, codes = np.unique(view.raw_student_ids, return_inverse=True)
+    for tile, (row_start, col_start, scores) in enumerate(similarity_blocks(view.matrix, runner=runner), start=1):
+        row_index = np.arange(row_start, row_start + scores.shape[0])
+        col_index = np.arange(col_start, col_start + scores.shape[1])
+        hits = scores >= threshold
+        hits &= col_index[None, :] > row_index[:, None]
+        hits &= codes[row_index][:, None] != codes[col_index][None, :]
+
+        for row, col in zip(*np.nonzero(hits)):
+            first, second = row_index[row], col_index[col]
+            yield {
+                "similarity": round(float(scores[row, col]), 4),
+                "enrollment_id": int(view.ids[first]),
+                "student_id": view.raw_student_ids[first].decode("utf-8"),
+                "other_enrollment_id": int(view.ids[second]),
+                "other_student_id": view.raw_student_ids[second].decode("utf-8"),
+            }
+        if progress:
+            progress(tile)
+
+
+class AuditJob:
+    """One audit run, reported as <audit_id>.ndjson plus a <audit_id>.json status file"""
+
+    def __init__(self, gallery: SharedGallery, model_name: str, threshold: float, report_dir: str,
+                 audit_id: Optional[str] = None, runner: Callable[..., Any] = run_inline):
+        self.gallery = gallery
+        self.model_name = model_name
+        self.threshold = threshold
+        self.report_dir = report_dir
+        self.audit_id = audit_id or uuid.uuid4().hex
+        self.runner = runner  # Computes each similarity tile, e.g. through the inference scheduler
+        self.status: Dict[str, Any] = {
+            "audit_id": self.audit_id,
+            "model_name": model_name,
+            "threshold": threshold,
+            "status": "queued",
+            "embeddings": None,
+            "tiles_done": 0,
+            "tiles_total": None,
+            "pairs_found": 0,
+            "students_involved": 0,
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+        }
+
+    @property
+    def report_path(self) -> str:
+        return os.path.join(self.report_dir, f"{self.audit_id}.ndjson")
+
+    @property
+    def status_path(self) -> str:
+        return os.path.join(self.report_dir, f"{self.audit_id}.json")
+
+    def _save_status(self) -> None:
+        temp_path = f"{self.status_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.status, f, indent=2)
+        os.replace(temp_path, self.status_path)
+
+    def submit(self) -> Dict[str, Any]:
+        """Record the audit as queued so any worker process can report on it"""
+        os.makedirs(self.report_dir, exist_ok=True)
+        self._save_status()
+        return dict(self.status)
+
+    def write(self, out: TextIO) -> None:
+        """Scan the gallery and write matching pairs to out as NDJSON"""
+        view = self.gallery.sync(self.model_name)
+        students = set()
+        last_saved = 0.0
+
+        def progress(tile: int) -> None:
+            nonlocal last_saved
+            self.status["tiles_done"] = tile
+            if time.monotonic() - last_saved > STATUS_INTERVAL:
+                out.flush()
+                self._save_status()
+                last_saved = time.monotonic()
+
+        self.status.update(embeddings=len(view), tiles_total=tile_count(len(view)))
+        for pair in cross_student_pairs(view, self.threshold, progress, self.runner):
+            out.write(json.dumps(pair) + "\n")
+            self.status["pairs_found"] += 1
+            students.update((pair["student_id"], pair["other_student_id"]))
+            self.status["students_involved"] = len(students)
+
+    def run(self) -> Dict[str, Any]:
+        os.makedirs(self.report_dir, exist_ok=True)
+        self.status.update(status="running", started_at=datetime.now().isoformat())
+        self._save_status()
+        started = time.perf_counter()
+        try:
+            with open(self.report_path, "w") as out:
+                self.write(out)
+            self.status["status"] = "completed"
+        except Exception as e:
+            logger.error(f"Audit {self.audit_id} failed: {e}")
+            self.status.update(status="failed", error=str(e))
+            raise
+        finally:
+            self.status["finished_at"] = datetime.now().isoformat()
+            self.status["duration_seconds"] = round(time.perf_counter() - started, 3)
+            self._save_status()
+
+        logger.info(f"Audit {self.audit_id} of {self.model_name}: {self.status['pairs_found']} pairs "
+                    f">= {self.threshold} among {self.status['embeddings']} embeddings")
+        return dict(self.status)
+
+
+def read_status(report_dir: str, audit_id: str) -> Optional[Dict[str, Any]]:
+    if not AUDIT_ID_PATTERN.match(audit_id):
+        return None
+    try:
+        with open(os.path.join(report_dir, f"{audit_id}.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the same face enrolled under different students")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    parser.add_argument("--gallery-dir", default=DEFAULT_GALLERY_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr)
+    gallery = SharedGallery(args.database, args.gallery_dir)
+    view = gallery.sync(args.model)
+    found = 0
+    for pair in cross_student_pairs(view, args.threshold):
+        sys.stdout.write(json.dumps(pair) + "\n")
+        found += 1
+    logger.info(f"{found} cross-student pairs >= {args.threshold} among {len(view)} embeddings")
+
+
+if __name__ == "__main__":
+    main()
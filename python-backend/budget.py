@@ -0,0 +1,89 @@
+"""Per-request time budgets and stage timings.
+
+A RequestBudget carries the client's deadline through the verification
+pipeline so optional work (relaxed detection retries, waiting for an inference
+slot) can be skipped once the budget is nearly spent, and records how long each
+stage took so the time can be reported back to the client.
+"""
+
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Set while a request is traced (see profiling.py); called with each budget the request creates
+trace_hook: ContextVar[Optional[Callable[["RequestBudget"], None]]] = ContextVar("budget_trace_hook", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's time budget runs out before a stage can start"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded before {stage}")
+        self.stage = stage
+
+
+class RequestBudget:
+    """Deadline and stage timings for one request (no deadline if budget_ms is None)"""
+
+    def __init__(self, budget_ms: Optional[float] = None):
+        self.started = time.perf_counter()
+        self.budget_ms = budget_ms if budget_ms and budget_ms > 0 else None
+        self.deadline = self.started + self.budget_ms / 1000 if self.budget_ms else None
+        self.timings: Dict[str, float] = {}
+        # cProfile.Profile attached by the slow-request profiler for sampled requests
+        self.profiler: Optional[Any] = None
+        hook = trace_hook.get()
+        if hook is not None:
+            hook(self)
+
+    def remaining_ms(self) -> float:
+        if self.deadline is None:
+            return math.inf
+        return (self.deadline - time.perf_counter()) * 1000
+
+    def expired(self) -> bool:
+        return self.remaining_ms() <= 0
+
+    def allows(self, cost_ms: float) -> bool:
+        """Whether a stage expected to take cost_ms still fits in the budget"""
+        return self.remaining_ms() >= cost_ms
+
+    def check(self, stage: str) -> None:
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    def record(self, stage: str, seconds: float) -> None:
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds * 1000
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    @contextmanager
+    def profiled(self) -> Iterator[None]:
+        """Run the block under this request's profiler, if it has one"""
+        if self.profiler is None:
+            yield
+            return
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Another profiler is active in this thread
+            yield
+            return
+        try:
+            yield
+        finally:
+            self.profiler.disable()
+
+    def report(self) -> Dict[str, float]:
+        """Stage timings in milliseconds, plus the total so far"""
+        timings = {stage: round(ms, 1) for stage, ms in self.timings.items()}
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return timings
@@ -0,0 +1,389 @@
+"""Offline calibration of per-student verification thresholds.
+
+One global verification threshold is too strict for students whose enrollment
+photos match each other poorly (they need several retries at the kiosk) and
+too loose for students with a look-alike in the gallery. This job scores every
+pair of enrolled embeddings for a model in fixed-size tiles (see
+gallery.similarity_blocks), so memory stays bounded at 100k faces, and collects:
+
+    - the full genuine (same student) and impostor similarity histograms,
+    - for every row, its best genuine partner across the student's other angles,
+    - for every row, its nearest impostor (most similar other student).
+
+From these each student gets a threshold: lowered towards how well their own
+angles match each other, but never below their nearest impostor plus a margin
+or the global threshold for the target false-accept rate. Thresholds are stored
+in face_student_thresholds and verify_face reads them from an in-memory table.
+
+Students with a single enrollment have no genuine pair and keep the global
+threshold. If the whole gallery has fewer than min_genuine_pairs genuine pairs
+the run is recorded as skipped and the stored thresholds are left untouched.
+
+Run standalone:
+    python calibrate.py --model Facenet512
+or start it from the API via POST /api/face/admin/calibrate.
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from gallery import GalleryView, SharedGallery, run_inline, similarity_blocks
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_PATH = "../backend/database/attendance.db"
+DEFAULT_GALLERY_DIR = "gallery"
+
+HISTOGRAM_BINS = 2000  # Over cosine similarity [-1, 1], i.e. 0.001 per bin
+DEFAULT_BASE_THRESHOLD = 0.6
+DEFAULT_TARGET_FAR = 1e-4  # Fraction of impostor pairs allowed at or above the global threshold
+IMPOSTOR_MARGIN = 0.05  # A student's threshold stays this far above their nearest impostor
+GENUINE_MARGIN = 0.05  # ... and may drop to this far below their weakest genuine match
+MAX_THRESHOLD = 0.95
+MIN_GENUINE_PAIRS = 50  # Fewer same-student pairs than this and the run writes no thresholds
+
+CALIBRATION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_calibration_runs (
+        run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        model_name TEXT NOT NULL,
+        embeddings INTEGER NOT NULL,
+        students INTEGER NOT NULL,
+        base_threshold REAL NOT NULL,
+        target_far REAL NOT NULL,
+        far_threshold REAL,
+        genuine_pairs INTEGER NOT NULL,
+        impostor_pairs INTEGER NOT NULL,
+        skipped_students INTEGER NOT NULL DEFAULT 0,
+        skipped_reason TEXT,
+        genuine_histogram TEXT NOT NULL,
+        impostor_histogram TEXT NOT NULL,
+        duration_seconds REAL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE IF NOT EXISTS face_student_thresholds (
+        student_id TEXT NOT NULL,
+        model_name TEXT NOT NULL,
+        threshold REAL NOT NULL,
+        genuine_score REAL,
+        impostor_score REAL,
+        nearest_impostor TEXT,
+        enrollment_count INTEGER NOT NULL,
+        run_id INTEGER NOT NULL,
+        PRIMARY KEY (student_id, model_name)
+    );
+"""
+
+
+def _bin_index(scores: np.ndarray) -> np.ndarray:
+    bins = ((scores + 1.0) * (HISTOGRAM_BINS / 2)).astype(np.int64)
+    return np.clip(bins, 0, HISTOGRAM_BINS - 1)
+
+
+def _bin_edge(index: int) -> float:
+    return index * 2.0 / HISTOGRAM_BINS - 1.0
+
+
+def far_threshold(impostor_histogram: np.ndarray, target_far: float) -> Optional[float]:
+    """Lowest bin edge at which at most target_far of impostor pairs score at or above it"""
+    total = impostor_histogram.sum()
+    if total == 0:
+        return None
+    # Impostor pairs at or above each bin
+    tail = np.cumsum(impostor_histogram[::-1])[::-1] / total
+    index = int(np.argmax(tail <= target_far))
+    return _bin_edge(index)
+
+
+def pair_statistics(view: GalleryView, runner: Callable[..., Any] = run_inline) -> Dict[str, Any]:
+    """Histograms plus per-row best genuine and nearest impostor scores, in bounded memory"""
+    count = len(view)
+    matrix = view.matrix
+    _, codes = np.unique(view.raw_student_ids, return_inverse=True)
+
+    genuine_histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    impostor_histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    best_genuine = np.full(count, -np.inf, dtype=np.float32)
+    best_impostor = np.full(count, -np.inf, dtype=np.float32)
+    nearest_impostor = np.full(count, -1, dtype=np.int64)
+
+    for row_start, col_start, scores in similarity_blocks(matrix, runner=runner):
+        row_index = np.arange(row_start, row_start + scores.shape[0])
+        col_index = np.arange(col_start, col_start + scores.shape[1])
+        upper = col_index[None, :] > row_index[:, None]
+        same = codes[row_index][:, None] == codes[col_index][None, :]
+        genuine, impostor = upper & same, upper & ~same
+
+        genuine_histogram += np.bincount(_bin_index(scores[genuine]), minlength=HISTOGRAM_BINS)
+        impostor_histogram += np.bincount(_bin_index(scores[impostor]), minlength=HISTOGRAM_BINS)
+
+        # Each pair is seen once, so update both the row side and the column side
+        genuine_scores = np.where(genuine, scores, -np.inf)
+        best_genuine[row_index] = np.maximum(best_genuine[row_index], genuine_scores.max(axis=1))
+        best_genuine[col_index] = np.maximum(best_genuine[col_index], genuine_scores.max(axis=0))
+
+        impostor_scores = np.where(impostor, scores, -np.inf)
+        for axis, own, other in ((1, row_index, col_index), (0, col_index, row_index)):
+            best = impostor_scores.max(axis=axis)
+            improved = best > best_impostor[own]
+            best_impostor[own[improved]] = best[improved]
+            nearest_impostor[own[improved]] = other[impostor_scores.argmax(axis=axis)[improved]]
+
+    return {
+        "codes": codes,
+        "genuine_histogram": genuine_histogram,
+        "impostor_histogram": impostor_histogram,
+        "best_genuine": best_genuine,
+        "best_impostor": best_impostor,
+        "nearest_impostor": nearest_impostor,
+    }
+
+
+def student_thresholds(view: GalleryView, stats: Dict[str, Any], base_threshold: float,
+                       global_threshold: Optional[float]) -> Dict[str, Dict[str, Any]]:
+    """Per-student threshold from their weakest genuine match and strongest impostor.
+
+    Students without a genuine pair (a single enrollment) are left out.
+    """
+    codes = stats["codes"]
+    student_count = int(codes.max()) + 1 if codes.size else 0
+
+    # Weakest "best own match" over a student's rows, and strongest impostor against any of them
+    genuine_score = np.full(student_count, np.inf, dtype=np.float32)
+    np.minimum.at(genuine_score, codes, stats["best_genuine"])
+    impostor_score = np.full(student_count, -np.inf, dtype=np.float32)
+    np.maximum.at(impostor_score, codes, stats["best_impostor"])
+    strongest_row = np.full(student_count, -1, dtype=np.int64)
+    matches = stats["best_impostor"] == impostor_score[codes]
+    strongest_row[codes[matches]] = np.nonzero(matches)[0]
+    enrollment_count = np.bincount(codes, minlength=student_count)
+
+    floor = np.maximum(impostor_score + IMPOSTOR_MARGIN, global_threshold if global_threshold is not None else -1.0)
+    has_genuine = np.isfinite(genuine_score)
+    relaxed = np.minimum(base_threshold, genuine_score - GENUINE_MARGIN)
+    thresholds = np.minimum(np.maximum(floor, relaxed), MAX_THRESHOLD)
+
+    first_row = np.full(student_count, -1, dtype=np.int64)
+    first_row[codes[::-1]] = np.arange(codes.size)[::-1]
+
+    results = {}
+    for code in np.nonzero(has_genuine)[0]:
+        row = strongest_row[code]
+        impostor_row = stats["nearest_impostor"][row] if row >= 0 else -1
+        results[view.raw_student_ids[first_row[code]].decode("utf-8")] = {
+            "threshold": round(float(thresholds[code]), 4),
+            "genuine_score": round(float(genuine_score[code]), 4),
+            "impostor_score": round(float(impostor_score[code]), 4) if np.isfinite(impostor_score[code]) else None,
+            "nearest_impostor": view.raw_student_ids[impostor_row].decode("utf-8") if impostor_row >= 0 else None,
+            "enrollment_count": int(enrollment_count[code]),
+        }
+    return results
+
+
+class CalibrationJob:
+    """Computes and stores per-student thresholds for one model"""
+
+    def __init__(self, database_path: str, gallery: SharedGallery, model_name: str,
+                 base_threshold: float = DEFAULT_BASE_THRESHOLD, target_far: float = DEFAULT_TARGET_FAR,
+                 min_genuine_pairs: int = MIN_GENUINE_PAIRS, runner: Callable[..., Any] = run_inline):
+        self.database_path = database_path
+        self.gallery = gallery
+        self.model_name = model_name
+        self.base_threshold = base_threshold
+        self.target_far = target_far
+        self.min_genuine_pairs = min_genuine_pairs
+        self.runner = runner  # Computes each similarity tile, e.g. through the inference scheduler
+
+    def run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        view = self.gallery.sync(self.model_name)
+        logger.info(f"Calibrating {self.model_name} thresholds over {len(view)} embeddings")
+
+        stats = pair_statistics(view, self.runner)
+        global_threshold = far_threshold(stats["impostor_histogram"], self.target_far)
+        genuine_pairs = int(stats["genuine_histogram"].sum())
+        student_count = int(stats["codes"].max()) + 1 if stats["codes"].size else 0
+        skipped_reason = None
+        if genuine_pairs < self.min_genuine_pairs:
+            skipped_reason = f"{genuine_pairs} genuine pairs, need at least {self.min_genuine_pairs}"
+            thresholds = {}
+        else:
+            thresholds = student_thresholds(view, stats, self.base_threshold, global_threshold)
+        skipped_students = student_count - len(thresholds)
+        duration = time.perf_counter() - started
+
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            conn.executescript(CALIBRATION_SCHEMA)
+            cursor = conn.execute("""
+                INSERT INTO face_calibration_runs (
+                    model_name, embeddings, students, base_threshold, target_far, far_threshold,
+                    genuine_pairs, impostor_pairs, skipped_students, skipped_reason,
+                    genuine_histogram, impostor_histogram, duration_seconds
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                self.model_name, len(view), len(thresholds), self.base_threshold, self.target_far,
+                global_threshold, genuine_pairs, int(stats["impostor_histogram"].sum()),
+                skipped_students, skipped_reason,
+                json.dumps(stats["genuine_histogram"].tolist()), json.dumps(stats["impostor_histogram"].tolist()),
+                round(duration, 3)
+            ))
+            run_id = cursor.lastrowid
+            if skipped_reason is None:
+                conn.execute("DELETE FROM face_student_thresholds WHERE model_name = ?", (self.model_name,))
+            conn.executemany("""
+                INSERT INTO face_student_thresholds (
+                    student_id, model_name, threshold, genuine_score, impostor_score,
+                    nearest_impostor, enrollment_count, run_id
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (student_id, self.model_name, entry["threshold"], entry["genuine_score"], entry["impostor_score"],
+                 entry["nearest_impostor"], entry["enrollment_count"], run_id)
+                for student_id, entry in thresholds.items()
+            ])
+            conn.commit()
+        finally:
+            conn.close()
+
+        values = [entry["threshold"] for entry in thresholds.values()]
+        summary = {
+            "run_id": run_id,
+            "model_name": self.model_name,
+            "embeddings": len(view),
+            "students": len(thresholds),
+            "skipped_students": skipped_students,
+            "skipped_reason": skipped_reason,
+            "genuine_pairs": genuine_pairs,
+            "far_threshold": global_threshold,
+            "raised": sum(1 for value in values if value > self.base_threshold),
+            "lowered": sum(1 for value in values if value < self.base_threshold),
+            "duration_seconds": round(duration, 3),
+        }
+        if skipped_reason is not None:
+            logger.warning(f"Calibration run {run_id} for {self.model_name} skipped ({skipped_reason}); "
+                           f"kept the previous thresholds")
+        else:
+            logger.info(f"Calibration run {run_id} for {self.model_name}: {summary}")
+        return summary
+
+
+def latest_run(database_path: str, model_name: str) -> Optional[Dict[str, Any]]:
+    """Summary of the most recent calibration run, without the histograms"""
+    conn = sqlite3.connect(database_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        row = conn.execute("""
+            SELECT run_id, model_name, embeddings, students, base_threshold, target_far, far_threshold,
+                   genuine_pairs, impostor_pairs, skipped_students, skipped_reason, duration_seconds, created_at
+            FROM face_calibration_runs WHERE model_name = ? ORDER BY run_id DESC LIMIT 1
+        """, (model_name,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return dict(row) if row else None
+
+
+class StudentThresholds:
+    """In-memory per-student thresholds, reloaded when a newer calibration run appears.
+
+    Only a model's first load reads SQLite on the caller's thread; after that a
+    stale table keeps answering while a daemon thread reloads it.
+    """
+
+    def __init__(self, database_path: str, refresh_interval: float = 30.0):
+        self.database_path = database_path
+        self.refresh_interval = refresh_interval
+        self._tables: Dict[str, Dict[str, float]] = {}
+        self._run_ids: Dict[str, Optional[int]] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self, model_name: str) -> None:
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            run_id = conn.execute(
+                "SELECT MAX(run_id) FROM face_student_thresholds WHERE model_name = ?", (model_name,)
+            ).fetchone()[0]
+            if run_id != self._run_ids.get(model_name):
+                rows = conn.execute(
+                    "SELECT student_id, threshold FROM face_student_thresholds WHERE model_name = ?",
+                    (model_name,)
+                ).fetchall()
+                self._tables[model_name] = dict(rows)
+                self._run_ids[model_name] = run_id
+        except sqlite3.OperationalError:
+            # No calibration has run yet
+            self._tables[model_name] = {}
+        finally:
+            conn.close()
+
+    def _refresh_in_background(self, model_name: str) -> None:
+        """Reload a model on a daemon thread; the caller holds _lock and the thread releases it"""
+        def run():
+            try:
+                self._refresh(model_name)
+            except Exception as e:
+                logger.warning(f"Reloading {model_name} student thresholds failed: {e}")
+            finally:
+                self._checked[model_name] = time.monotonic()
+                self._lock.release()
+
+        threading.Thread(target=run, name="student-thresholds", daemon=True).start()
+
+    def warm(self, model_name: str) -> int:
+        """Load a model's thresholds now rather than on its first verification"""
+        with self._lock:
+            self._refresh(model_name)
+            self._checked[model_name] = time.monotonic()
+        return len(self._tables.get(model_name, {}))
+
+    def get(self, model_name: str, student_id: str, default: float) -> Tuple[float, bool]:
+        """(threshold, calibrated) for a student, falling back to default"""
+        now = time.monotonic()
+        if now - self._checked.get(model_name, -np.inf) > self.refresh_interval:
+            if model_name not in self._tables:
+                # Nothing cached to answer with yet
+                with self._lock:
+                    if model_name not in self._tables:
+                        self._refresh(model_name)
+                        self._checked[model_name] = now
+            elif self._lock.acquire(blocking=False):
+                self._refresh_in_background(model_name)
+        threshold = self._tables.get(model_name, {}).get(student_id)
+        return (threshold, True) if threshold is not None else (default, False)
+
+    def invalidate(self, model_name: str) -> None:
+        self._checked.pop(model_name, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute per-student verification thresholds")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    parser.add_argument("--gallery-dir", default=DEFAULT_GALLERY_DIR)
+    parser.add_argument("--base-threshold", type=float, default=DEFAULT_BASE_THRESHOLD)
+    parser.add_argument("--target-far", type=float, default=DEFAULT_TARGET_FAR)
+    parser.add_argument("--min-genuine-pairs", type=int, default=MIN_GENUINE_PAIRS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    job = CalibrationJob(
+        args.database,
+        SharedGallery(args.database, args.gallery_dir),
+        args.model,
+        base_threshold=args.base_threshold,
+        target_far=args.target_far,
+        min_genuine_pairs=args.min_genuine_pairs
+    )
+    print(json.dumps(job.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Kiosk devices that upload precomputed embeddings.
+
+Kiosks that run the face model themselves send only the embedding (raw
+little-endian float32) to /api/face/verify/embedding or
+/api/face/identify/embedding, and the server just matches it. Because the
+server can't check how such an embedding was made, only registered devices
+may use these endpoints. Every request is signed with the device's secret:
+
+    X-Device-Id:        <device_id>
+    X-Device-Timestamp: <unix time, e.g. 1760000000.123456>
+    X-Device-Signature: hex HMAC-SHA256(secret, "<device_id>\\n<timestamp>\\n<path>\\n<query>\\n<sha256 of body>")
+
+Requests whose timestamp is more than SIGNATURE_MAX_AGE seconds off the
+server clock are rejected, as are signatures already used. Used signatures
+are recorded in face_device_nonces in the shared database, so a replay is
+rejected by every worker process, and two identical uploads need different
+timestamps.
+
+Registering a device hands out a signing secret, so the API only allows it
+with the admin token (FACE_ADMIN_TOKEN); otherwise use this CLI:
+
+    python devices.py add --name "Main entrance"
+    python devices.py list
+    python devices.py revoke <device_id>
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import math
+import secrets
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_PATH = "../backend/database/attendance.db"
+SIGNATURE_MAX_AGE = 60.0  # Seconds a signed request stays valid (bounds clock skew and replays)
+
+DEVICES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_devices (
+        device_id TEXT PRIMARY KEY,
+        name TEXT,
+        secret TEXT NOT NULL,
+        is_active INTEGER NOT NULL DEFAULT 1,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        revoked_at DATETIME
+    )
+"""
+
+NONCES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_device_nonces (
+        signature TEXT PRIMARY KEY,
+        expires_at REAL NOT NULL
+    )
+"""
+
+
+class DeviceAuthError(Exception):
+    """A device request that is unsigned, badly signed, expired or replayed"""
+
+
+def sign(secret: str, device_id: str, timestamp: str, path: str, query: str, body: bytes) -> str:
+    """Signature a device sends in X-Device-Signature"""
+    message = "\n".join([device_id, timestamp, path, query, hashlib.sha256(body).hexdigest()])
+    return hmac.new(secret.encode("utf-8"), message.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def add_device(database_path: str, name: Optional[str] = None, device_id: Optional[str] = None) -> Dict[str, Any]:
+    """Register a device; the returned secret is not shown again"""
+    device = {
+        "device_id": device_id or f"dev_{secrets.token_hex(8)}",
+        "name": name,
+        "secret": secrets.token_hex(32),
+    }
+    conn = sqlite3.connect(database_path, timeout=30)
+    try:
+        conn.execute(DEVICES_SCHEMA)
+        conn.execute(
+            "INSERT INTO face_devices (device_id, name, secret) VALUES (?, ?, ?)",
+            (device["device_id"], name, device["secret"])
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    logger.info(f"Registered device {device['device_id']}")
+    return device
+
+
+def list_devices(database_path: str) -> List[Dict[str, Any]]:
+    conn = sqlite3.connect(database_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        rows = conn.execute(
+            "SELECT device_id, name, is_active, created_at, revoked_at FROM face_devices ORDER BY created_at"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        # No device has been registered yet
+        return []
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def revoke_device(database_path: str, device_id: str) -> bool:
+    """Deactivate a device; returns False if it isn't registered or already revoked"""
+    conn = sqlite3.connect(database_path, timeout=30)
+    try:
+        cursor = conn.execute(
+            "UPDATE face_devices SET is_active = 0, revoked_at = CURRENT_TIMESTAMP WHERE device_id = ? AND is_active = 1",
+            (device_id,)
+        )
+        conn.commit()
+        revoked = cursor.rowcount > 0
+    except sqlite3.OperationalError:
+        revoked = False
+    finally:
+        conn.close()
+    if revoked:
+        logger.info(f"Revoked device {device_id}")
+    return revoked
+
+
+class DeviceRegistry:
+    """In-memory secrets of active devices, reloaded every refresh_interval seconds"""
+
+    def __init__(self, database_path: str, refresh_interval: float = 30.0, max_age: float = SIGNATURE_MAX_AGE):
+        self.database_path = database_path
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self._secrets: Dict[str, str] = {}
+        self._checked = -float("inf")
+        self._nonces_ready = False
+        self._prune_at = 0.0
+        self._lock = threading.Lock()
+
+    def _refresh(self) -> None:
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            self._secrets = dict(conn.execute("SELECT device_id, secret FROM face_devices WHERE is_active = 1"))
+        except sqlite3.OperationalError:
+            self._secrets = {}
+        finally:
+            conn.close()
+
+    def secret(self, device_id: str) -> Optional[str]:
+        now = time.monotonic()
+        if now - self._checked > self.refresh_interval:
+            with self._lock:
+                if now - self._checked > self.refresh_interval:
+                    self._refresh()
+                    self._checked = now
+        return self._secrets.get(device_id)
+
+    def invalidate(self) -> None:
+        self._checked = -float("inf")
+
+    def _claim(self, signature: str) -> None:
+        """Record a used signature in the shared database, raising DeviceAuthError if any process already has"""
+        now = time.time()
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            if not self._nonces_ready:
+                conn.execute(NONCES_SCHEMA)
+                self._nonces_ready = True
+            try:
+                conn.execute(
+                    "INSERT INTO face_device_nonces (signature, expires_at) VALUES (?, ?)",
+                    (signature, now + 2 * self.max_age)
+                )
+            except sqlite3.IntegrityError:
+                raise DeviceAuthError("Replayed device request")
+            if now >= self._prune_at:
+                # Expired signatures fail the timestamp check anyway
+                conn.execute("DELETE FROM face_device_nonces WHERE expires_at < ?", (now,))
+                self._prune_at = now + self.max_age
+            conn.commit()
+        finally:
+            conn.close()
+
+    def authenticate(self, device_id: Optional[str], timestamp: Optional[str], signature: Optional[str],
+                     path: str, query: str, body: bytes) -> None:
+        """Check a signed device request, raising DeviceAuthError if it must be rejected"""
+        if not (device_id and timestamp and signature):
+            raise DeviceAuthError("X-Device-Id, X-Device-Timestamp and X-Device-Signature are required")
+        secret = self.secret(device_id)
+        if secret is None:
+            raise DeviceAuthError(f"Unknown or revoked device {device_id}")
+        try:
+            sent_at = float(timestamp)
+        except ValueError:
+            raise DeviceAuthError("Invalid X-Device-Timestamp")
+        if not math.isfinite(sent_at):
+            raise DeviceAuthError("Invalid X-Device-Timestamp")
+        skew = abs(time.time() - sent_at)
+        if skew > self.max_age:
+            raise DeviceAuthError(f"Request timestamp is {skew:.0f}s off the server clock")
+
+        # One spelling per signature, so a re-cased replay is caught as a replay
+        signature = signature.strip().lower()
+        if not hmac.compare_digest(sign(secret, device_id, timestamp, path, query, body), signature):
+            raise DeviceAuthError("Invalid device signature")
+        self._claim(signature)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage kiosks that upload precomputed embeddings")
+    parser.add_argument("command", choices=["add", "list", "revoke"])
+    parser.add_argument("device_id", nargs="?", help="Device to revoke (or the ID to register, default random)")
+    parser.add_argument("--name")
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "add":
+        print(json.dumps(add_device(args.database, args.name, args.device_id), indent=2))
+    elif args.command == "list":
+        print(json.dumps(list_devices(args.database), indent=2))
+    else:
+        if not args.device_id:
+            parser.error("revoke needs a device_id")
+        if not revoke_device(args.database, args.device_id):
+            parser.exit(1, f"No active device {args.device_id}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+"""Persistent background queue for multi-angle enrollments.
+
+Uploads are staged on disk and recorded in the face_enrollment_jobs table, so
+the HTTP request returns immediately and queued jobs survive a restart. A small
+pool of worker threads claims jobs under a lease; if a worker dies, its job is
+picked up again once the lease expires.
+
+A client retrying an upload gets the queued or running job back instead of a
+second one. Finished jobs are kept for retention_seconds so clients can read
+the result, then purged by an idle worker along with any staging directory
+left behind.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# handler(student_id, photos, model_name, progress) -> (status_code, response body)
+EnrollmentHandler = Callable[..., Tuple[int, Dict[str, Any]]]
+
+MAX_ATTEMPTS = 3
+PURGE_INTERVAL = 3600.0  # Seconds between purges of expired jobs
+
+JOBS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_enrollment_jobs (
+        job_id TEXT PRIMARY KEY,
+        student_id TEXT NOT NULL,
+        model_name TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        angles TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        progress TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        lease_expires_at REAL,
+        status_code INTEGER,
+        result TEXT,
+        error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME
+    );
+    CREATE INDEX IF NOT EXISTS idx_face_enrollment_jobs_status ON face_enrollment_jobs(status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_face_enrollment_jobs_request_hash ON face_enrollment_jobs(request_hash);
+"""
+
+
+class EnrollmentJobQueue:
+    """SQLite-backed enrollment job queue with a bounded worker pool"""
+
+    def __init__(self, database_path: str, staging_dir: str, handler: EnrollmentHandler,
+                 max_workers: int = 1, lease_seconds: float = 300.0, poll_interval: float = 1.0,
+                 retention_seconds: float = 7 * 86400.0):
+        self.database_path = database_path
+        self.staging_dir = staging_dir
+        self.handler = handler
+        self.max_workers = max_workers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self._purged_at = -float("inf")
+        self._threads: List[threading.Thread] = []
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, student_id: str, model_name: str, photos: List[Tuple[str, bytes]]) -> Dict[str, Any]:
+        """Stage photos and queue a job, reusing an identical job still queued or running.
+
+        Finished jobs are never reused: the same photos submitted again after
+        the student was deleted must enroll them again.
+        """
+        digest = hashlib.sha256(f"{student_id}|{model_name}".encode("utf-8"))
+        for angle, photo_data in photos:
+            digest.update(angle.encode("utf-8"))
+            digest.update(hashlib.sha256(photo_data).digest())
+        request_hash = digest.hexdigest()
+
+        conn = self._connect()
+        try:
+            existing = conn.execute("""
+                SELECT * FROM face_enrollment_jobs
+                WHERE request_hash = ? AND status IN ('queued', 'running')
+                ORDER BY created_at DESC LIMIT 1
+            """, (request_hash,)).fetchone()
+            if existing:
+                logger.info(f"Reusing enrollment job {existing['job_id']} for retried upload of {student_id}")
+                return self._to_dict(existing)
+
+            job_id = uuid.uuid4().hex
+            job_dir = os.path.join(self.staging_dir, job_id)
+            os.makedirs(job_dir, exist_ok=True)
+            for angle, photo_data in photos:
+                with open(os.path.join(job_dir, f"{angle}.jpg"), "wb") as f:
+                    f.write(photo_data)
+
+            conn.execute("""
+                INSERT INTO face_enrollment_jobs (
+                    job_id, student_id, model_name, request_hash, angles, progress
+                ) VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                job_id,
+                student_id,
+                model_name,
+                request_hash,
+                json.dumps([angle for angle, _ in photos]),
+                json.dumps({angle: "queued" for angle, _ in photos})
+            ))
+            job = conn.execute("SELECT * FROM face_enrollment_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+        logger.info(f"Queued enrollment job {job_id} for student {student_id}")
+        self._wakeup.set()
+        return self._to_dict(job)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._connect()
+        try:
+            job = conn.execute("SELECT * FROM face_enrollment_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return self._to_dict(job) if job else None
+
+    def counts(self) -> Dict[str, int]:
+        """Number of jobs per status"""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM face_enrollment_jobs GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        return {status: count for status, count in rows}
+
+    def purge(self) -> int:
+        """Delete finished jobs older than retention_seconds and staging directories no live job owns"""
+        conn = self._connect()
+        try:
+            cursor = conn.execute("""
+                DELETE FROM face_enrollment_jobs
+                WHERE status IN ('completed', 'failed') AND finished_at < datetime('now', ?)
+            """, (f"-{int(self.retention_seconds)} seconds",))
+            purged = cursor.rowcount
+            live = {row[0] for row in conn.execute(
+                "SELECT job_id FROM face_enrollment_jobs WHERE status IN ('queued', 'running')"
+            )}
+        finally:
+            conn.close()
+
+        # _run removes a job's directory when it finishes; this catches crashes in between.
+        # Recent directories are skipped, since submit writes the photos before the job row.
+        try:
+            names = os.listdir(self.staging_dir)
+        except FileNotFoundError:
+            names = []
+        stale_before = time.time() - self.lease_seconds
+        for name in names:
+            path = os.path.join(self.staging_dir, name)
+            if name not in live and os.path.isdir(path) and os.path.getmtime(path) < stale_before:
+                shutil.rmtree(path, ignore_errors=True)
+
+        if purged:
+            logger.info(f"Purged {purged} finished enrollment jobs")
+        return purged
+
+    @staticmethod
+    def _to_dict(job: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "job_id": job["job_id"],
+            "student_id": job["student_id"],
+            "model_name": job["model_name"],
+            "status": job["status"],
+            "progress": json.loads(job["progress"]),
+            "attempts": job["attempts"],
+            "status_code": job["status_code"],
+            "result": json.loads(job["result"]) if job["result"] else None,
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "finished_at": job["finished_at"],
+        }
+
+    def start(self) -> None:
+        """Start the worker threads; jobs left queued or orphaned by a restart resume"""
+        self._stop.clear()
+        for index in range(self.max_workers):
+            thread = threading.Thread(target=self._worker, name=f"enrollment-job-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wakeup.set()
+
+    def _worker(self) -> None:
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                logger.warning(f"Failed to claim enrollment job: {e}")
+                job = None
+
+            if job is None:
+                if time.monotonic() - self._purged_at > PURGE_INTERVAL:
+                    self._purged_at = time.monotonic()
+                    try:
+                        self.purge()
+                    except Exception as e:
+                        logger.warning(f"Failed to purge enrollment jobs: {e}")
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._run(job)
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Atomically take the oldest queued job, or one whose lease expired"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            job = conn.execute("""
+                SELECT * FROM face_enrollment_jobs
+                WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ?)
+                ORDER BY created_at
+                LIMIT 1
+            """, (now,)).fetchone()
+            if job is None:
+                conn.execute("ROLLBACK")
+                return None
+
+            conn.execute("""
+                UPDATE face_enrollment_jobs
+                SET status = 'running', attempts = attempts + 1,
+                    lease_expires_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            """, (now + self.lease_seconds, job["job_id"]))
+            job = conn.execute("SELECT * FROM face_enrollment_jobs WHERE job_id = ?", (job["job_id"],)).fetchone()
+            conn.execute("COMMIT")
+            return job
+        finally:
+            conn.close()
+
+    def _set_progress(self, job_id: str, angle: str, stage: str) -> None:
+        """Record per-angle progress and renew the lease"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT progress FROM face_enrollment_jobs WHERE job_id = ?", (job_id,)).fetchone()
+            progress = json.loads(row["progress"]) if row else {}
+            progress[angle] = stage
+            conn.execute("""
+                UPDATE face_enrollment_jobs
+                SET progress = ?, lease_expires_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = ?
+            """, (json.dumps(progress), time.time() + self.lease_seconds, job_id))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _finish(self, job_id: str, status: str, status_code: Optional[int],
+                result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("""
+                UPDATE face_enrollment_jobs
+                SET status = ?, status_code = ?, result = ?, error = ?, lease_expires_at = NULL,
+                    updated_at = CURRENT_TIMESTAMP,
+                    finished_at = CASE WHEN ? IN ('completed', 'failed') THEN CURRENT_TIMESTAMP END
+                WHERE job_id = ?
+            """, (status, status_code, json.dumps(result) if result is not None else None, error, status, job_id))
+        finally:
+            conn.close()
+
+    def _run(self, job: sqlite3.Row) -> None:
+        job_id = job["job_id"]
+        job_dir = os.path.join(self.staging_dir, job_id)
+        logger.info(f"Running enrollment job {job_id} for student {job['student_id']} (attempt {job['attempts']})")
+
+        try:
+            photos = []
+            for angle in json.loads(job["angles"]):
+                with open(os.path.join(job_dir, f"{angle}.jpg"), "rb") as f:
+                    photos.append((angle, f.read()))
+
+            status_code, result = self.handler(
+                job["student_id"],
+                photos,
+                job["model_name"],
+                progress=lambda angle, stage: self._set_progress(job_id, angle, stage)
+            )
+        except Exception as e:
+            logger.error(f"Enrollment job {job_id} failed: {e}")
+            if job["attempts"] < MAX_ATTEMPTS and os.path.isdir(job_dir):
+                self._finish(job_id, "queued", None, None, str(e))
+                return
+            self._finish(job_id, "failed", 500, None, str(e))
+        else:
+            status = "completed" if status_code == 200 else "failed"
+            self._finish(job_id, status, status_code, result, None if status_code == 200 else result.get("error"))
+            logger.info(f"Enrollment job {job_id} {status} with status {status_code}")
+
+        shutil.rmtree(job_dir, ignore_errors=True)
@@ -0,0 +1,116 @@
+"""Face-level quality scoring on the aligned crop from detection.
+
+assess_photo_quality in main.py looks at the whole upload, background
+included. This module scores only the face: DeepFace.extract_faces already
+returns an aligned crop, which is downscaled to a small fixed size so every
+check is a handful of vectorized NumPy/OpenCV operations (well under a
+millisecond). That is cheap enough to run on every live verify frame and
+reject bad ones before the embedding model runs.
+
+Checks:
+    sharpness  - variance of the Laplacian
+    exposure   - mean brightness and the fraction of clipped pixels
+    symmetry   - left half vs mirrored right half (turned head, side lighting)
+    occlusion  - eye and mouth bands compared with the rest of the face
+                 (sunglasses, masks, hands)
+"""
+
+from typing import Any, Dict
+
+import cv2
+import numpy as np
+
+CROP_SIZE = 112  # Side of the square crop all checks run on
+
+SHARPNESS_REFERENCE = 150.0  # Laplacian variance treated as fully sharp at CROP_SIZE
+CLIPPED_LOW, CLIPPED_HIGH = 10, 245
+MAX_CLIPPED_FRACTION = 0.25
+SYMMETRY_REFERENCE = 0.25  # Mean absolute half difference (0-1 scale) treated as fully asymmetric
+EYE_BAND = (0.25, 0.50)  # Vertical extent of the eye region, as fractions of the crop height
+MOUTH_BAND = (0.65, 0.90)
+BAND_COLUMNS = (0.2, 0.8)  # Horizontal extent of both bands, leaving out hair and background
+MIN_BAND_CONTRAST = 0.35  # Band std relative to whole-face std below this looks covered
+MAX_BAND_DARKENING = 0.45  # Band darker than the face by this fraction of its mean looks covered
+
+# Weights of each factor in the combined (weighted geometric mean) score
+WEIGHTS = {"sharpness": 0.35, "exposure": 0.25, "symmetry": 0.2, "occlusion": 0.2}
+
+
+def face_pixels(face_obj: Any) -> np.ndarray:
+    """Grayscale uint8 CROP_SIZE x CROP_SIZE image from a DeepFace face object or array"""
+    face = face_obj["face"] if isinstance(face_obj, dict) else face_obj
+    face = np.asarray(face)
+    while face.ndim > 3:
+        face = face[0]
+    if face.dtype != np.uint8:
+        # DeepFace returns RGB floats in [0, 1]
+        scale = 255.0 if face.max() <= 1.0 else 1.0
+        face = np.clip(face * scale, 0, 255).astype(np.uint8)
+    if face.ndim == 3:
+        face = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY) if face.shape[2] == 3 else face[:, :, 0]
+    return cv2.resize(face, (CROP_SIZE, CROP_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def _band(gray: np.ndarray, band: tuple) -> np.ndarray:
+    rows = slice(int(band[0] * CROP_SIZE), int(band[1] * CROP_SIZE))
+    columns = slice(int(BAND_COLUMNS[0] * CROP_SIZE), int(BAND_COLUMNS[1] * CROP_SIZE))
+    return gray[rows, columns]
+
+
+def assess_face_quality(face_obj: Any) -> Dict[str, Any]:
+    """Score an aligned face crop from 0 (unusable) to 1, with the per-factor scores and issues"""
+    gray = face_pixels(face_obj)
+    pixels = gray.astype(np.float32)
+    issues = []
+
+    # Sharpness
+    laplacian_var = float(cv2.Laplacian(gray, cv2.CV_32F).var())
+    sharpness = min(1.0, laplacian_var / SHARPNESS_REFERENCE)
+    if sharpness < 0.4:
+        issues.append("Face is blurry")
+
+    # Exposure
+    brightness = float(pixels.mean())
+    clipped = float(np.mean((gray <= CLIPPED_LOW) | (gray >= CLIPPED_HIGH)))
+    exposure = max(0.0, 1.0 - abs(brightness - 128) / 128) * max(0.0, 1.0 - clipped / MAX_CLIPPED_FRACTION)
+    if brightness < 60:
+        issues.append("Face is underexposed")
+    elif brightness > 200:
+        issues.append("Face is overexposed")
+    elif clipped > MAX_CLIPPED_FRACTION / 2:
+        issues.append("Harsh lighting on face")
+
+    # Pose / symmetry
+    half = CROP_SIZE // 2
+    left, right = pixels[:, :half], pixels[:, CROP_SIZE - half:][:, ::-1]
+    asymmetry = float(np.abs(left - right).mean()) / 255.0
+    symmetry = max(0.0, 1.0 - asymmetry / SYMMETRY_REFERENCE)
+    if symmetry < 0.4:
+        issues.append("Face is turned or unevenly lit")
+
+    # Occlusion
+    face_std = float(pixels.std()) + 1e-6
+    occlusion = 1.0
+    for name, band in (("eyes", EYE_BAND), ("mouth", MOUTH_BAND)):
+        region = _band(pixels, band)
+        contrast = float(region.std()) / face_std
+        darkening = (brightness - float(region.mean())) / (brightness + 1e-6)
+        band_score = min(1.0, contrast / MIN_BAND_CONTRAST) * (1.0 if darkening < MAX_BAND_DARKENING else 0.3)
+        if band_score < 0.6:
+            issues.append(f"Face may be covered around the {name}")
+        occlusion = min(occlusion, band_score)
+
+    factors = {
+        "sharpness": round(sharpness, 3),
+        "exposure": round(exposure, 3),
+        "symmetry": round(symmetry, 3),
+        "occlusion": round(occlusion, 3),
+    }
+    # Geometric mean, so one failing factor (e.g. a blurry face) pulls the score down on its own
+    quality_score = float(np.prod([max(value, 0.01) ** WEIGHTS[name] for name, value in factors.items()]))
+
+    return {
+        "quality_score": round(quality_score, 3),
+        "factors": factors,
+        "issues": issues,
+    }
@@ -0,0 +1,970 @@
+"""Shared embedding gallery for multi-process serving.
+
+Each model's active enrollments are stored as a normalized float32 matrix in a
+generation file under the gallery directory. Every worker process maps that
+file read-only, and a small shared counter file records the latest generation
+and update sequence so an enroll or delete handled by one worker is picked up
+by all the others on their next lookup, without a reload.
+
+Generation files are never modified. Enrollment changes are appended to the
+generation's delta file (an add per new row, a tombstone per removed one), so
+an enroll or delete costs O(changed rows) rather than a rewrite of the whole
+gallery; each process applies new delta records to its current view in place
+of remapping. A background thread compacts a large delta into the next
+generation, and readers switch to it atomically.
+
+Generation files double as on-disk snapshots: they survive restarts and are
+brought up to date from the photo_face_enrollment_changes log, which triggers
+fill for every insert, update and delete (including those made by the Node
+backend). Only changed rows are re-read, never the whole table.
+"""
+
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GALLERY_MAGIC = b"AEGALRY3"
+CHANGE_LOG_RETENTION_DAYS = 7
+SQLITE_PARAM_BATCH = 500
+EARLY_EXIT_CHUNK = 1024  # Rows scored per step when searching the whole gallery with stop_at
+PAIRWISE_BLOCK_ROWS = 1024  # Tile size for all-pairs similarity passes (4096 x 1024 float32 = 16 MB)
+PAIRWISE_BLOCK_COLS = 4096
+PROJECTION_CANDIDATES = 64  # Rows re-ranked at full size after a reduced-dimension coarse search
+COMPACT_MIN_CHANGES = 256  # Delta records before compaction is worthwhile...
+COMPACT_RATIO = 0.1  # ...or this fraction of the base snapshot, if larger
+
+# Fixed-size file header, followed by the ID table and the embedding matrix.
+# high_water is the last photo_face_enrollment_changes.change_id the snapshot includes.
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("generation", "<u8"),
+    ("count", "<u8"),
+    ("dim", "<u4"),
+    ("reserved", "<u4"),
+    ("high_water", "<i8"),
+    ("model_name", "S32"),
+])
+STUDENT_ID_DTYPE = np.dtype("S64")
+
+# Append-only delta file next to each generation file. Records are written
+# first and the header count moved after, so readers never see a partial record.
+DELTA_MAGIC = b"AEGDELT1"
+DELTA_HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("count", "<u8"),
+    ("high_water", "<i8"),
+    ("dim", "<u4"),
+    ("reserved", "<u4"),
+])
+DELTA_ADD = 1
+DELTA_DELETE = 2
+EMPTY_ROWS = np.zeros(0, dtype=np.intp)
+
+# Generation counter per model, and the change log filled by triggers so writes
+# from the Node backend are seen too
+GALLERY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_gallery_state (
+        model_name TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS photo_face_enrollment_changes (
+        change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        enrollment_id INTEGER NOT NULL,
+        model_name TEXT,
+        operation TEXT NOT NULL,
+        changed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+# Needs photo_face_enrollments, which the Node backend creates
+CHANGE_TRIGGERS = """
+    CREATE TRIGGER IF NOT EXISTS trg_photo_face_enrollments_insert
+    AFTER INSERT ON photo_face_enrollments
+    BEGIN
+        INSERT INTO photo_face_enrollment_changes (enrollment_id, model_name, operation)
+        VALUES (NEW.id, NEW.model_name, 'insert');
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_photo_face_enrollments_update
+    AFTER UPDATE ON photo_face_enrollments
+    BEGIN
+        INSERT INTO photo_face_enrollment_changes (enrollment_id, model_name, operation)
+        VALUES (NEW.id, NEW.model_name, 'update');
+        INSERT INTO photo_face_enrollment_changes (enrollment_id, model_name, operation)
+        SELECT OLD.id, OLD.model_name, 'delete'
+        WHERE OLD.id != NEW.id OR OLD.model_name IS NOT NEW.model_name;
+    END;
+
+    CREATE TRIGGER IF NOT EXISTS trg_photo_face_enrollments_delete
+    AFTER DELETE ON photo_face_enrollments
+    BEGIN
+        INSERT INTO photo_face_enrollment_changes (enrollment_id, model_name, operation)
+        VALUES (OLD.id, OLD.model_name, 'delete');
+    END;
+"""
+
+
+def delta_record_dtype(dim: int) -> np.dtype:
+    return np.dtype([
+        ("op", "u1"),
+        ("pad", "V7"),
+        ("id", "<i8"),
+        ("student_id", STUDENT_ID_DTYPE),
+        ("vector", "<f4", (dim,)),
+    ])
+
+
+def normalize_embedding(embedding: Any) -> np.ndarray:
+    """Return a float32 unit vector so cosine similarity is a dot product"""
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector = vector / norm
+    return vector
+
+
+def parse_embedding_rows(rows) -> Tuple[List[int], List[str], np.ndarray]:
+    """Normalize (id, student_id, embedding JSON) rows into gallery arrays"""
+    ids, student_ids, vectors = [], [], []
+    for enrollment_id, student_id, embedding_json in rows:
+        try:
+            vector = normalize_embedding(json.loads(embedding_json))
+        except Exception as e:
+            logger.warning(f"Skipping enrollment {enrollment_id} in gallery: {e}")
+            continue
+        if vectors and vector.shape[0] != vectors[0].shape[0]:
+            logger.warning(f"Skipping enrollment {enrollment_id} in gallery: embedding size mismatch")
+            continue
+        ids.append(enrollment_id)
+        student_ids.append(student_id)
+        vectors.append(vector)
+
+    matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+    return ids, student_ids, matrix
+
+
+def run_inline(func: Callable[..., Any], *args) -> Any:
+    """Default runner for the all-pairs passes: call func in this thread"""
+    return func(*args)
+
+
+def similarity_blocks(matrix: np.ndarray, block_rows: int = PAIRWISE_BLOCK_ROWS,
+                      block_cols: int = PAIRWISE_BLOCK_COLS,
+                      runner: Callable[..., Any] = run_inline) -> Iterator[Tuple[int, int, np.ndarray]]:
+    """Yield (row_start, col_start, scores) tiles covering every pair i < j once.
+
+    Scores are cosine similarities of normalized rows. Only one tile of at most
+    block_rows x block_cols is in memory at a time, so the whole N x N
+    similarity matrix is never materialized; entries with j <= i in diagonal
+    tiles are still present and must be masked by the caller. Each tile is
+    computed through runner(func, *args), e.g. one scheduler slot per tile.
+    """
+    count = matrix.shape[0]
+    for row_start in range(0, count, block_rows):
+        rows = np.ascontiguousarray(matrix[row_start:row_start + block_rows])
+        for col_start in range(row_start, count, block_cols):
+            yield row_start, col_start, runner(np.matmul, rows, matrix[col_start:col_start + block_cols].T)
+
+
+class _TailBuffer:
+    """Rows appended after a base snapshot, in arrays that grow by doubling.
+
+    Views share one buffer and each reads only its first N rows, so appending
+    in place never changes what an existing view sees.
+    """
+
+    def __init__(self, dim: int, capacity: int = 64):
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.student_ids = np.zeros(capacity, dtype=STUDENT_ID_DTYPE)
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def append(self, count: int, ids: np.ndarray, student_ids: np.ndarray, matrix: np.ndarray) -> "_TailBuffer":
+        """Add rows after the first count rows; returns the buffer now holding them"""
+        with self._lock:
+            needed = count + len(ids)
+            if count == self.count and needed <= len(self.ids):
+                buffer = self
+            else:
+                # Out of room, or another view already appended past count
+                buffer = _TailBuffer(self.matrix.shape[1], max(needed, 2 * len(self.ids)))
+                buffer.ids[:count] = self.ids[:count]
+                buffer.student_ids[:count] = self.student_ids[:count]
+                buffer.matrix[:count] = self.matrix[:count]
+            buffer.ids[count:needed] = ids
+            buffer.student_ids[count:needed] = student_ids
+            buffer.matrix[count:needed] = matrix
+            buffer.count = needed
+        return buffer
+
+
+class GalleryView:
+    """Read-only state of one model's gallery: a base snapshot plus appended and deleted rows.
+
+    Rows are numbered base first, then appended rows, and keep their numbers
+    until the next compaction; deleted rows are tombstoned, never moved. A view
+    never changes once built (apply returns a new one), so a reader holding it
+    can't see a half-applied update.
+    """
+
+    def __init__(self, model_name: str, generation: int, ids: np.ndarray,
+                 raw_student_ids: np.ndarray, matrix: np.ndarray, high_water: int = 0):
+        self.model_name = model_name
+        self.generation = generation
+        self.high_water = high_water
+        self.sequence = 0  # Published update sequence this view reflects
+        self.delta_count = 0  # Delta file records applied on top of the base
+        self._base_ids = ids
+        self._base_student_ids = raw_student_ids
+        self._base_matrix = matrix
+        self._base_index: List[Any] = [None]  # Shared with derived views, built on first use
+        self._tail: Optional[_TailBuffer] = None
+        self._tail_count = 0
+        self._dead = EMPTY_ROWS  # Sorted tombstoned row numbers
+        self._student_overlay: Dict[str, np.ndarray] = {}  # Rows of students changed since the base
+        self._live: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._student_ids: Optional[List[str]] = None
+        self._base_projected: Dict[int, np.ndarray] = {}  # Shared with derived views, by projection version
+        self._tail_projected: Dict[int, np.ndarray] = {}  # Replaced, never mutated, so derived views can reuse it
+
+    @property
+    def _base_count(self) -> int:
+        return int(self._base_ids.shape[0])
+
+    @property
+    def _total(self) -> int:
+        return self._base_count + self._tail_count
+
+    def __len__(self) -> int:
+        return self._total - int(self._dead.size)
+
+    @property
+    def dim(self) -> int:
+        if self._base_count or self._tail is None:
+            return int(self._base_matrix.shape[1]) if self._base_matrix.ndim == 2 else 0
+        return int(self._tail.matrix.shape[1])
+
+    def _materialized(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Live rows as contiguous arrays, built on first use after an update"""
+        if not self._tail_count and not self._dead.size:
+            return self._base_ids, self._base_student_ids, self._base_matrix
+        if self._live is None:
+            keep = np.ones(self._total, dtype=bool)
+            keep[self._dead] = False
+            base_keep, tail_keep = keep[:self._base_count], keep[self._base_count:]
+            parts = []
+            if self._base_count:
+                parts.append((np.asarray(self._base_ids)[base_keep], np.asarray(self._base_student_ids)[base_keep],
+                              np.asarray(self._base_matrix)[base_keep]))
+            if self._tail_count:
+                tail = self._tail
+                parts.append((tail.ids[:self._tail_count][tail_keep], tail.student_ids[:self._tail_count][tail_keep],
+                              tail.matrix[:self._tail_count][tail_keep]))
+            self._live = (
+                np.concatenate([part[0] for part in parts]),
+                np.concatenate([part[1] for part in parts]),
+                np.vstack([part[2] for part in parts]),
+            )
+        return self._live
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._materialized()[0]
+
+    @property
+    def raw_student_ids(self) -> np.ndarray:
+        return self._materialized()[1]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._materialized()[2]
+
+    @property
+    def student_ids(self) -> List[str]:
+        """Decoded student IDs of the live rows, built on first use so mapping stays O(1)"""
+        if self._student_ids is None:
+            self._student_ids = [sid.decode("utf-8") for sid in self.raw_student_ids]
+        return self._student_ids
+
+    def _base_lookup(self) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+        """(sorted base IDs, their row numbers, base rows per student), built once per snapshot"""
+        if self._base_index[0] is None:
+            ids = np.asarray(self._base_ids)
+            order = np.argsort(ids, kind="stable")
+            index: Dict[str, List[int]] = {}
+            for row, sid in enumerate(self._base_student_ids):
+                index.setdefault(sid.decode("utf-8"), []).append(row)
+            self._base_index[0] = (ids[order], order, {
+                sid: np.asarray(rows, dtype=np.intp) for sid, rows in index.items()
+            })
+        return self._base_index[0]
+
+    def rows_for_student(self, student_id: str) -> np.ndarray:
+        """Row numbers of one student's live rows"""
+        rows = self._student_overlay.get(student_id)
+        if rows is None:
+            rows = self._base_lookup()[2].get(student_id, EMPTY_ROWS)
+        return rows
+
+    def _row_id(self, row: int) -> int:
+        if row < self._base_count:
+            return int(self._base_ids[row])
+        return int(self._tail.ids[row - self._base_count])
+
+    def _row_student(self, row: int) -> str:
+        if row < self._base_count:
+            return self._base_student_ids[row].decode("utf-8")
+        return self._tail.student_ids[row - self._base_count].decode("utf-8")
+
+    def similarities(self, query: Any, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Cosine similarity of the query against every row number (tombstones score -inf) or a subset"""
+        return self._scores(self._query_vector(query), rows)
+
+    def _query_vector(self, query: Any) -> np.ndarray:
+        vector = normalize_embedding(query)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f"Embedding size {vector.shape[0]} does not match gallery size {self.dim}")
+        return vector
+
+    def _scores(self, vector: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        base_count = self._base_count
+        if rows is None:
+            scores = self._base_matrix @ vector if base_count else np.zeros(0, dtype=np.float32)
+            if self._tail_count:
+                scores = np.concatenate([scores, self._tail.matrix[:self._tail_count] @ vector])
+            if self._dead.size:
+                scores[self._dead] = -np.inf
+            return scores
+
+        in_base = rows < base_count
+        if in_base.all():
+            return self._base_matrix[rows] @ vector
+        scores = np.empty(rows.size, dtype=np.float32)
+        if in_base.any():
+            scores[in_base] = self._base_matrix[rows[in_base]] @ vector
+        scores[~in_base] = self._tail.matrix[rows[~in_base] - base_count] @ vector
+        return scores
+
+    def prepare(self, projection: Any) -> None:
+        """Project the rows now, so the first coarse search with this projection doesn't"""
+        self._projected(projection)
+
+    def _projected(self, projection: Any) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """Base and appended rows in a projection's reduced space, projected once per snapshot and row"""
+        base = self._base_projected.get(projection.version)
+        if base is None:
+            if self._base_count:
+                base = projection.project(self._base_matrix)
+            else:
+                base = np.zeros((0, projection.dim), dtype=np.float32)
+            # Shared with other views of this snapshot; only the newest projection is kept
+            self._base_projected.clear()
+            self._base_projected[projection.version] = base
+
+        tail = None
+        if self._tail_count:
+            tail = self._tail_projected.get(projection.version)
+            done = 0 if tail is None else tail.shape[0]
+            if done < self._tail_count:
+                new = projection.project(self._tail.matrix[done:self._tail_count])
+                tail = new if tail is None else np.vstack([tail, new])
+                self._tail_projected = {projection.version: tail}
+        return base, tail
+
+    def _coarse_candidates(self, vector: np.ndarray, projection: Any, candidates: int) -> np.ndarray:
+        """Row numbers of the best live rows by reduced-dimension score"""
+        base, tail = self._projected(projection)
+        reduced = projection.project(vector)
+        scores = base @ reduced
+        if tail is not None:
+            scores = np.concatenate([scores, tail @ reduced])
+        if self._dead.size:
+            scores[self._dead] = -np.inf
+        return np.sort(np.argpartition(scores, -candidates)[-candidates:])
+
+    def best_match(self, query: Any, student_id: Optional[str] = None, stop_at: Optional[float] = None,
+                   projection: Any = None, candidates: int = PROJECTION_CANDIDATES) -> Optional[Dict[str, Any]]:
+        """Best scoring row overall, or among one student's rows.
+
+        With stop_at, rows are scored in chunks (one row at a time for a single
+        student) and the search stops at the first row reaching stop_at. With a
+        projection (see projection.py), a whole-gallery search first shortlists
+        candidates rows in the reduced space and re-ranks only those.
+        """
+        rows = None if student_id is None else self.rows_for_student(student_id)
+        if len(self) == 0 or (rows is not None and rows.size == 0):
+            return None
+
+        vector = self._query_vector(query)
+        if rows is None and projection is not None and projection.source_dim == self.dim and len(self) > candidates:
+            rows = self._coarse_candidates(vector, projection, candidates)
+        if stop_at is None:
+            scores = self._scores(vector, rows)
+            best = int(np.argmax(scores))
+            row = best if rows is None else int(rows[best])
+            best_score = float(scores[best])
+        else:
+            if rows is not None:
+                candidates = rows
+            else:
+                candidates = np.delete(np.arange(self._total), self._dead)
+            chunk_size = 1 if rows is not None else EARLY_EXIT_CHUNK
+            row, best_score = -1, -np.inf
+            for start in range(0, candidates.size, chunk_size):
+                chunk = candidates[start:start + chunk_size]
+                scores = self._scores(vector, chunk)
+                best = int(np.argmax(scores))
+                if scores[best] > best_score:
+                    row, best_score = int(chunk[best]), float(scores[best])
+                if best_score >= stop_at:
+                    break
+
+        return {
+            "enrollment_id": self._row_id(row),
+            "student_id": self._row_student(row),
+            "similarity": best_score,
+        }
+
+    def _find_live_row(self, enrollment_id: int, dead: set, pending: Dict[int, int]) -> Optional[int]:
+        """Row number holding an enrollment, or None if it isn't in the view"""
+        row = pending.get(enrollment_id)
+        if row is not None and row not in dead:
+            return row
+        if self._tail_count:
+            for tail_row in np.nonzero(self._tail.ids[:self._tail_count] == enrollment_id)[0]:
+                if self._base_count + int(tail_row) not in dead:
+                    return self._base_count + int(tail_row)
+        sorted_ids, order, _ = self._base_lookup()
+        position = int(np.searchsorted(sorted_ids, enrollment_id))
+        if position < sorted_ids.size and sorted_ids[position] == enrollment_id and int(order[position]) not in dead:
+            return int(order[position])
+        return None
+
+    def apply(self, records: np.ndarray, high_water: int, sequence: int, delta_count: int) -> "GalleryView":
+        """New view with delta records applied on top of this one, which is left unchanged"""
+        view = copy.copy(self)
+        view.high_water, view.sequence, view.delta_count = high_water, sequence, delta_count
+        view._live, view._student_ids = None, None
+        if not len(records):
+            return view
+
+        base_rows = self._base_lookup()[2]
+        overlay = dict(self._student_overlay)
+        dead = set(self._dead.tolist())
+        pending: Dict[int, int] = {}
+        added = []
+
+        def student_rows(student_id: str) -> np.ndarray:
+            rows = overlay.get(student_id)
+            return rows if rows is not None else base_rows.get(student_id, EMPTY_ROWS)
+
+        for index, record in enumerate(records):
+            enrollment_id = int(record["id"])
+            if record["op"] == DELTA_DELETE:
+                row = self._find_live_row(enrollment_id, dead, pending)
+                if row is None:
+                    continue
+                dead.add(row)
+                if row >= self._total:
+                    student_id = records[added[row - self._total]]["student_id"].decode("utf-8")
+                else:
+                    student_id = self._row_student(row)
+                rows = student_rows(student_id)
+                overlay[student_id] = rows[rows != row]
+            else:
+                row = self._total + len(added)
+                pending[enrollment_id] = row
+                added.append(index)
+                student_id = record["student_id"].decode("utf-8")
+                overlay[student_id] = np.append(student_rows(student_id), row).astype(np.intp)
+
+        if added:
+            new = records[added]
+            if self.dim and len(self) and new["vector"].shape[1] != self.dim:
+                raise ValueError(f"Delta for {self.model_name} does not match gallery size {self.dim}")
+            tail = self._tail or _TailBuffer(new["vector"].shape[1])
+            view._tail = tail.append(self._tail_count, new["id"], new["student_id"], new["vector"])
+            view._tail_count = self._tail_count + len(added)
+        view._dead = np.array(sorted(dead), dtype=np.intp)
+        view._student_overlay = overlay
+        return view
+
+
+class SharedGallery:
+    """Per-model galleries published as memory-mapped generation files plus delta files.
+
+    Updates append to the current generation's delta file inside a SQLite write
+    transaction, so concurrent writers in different worker processes are
+    serialized and the published (generation, sequence) always reflects the
+    newest committed rows. Compaction folds the delta into the next generation.
+    """
+
+    def __init__(self, database_path: str, gallery_dir: str):
+        self.database_path = database_path
+        self.gallery_dir = gallery_dir
+        self._views: Dict[str, GalleryView] = {}
+        self._counters: Dict[str, np.memmap] = {}
+        self._lock = threading.Lock()
+        self._stop_sync = threading.Event()
+        self._stop_compaction = threading.Event()
+        self._compaction_due = threading.Event()
+
+    def _data_path(self, model_name: str, generation: int) -> str:
+        return os.path.join(self.gallery_dir, f"{model_name}.{generation}.bin")
+
+    def _delta_path(self, model_name: str, generation: int) -> str:
+        return os.path.join(self.gallery_dir, f"{model_name}.{generation}.delta")
+
+    def _counter(self, model_name: str) -> np.memmap:
+        """Shared [generation, update sequence] counter for a model, mapped read-write"""
+        counter = self._counters.get(model_name)
+        if counter is None:
+            os.makedirs(self.gallery_dir, exist_ok=True)
+            path = os.path.join(self.gallery_dir, f"{model_name}.gen")
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                try:
+                    os.write(fd, np.zeros(2, dtype="<u8").tobytes())
+                finally:
+                    os.close(fd)
+            except FileExistsError:
+                if os.path.getsize(path) < 16:
+                    # Counter from before delta files; the sequence slot starts at 0
+                    os.truncate(path, 16)
+            counter = np.memmap(path, dtype="<u8", mode="r+", shape=(2,))
+            self._counters[model_name] = counter
+        return counter
+
+    def published(self, model_name: str) -> Tuple[int, int]:
+        """Published (generation, update sequence) of a model"""
+        counter = self._counter(model_name)
+        return int(counter[0]), int(counter[1])
+
+    def published_generation(self, model_name: str) -> int:
+        return int(self._counter(model_name)[0])
+
+    def view(self, model_name: str) -> GalleryView:
+        """Current gallery for a model, catching up if another worker published.
+
+        Readers never wait on a refresh: while one thread swaps in the new view,
+        the others keep using the previous one.
+        """
+        current = self._views.get(model_name)
+        if current is not None and (current.generation, current.sequence) == self.published(model_name):
+            return current
+
+        if not self._lock.acquire(blocking=current is None):
+            return current
+        try:
+            view = self._refresh(model_name, self._views.get(model_name))
+            if view is None:
+                self.rebuild(model_name)
+                view = self._refresh(model_name, None)
+            self._views[model_name] = view
+            return view
+        finally:
+            self._lock.release()
+
+    def _refresh(self, model_name: str, current: Optional[GalleryView]) -> Optional[GalleryView]:
+        """Published state built on current where possible, or None if it is missing or unusable"""
+        generation, sequence = self.published(model_name)
+        if current is not None and current.generation == generation:
+            if current.sequence == sequence:
+                return current
+            base = current
+        else:
+            base = self._load(model_name, generation)
+            if base is None:
+                return None
+        try:
+            return self._read_delta(base, sequence)
+        except (OSError, ValueError, IndexError) as e:
+            logger.warning(f"Gallery delta {model_name}.{generation} unusable, rebuilding: {e}")
+            return None
+
+    def _read_delta(self, view: GalleryView, sequence: int) -> GalleryView:
+        """Apply delta records the view hasn't seen yet"""
+        path = self._delta_path(view.model_name, view.generation)
+        try:
+            header = np.fromfile(path, dtype=DELTA_HEADER_DTYPE, count=1)
+        except FileNotFoundError:
+            header = np.zeros(0, dtype=DELTA_HEADER_DTYPE)
+        if not len(header):
+            return view.apply(np.zeros(0, dtype=delta_record_dtype(view.dim)), view.high_water, sequence, 0)
+        if header["magic"][0] != DELTA_MAGIC:
+            raise ValueError(f"Invalid gallery delta file: {path}")
+
+        count = int(header["count"][0])
+        record_dtype = delta_record_dtype(int(header["dim"][0]))
+        records = np.fromfile(
+            path, dtype=record_dtype, count=count - view.delta_count,
+            offset=DELTA_HEADER_DTYPE.itemsize + view.delta_count * record_dtype.itemsize
+        ) if count > view.delta_count else np.zeros(0, dtype=record_dtype)
+        if len(records) != count - view.delta_count:
+            raise ValueError(f"Gallery delta file {path} is truncated")
+        return view.apply(records, max(int(header["high_water"][0]), view.high_water), sequence, count)
+
+    def _load(self, model_name: str, generation: int) -> Optional[GalleryView]:
+        """Map a published snapshot, or None if it is missing or unusable"""
+        if generation == 0:
+            return None
+        try:
+            return self._map(model_name, generation)
+        except (OSError, ValueError, IndexError) as e:
+            logger.warning(f"Gallery snapshot {model_name}.{generation} unusable, rebuilding: {e}")
+            return None
+
+    def _map(self, model_name: str, generation: int) -> GalleryView:
+        """Map a generation file read-only"""
+        path = self._data_path(model_name, generation)
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+        if header["magic"] != GALLERY_MAGIC:
+            raise ValueError(f"Invalid gallery file: {path}")
+        if header["model_name"].decode("utf-8") != model_name:
+            raise ValueError(f"Gallery file {path} belongs to model {header['model_name'].decode('utf-8')}")
+
+        count = int(header["count"])
+        dim = int(header["dim"])
+        high_water = int(header["high_water"])
+        if count == 0:
+            return GalleryView(model_name, generation, np.zeros(0, dtype=np.int64),
+                               np.zeros(0, dtype=STUDENT_ID_DTYPE),
+                               np.zeros((0, dim), dtype=np.float32), high_water)
+
+        offset = HEADER_DTYPE.itemsize
+        ids = np.memmap(path, dtype="<i8", mode="r", offset=offset, shape=(count,))
+        offset += ids.nbytes
+        raw_student_ids = np.memmap(path, dtype=STUDENT_ID_DTYPE, mode="r", offset=offset, shape=(count,))
+        offset += raw_student_ids.nbytes
+        matrix = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(count, dim))
+
+        return GalleryView(model_name, generation, ids, raw_student_ids, matrix, high_water)
+
+    def _write(self, model_name: str, generation: int, ids: Any, student_ids: Any,
+               matrix: np.ndarray, high_water: int) -> None:
+        """Write a generation file atomically (temp file + rename)"""
+        path = self._data_path(model_name, generation)
+        temp_path = f"{path}.tmp{os.getpid()}"
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = GALLERY_MAGIC
+        header["generation"] = generation
+        header["count"] = len(ids)
+        header["dim"] = matrix.shape[1] if matrix.ndim == 2 else 0
+        header["high_water"] = high_water
+        header["model_name"] = model_name.encode("utf-8")
+
+        with open(temp_path, "wb") as f:
+            f.write(header.tobytes())
+            f.write(np.asarray(ids, dtype="<i8").tobytes())
+            f.write(np.asarray(
+                [sid if isinstance(sid, bytes) else sid.encode("utf-8") for sid in student_ids],
+                dtype=STUDENT_ID_DTYPE
+            ).tobytes())
+            f.write(np.ascontiguousarray(matrix, dtype="<f4").tobytes())
+        try:
+            # Left behind by a crash before this generation was published
+            os.remove(self._delta_path(model_name, generation))
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, path)
+
+    def _append_delta(self, view: GalleryView, records: np.ndarray, high_water: int) -> None:
+        """Append records to a generation's delta file, then advance its header"""
+        path = self._delta_path(view.model_name, view.generation)
+        header = np.zeros(1, dtype=DELTA_HEADER_DTYPE)
+        header["magic"] = DELTA_MAGIC
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            existing = np.frombuffer(f.read(DELTA_HEADER_DTYPE.itemsize), dtype=DELTA_HEADER_DTYPE)
+            if len(existing):
+                if existing["magic"][0] != DELTA_MAGIC:
+                    raise ValueError(f"Invalid gallery delta file: {path}")
+                header = existing.copy()
+            count = int(header["count"][0])
+            if len(records):
+                dim = records.dtype["vector"].shape[0]
+                if count and int(header["dim"][0]) != dim:
+                    raise ValueError(f"New {view.model_name} embeddings do not match gallery size {header['dim'][0]}")
+                header["dim"] = dim
+                # Readers trust only the header count, so records land before it moves
+                f.seek(DELTA_HEADER_DTYPE.itemsize + count * records.dtype.itemsize)
+                f.write(records.tobytes())
+                f.flush()
+            header["count"] = count + len(records)
+            header["high_water"] = high_water
+            f.seek(0)
+            f.write(header.tobytes())
+
+    def rebuild(self, model_name: str) -> int:
+        """Rebuild a model's gallery from scratch and publish it as a new generation"""
+        os.makedirs(self.gallery_dir, exist_ok=True)
+        conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                high_water = self._latest_change(conn)
+                generation = self._next_generation(conn, model_name)
+                rows = conn.execute("""
+                    SELECT id, student_id, deepface_embedding
+                    FROM photo_face_enrollments
+                    WHERE is_active = 1 AND model_name = ?
+                    ORDER BY id
+                """, (model_name,)).fetchall()
+                ids, student_ids, matrix = parse_embedding_rows(rows)
+                self._write(model_name, generation, ids, student_ids, matrix, high_water)
+                self._publish(model_name, generation)
+                self._prune_change_log(conn)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+        self._remove_stale(model_name, generation)
+        logger.info(f"Published {model_name} gallery generation {generation} ({len(ids)} embeddings)")
+        return generation
+
+    def update(self, model_name: str) -> int:
+        """Append logged enrollment changes since the published state to the current delta file.
+
+        Each changed enrollment becomes a delete of its old row plus an add of its
+        active version, so an enroll or delete costs O(changed rows) instead of
+        rewriting the gallery. Falls back to a rebuild when there is no usable
+        snapshot or the change log no longer covers it.
+        """
+        os.makedirs(self.gallery_dir, exist_ok=True)
+        conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                high_water = self._latest_change(conn)
+                current = self._refresh(model_name, self._views.get(model_name))
+                if current is not None and current.high_water >= high_water:
+                    # Another worker already published these changes
+                    conn.execute("ROLLBACK")
+                    return current.generation
+                if current is None or not self._log_covers(conn, current.high_water):
+                    conn.execute("ROLLBACK")
+                    current = None
+                else:
+                    records = self._change_records(conn, current, high_water)
+                    self._append_delta(current, records, high_water)
+                    counter = self._counter(model_name)
+                    counter[1] = counter[1] + 1
+                    counter.flush()
+                    self._prune_change_log(conn)
+                    conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+        if current is None:
+            return self.rebuild(model_name)
+        view = self.view(model_name)
+        if self.needs_compaction(view):
+            self._compaction_due.set()
+        logger.info(f"Appended {len(records)} changes to {model_name} gallery generation {current.generation} "
+                    f"({len(view)} embeddings, {view.delta_count} pending compaction)")
+        return current.generation
+
+    def compact(self, model_name: str) -> int:
+        """Fold the current delta file into a new generation and swap it in"""
+        os.makedirs(self.gallery_dir, exist_ok=True)
+        conn = sqlite3.connect(self.database_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = self._refresh(model_name, self._views.get(model_name))
+                if current is None or current.delta_count == 0:
+                    conn.execute("ROLLBACK")
+                    return current.generation if current is not None else 0
+
+                generation = self._next_generation(conn, model_name)
+                order = np.argsort(current.ids, kind="stable")
+                matrix = current.matrix[order] if len(current) else np.zeros((0, current.dim), dtype=np.float32)
+                self._write(model_name, generation, current.ids[order], current.raw_student_ids[order],
+                            matrix, current.high_water)
+                self._publish(model_name, generation)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            conn.close()
+
+        self.view(model_name)
+        self._remove_stale(model_name, generation)
+        logger.info(f"Compacted {model_name} gallery into generation {generation} "
+                    f"({len(current)} embeddings, {current.delta_count} changes folded in)")
+        return generation
+
+    def needs_compaction(self, view: GalleryView) -> bool:
+        """Whether a view's delta is large enough to fold into a new snapshot"""
+        return view.delta_count >= max(COMPACT_MIN_CHANGES, COMPACT_RATIO * view._base_count)
+
+    def start_compaction(self, interval: float) -> threading.Thread:
+        """Compact loaded models in a daemon thread, every interval or as soon as a delta grows large"""
+        def run():
+            while not self._stop_compaction.is_set():
+                self._compaction_due.wait(interval)
+                self._compaction_due.clear()
+                if self._stop_compaction.is_set():
+                    break
+                for model_name in list(self._views):
+                    try:
+                        if self.needs_compaction(self.view(model_name)):
+                            self.compact(model_name)
+                    except Exception as e:
+                        logger.warning(f"Gallery compaction for {model_name} failed: {e}")
+
+        self._stop_compaction.clear()
+        thread = threading.Thread(target=run, name="gallery-compaction", daemon=True)
+        thread.start()
+        return thread
+
+    def stop_compaction(self) -> None:
+        self._stop_compaction.set()
+        self._compaction_due.set()
+
+    def latest_change(self) -> int:
+        """Newest change-log sequence number (an O(log n) rowid lookup)"""
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            return self._latest_change(conn)
+        finally:
+            conn.close()
+
+    def _latest_change(self, conn: sqlite3.Connection) -> int:
+        return conn.execute(
+            "SELECT COALESCE(MAX(change_id), 0) FROM photo_face_enrollment_changes"
+        ).fetchone()[0]
+
+    def sync(self, model_name: str) -> GalleryView:
+        """Apply enrollment changes made by any writer, including the Node backend"""
+        view = self.view(model_name)
+        if self.latest_change() > view.high_water:
+            self.update(model_name)
+            view = self.view(model_name)
+        return view
+
+    def start_sync(self, interval: float) -> threading.Thread:
+        """Poll the change log in a daemon thread and sync every loaded model"""
+        def poll():
+            while not self._stop_sync.wait(interval):
+                for model_name in list(self._views):
+                    try:
+                        self.sync(model_name)
+                    except Exception as e:
+                        logger.warning(f"Gallery sync for {model_name} failed: {e}")
+
+        self._stop_sync.clear()
+        thread = threading.Thread(target=poll, name="gallery-sync", daemon=True)
+        thread.start()
+        return thread
+
+    def stop_sync(self) -> None:
+        self._stop_sync.set()
+
+    def _next_generation(self, conn: sqlite3.Connection, model_name: str) -> int:
+        """Allocate a model's next generation number (caller holds the write lock)"""
+        conn.execute(
+            "INSERT OR IGNORE INTO face_gallery_state (model_name, generation) VALUES (?, 0)",
+            (model_name,)
+        )
+        conn.execute(
+            "UPDATE face_gallery_state SET generation = generation + 1 WHERE model_name = ?",
+            (model_name,)
+        )
+        return conn.execute(
+            "SELECT generation FROM face_gallery_state WHERE model_name = ?",
+            (model_name,)
+        ).fetchone()[0]
+
+    def _publish(self, model_name: str, generation: int) -> None:
+        """Point readers at a written generation, while still holding the write lock so generations stay ordered"""
+        counter = self._counter(model_name)
+        counter[0] = generation
+        counter[1] = counter[1] + 1
+        counter.flush()
+
+    def _prune_change_log(self, conn: sqlite3.Connection) -> None:
+        """Prune old entries, always keeping the newest so MAX(change_id) stays accurate"""
+        conn.execute("""
+            DELETE FROM photo_face_enrollment_changes
+            WHERE changed_at < datetime('now', ?)
+              AND change_id < (SELECT MAX(change_id) FROM photo_face_enrollment_changes)
+        """, (f"-{CHANGE_LOG_RETENTION_DAYS} days",))
+
+    def _log_covers(self, conn: sqlite3.Connection, since: int) -> bool:
+        """Whether the change log still holds every entry after a snapshot"""
+        oldest = conn.execute("SELECT MIN(change_id) FROM photo_face_enrollment_changes").fetchone()[0]
+        return oldest is None or oldest <= since + 1
+
+    def _change_records(self, conn: sqlite3.Connection, view: GalleryView, high_water: int) -> np.ndarray:
+        """Delta records replacing changed rows in a view with their current active versions"""
+        changed_ids = [row[0] for row in conn.execute("""
+            SELECT DISTINCT enrollment_id
+            FROM photo_face_enrollment_changes
+            WHERE change_id > ? AND change_id <= ? AND model_name = ?
+        """, (view.high_water, high_water, view.model_name))]
+
+        rows = []
+        for start in range(0, len(changed_ids), SQLITE_PARAM_BATCH):
+            batch = changed_ids[start:start + SQLITE_PARAM_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows.extend(conn.execute(f"""
+                SELECT id, student_id, deepface_embedding
+                FROM photo_face_enrollments
+                WHERE id IN ({placeholders}) AND is_active = 1 AND model_name = ?
+                ORDER BY id
+            """, (*batch, view.model_name)).fetchall())
+        new_ids, new_student_ids, new_matrix = parse_embedding_rows(rows)
+
+        if new_ids and len(view) and new_matrix.shape[1] != view.dim:
+            raise ValueError(f"New {view.model_name} embeddings do not match gallery size {view.dim}")
+        dim = new_matrix.shape[1] if new_ids else view.dim
+        if not dim:
+            # Nothing to delete from an empty gallery and nothing to add
+            return np.zeros(0, dtype=delta_record_dtype(0))
+
+        records = np.zeros(len(changed_ids) + len(new_ids), dtype=delta_record_dtype(dim))
+        records["op"][:len(changed_ids)] = DELTA_DELETE
+        records["id"][:len(changed_ids)] = changed_ids
+        records["op"][len(changed_ids):] = DELTA_ADD
+        records["id"][len(changed_ids):] = new_ids
+        records["student_id"][len(changed_ids):] = [sid.encode("utf-8") for sid in new_student_ids]
+        if new_ids:
+            records["vector"][len(changed_ids):] = new_matrix
+        return records
+
+    def _remove_stale(self, model_name: str, generation: int) -> None:
+        """Delete generation and delta files older than the previous generation"""
+        prefix = f"{model_name}."
+        for name in os.listdir(self.gallery_dir):
+            if not name.startswith(prefix):
+                continue
+            stem, _, extension = name[len(prefix):].partition(".")
+            if extension not in ("bin", "delta"):
+                continue
+            try:
+                file_generation = int(stem)
+            except ValueError:
+                continue
+            if file_generation < generation - 1:
+                try:
+                    os.remove(os.path.join(self.gallery_dir, name))
+                except OSError:
+                    # Still mapped by a worker on platforms that lock mapped files
+                    pass
@@ -0,0 +1,578 @@
+"""Load test for the face API with a fake DeepFace model.
+
+No model weights are needed: the server runs main.py with the DeepFace
+functions it calls (build_model, extract_faces, represent) replaced by
+FakeDeepFace, a deterministic embedder that sleeps for a configurable
+detection and embedding latency. What gets measured is everything around the
+model: uploads, the inference scheduler, SQLite and gallery matching.
+
+Every synthetic student has its own image. Frames of the same student embed
+close together and different students far apart, so verify and identify
+results are meaningful and their match rates are reported. Requests are sent
+open-loop at a fixed rate and latency is measured from each request's
+scheduled send time, so a saturated server can't hide its queueing.
+
+    python loadtest.py run --students 200 --rps 40 --duration 60 --mix verify=8,identify=1,enroll=1
+    python loadtest.py serve --port 8100 --workers 4 --detect-ms 40 --embed-ms 60
+    python loadtest.py run --url http://127.0.0.1:8100 --rps 100
+
+Without --url, run starts its own server on a fresh database in a temporary
+working directory. With --url and --transport embedding, set FACE_ADMIN_TOKEN
+to the server's token so the test can register its device.
+"""
+
+import argparse
+import functools
+import http.client
+import json
+import logging
+import os
+import random
+import secrets
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+import cv2
+import numpy as np
+
+from devices import sign
+
+logger = logging.getLogger(__name__)
+
+FRAME_WIDTH, FRAME_HEIGHT = 640, 480
+FRAME_VARIANTS = 3  # Distinct live frames per student; variant 0 is the enrollment photo
+FRAME_CACHE_SIZE = 512
+DESCRIPTOR_SIDE = 16  # The fake embedding is a random projection of a 16x16 thumbnail
+MODEL_DIMENSIONS = {"Facenet512": 512, "Facenet": 128, "VGG-Face": 4096, "OpenFace": 128, "DeepFace": 4096}
+DEFAULT_MIX = "verify=8,identify=1,enroll=1"
+DB_LOCKED = "database is locked"
+READY_TIMEOUT = 120.0
+
+# Enrollment table as created by the Node backend (backend/config/sqlite-database.js),
+# without the foreign key to its students table
+ENROLLMENTS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS photo_face_enrollments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        student_id TEXT NOT NULL,
+        photo_path TEXT NOT NULL,
+        photo_hash TEXT NOT NULL,
+        deepface_embedding TEXT NOT NULL,
+        face_confidence REAL NOT NULL,
+        photo_quality_score REAL NOT NULL,
+        enrollment_method TEXT DEFAULT 'photo_upload',
+        model_name TEXT DEFAULT 'Facenet512',
+        detector_backend TEXT DEFAULT 'opencv',
+        enrollment_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+        is_active BOOLEAN DEFAULT 1,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(student_id, model_name, photo_hash)
+    )
+"""
+
+
+class FakeDeepFace:
+    """Stand-in for the DeepFace functions main.py calls, with simulated model latency"""
+
+    def __init__(self, detect_ms: float = 30.0, embed_ms: float = 50.0, jitter: float = 0.2):
+        self.detect_ms = detect_ms
+        self.embed_ms = embed_ms
+        self.jitter = jitter
+        self._projections: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _sleep(self, milliseconds: float) -> None:
+        if milliseconds > 0:
+            time.sleep(milliseconds * random.uniform(1 - self.jitter, 1 + self.jitter) / 1000)
+
+    def _projection(self, model_name: str) -> np.ndarray:
+        with self._lock:
+            if model_name not in self._projections:
+                rng = np.random.default_rng(zlib.crc32(model_name.encode("utf-8")))
+                dimensions = MODEL_DIMENSIONS.get(model_name, 512)
+                self._projections[model_name] = rng.standard_normal((DESCRIPTOR_SIDE ** 2, dimensions)).astype(np.float32)
+            return self._projections[model_name]
+
+    @staticmethod
+    def _load(img_path: Any) -> np.ndarray:
+        image = cv2.imread(img_path) if isinstance(img_path, str) else np.asarray(img_path)
+        if image is None:
+            raise ValueError(f"Failed to load image {img_path}")
+        return image
+
+    @staticmethod
+    def _facial_area(image: np.ndarray) -> Dict[str, int]:
+        height, width = image.shape[:2]
+        return {"x": 0, "y": 0, "w": width, "h": height}
+
+    def build_model(self, model_name: str) -> "FakeDeepFace":
+        self._projection(model_name)
+        return self
+
+    def extract_faces(self, img_path: Any, detector_backend: str = "opencv", enforce_detection: bool = True,
+                      align: bool = True, **kwargs) -> List[Dict[str, Any]]:
+        self._sleep(self.detect_ms)
+        image = self._load(img_path)
+        face = cv2.resize(image, (224, 224), interpolation=cv2.INTER_AREA)
+        return [{
+            "face": cv2.cvtColor(face, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0,
+            "facial_area": self._facial_area(image),
+            "confidence": 1.0,
+        }]
+
+    def represent(self, img_path: Any, model_name: str = "VGG-Face", detector_backend: str = "opencv",
+                  enforce_detection: bool = True, **kwargs) -> List[Dict[str, Any]]:
+        self._sleep(self.embed_ms)
+        image = self._load(img_path)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        descriptor = cv2.resize(gray, (DESCRIPTOR_SIDE, DESCRIPTOR_SIDE), interpolation=cv2.INTER_AREA)
+        descriptor = descriptor.astype(np.float32).ravel()
+        descriptor -= descriptor.mean()
+        descriptor /= np.linalg.norm(descriptor) + 1e-6
+        return [{
+            "embedding": (descriptor @ self._projection(model_name)).tolist(),
+            "facial_area": self._facial_area(image),
+            "face_confidence": 1.0,
+        }]
+
+
+def create_app():
+    """uvicorn app factory: main.app with FakeDeepFace installed, configured from FACE_FAKE_* variables"""
+    fake = FakeDeepFace(
+        detect_ms=float(os.environ.get("FACE_FAKE_DETECT_MS", "30")),
+        embed_ms=float(os.environ.get("FACE_FAKE_EMBED_MS", "50")),
+        jitter=float(os.environ.get("FACE_FAKE_JITTER", "0.2")),
+    )
+    # Registered before main is imported so the real package (and its weights) is never loaded
+    module = types.ModuleType("deepface")
+    module.DeepFace = fake
+    sys.modules["deepface"] = module
+
+    import main
+    main.DeepFace = fake
+    return main.app
+
+
+@functools.lru_cache(maxsize=FRAME_CACHE_SIZE)
+def student_frame(index: int, variant: int) -> bytes:
+    """JPEG frame of a synthetic student: a symmetric face-sized pattern plus per-frame noise"""
+    rng = np.random.default_rng(index)
+    half = rng.random((12, 8))
+    pattern = cv2.resize(np.hstack([half, half[:, ::-1]]).astype(np.float32), (FRAME_WIDTH, FRAME_HEIGHT),
+                         interpolation=cv2.INTER_CUBIC)
+    texture = rng.random((FRAME_HEIGHT, FRAME_WIDTH // 2)).astype(np.float32)
+    texture = np.hstack([texture, texture[:, ::-1]])
+    noise = np.random.default_rng([index, variant]).normal(0, 0.04, (FRAME_HEIGHT, FRAME_WIDTH)).astype(np.float32)
+    gray = np.clip((0.2 + 0.55 * pattern + 0.2 * texture + noise) * 255, 0, 255).astype(np.uint8)
+    ok, encoded = cv2.imencode(".jpg", cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), [cv2.IMWRITE_JPEG_QUALITY, 90])
+    if not ok:
+        raise ValueError("Failed to encode frame")
+    return encoded.tobytes()
+
+
+@functools.lru_cache(maxsize=FRAME_CACHE_SIZE)
+def frame_embedding(index: int, variant: int, model_name: str) -> bytes:
+    """What a kiosk running the model itself would upload for a frame: float32 embedding bytes"""
+    image = cv2.imdecode(np.frombuffer(student_frame(index, variant), dtype=np.uint8), cv2.IMREAD_COLOR)
+    embedding = FakeDeepFace(0, 0, 0).represent(image, model_name)[0]["embedding"]
+    return np.asarray(embedding, dtype="<f4").tobytes()
+
+
+def multipart_body(fields: Dict[str, str], photo: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8"))
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="photo"; filename="frame.jpg"\r\n'
+                 f'Content-Type: image/jpeg\r\n\r\n'.encode("utf-8"))
+    parts.append(photo)
+    parts.append(f"\r\n--{boundary}--\r\n".encode("utf-8"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class Client:
+    """One keep-alive HTTP connection per sending thread"""
+
+    def __init__(self, url: str, timeout: float):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "127.0.0.1"
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: Optional[bytes] = None,
+                headers: Optional[Dict[str, str]] = None) -> Tuple[int, bytes]:
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            reused = connection is not None
+            if connection is None:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                self._local.connection = connection
+            try:
+                connection.request(method, path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                return response.status, response.read()
+            except Exception as e:
+                connection.close()
+                self._local.connection = None
+                # The server closes idle keep-alive connections; retry those once on a new one
+                stale = isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError))
+                if not (stale and reused) or attempt:
+                    raise
+
+    def get_json(self, path: str) -> Dict[str, Any]:
+        status, body = self.request("GET", path)
+        if status != 200:
+            raise RuntimeError(f"GET {path} returned {status}")
+        return json.loads(body)
+
+
+class Workload:
+    """Synthetic students and the requests sent for them"""
+
+    def __init__(self, client: Client, students: int, model_name: str, seed: int, transport: str = "multipart"):
+        self.client = client
+        self.transport = transport
+        self.students = students
+        self.model_name = model_name
+        self.prefix = f"LT{uuid.uuid4().hex[:6]}"  # Unique per run, so reruns against one server don't collide
+        self.rng = random.Random(seed)
+        self.device: Optional[Dict[str, Any]] = None  # Registered kiosk for the embedding transport
+        self._next_student = students
+
+    def student_id(self, index: int) -> str:
+        return f"{self.prefix}-{index:06d}"
+
+    def plan(self, op: str) -> Dict[str, Any]:
+        """Choose the student and frame for one request (called from the scheduling thread only)"""
+        if op == "enroll":
+            index, self._next_student = self._next_student, self._next_student + 1
+            return {"op": op, "index": index, "variant": 0}
+        return {"op": op, "index": self.rng.randrange(self.students), "variant": self.rng.randrange(1, FRAME_VARIANTS)}
+
+    def send(self, request: Dict[str, Any], scheduled: float) -> Dict[str, Any]:
+        op, index = request["op"], request["index"]
+        photo = student_frame(index, request["variant"]) if request["variant"] else _enrollment_frame(index)
+        fields = {"model_name": self.model_name}
+        if op != "identify":
+            fields["student_id"] = self.student_id(index)
+        headers = {}
+        if self.transport == "raw" and op != "enroll":
+            path, body, headers["Content-Type"] = f"/api/face/{op}/raw?{urlencode(fields)}", photo, "image/jpeg"
+        elif self.transport == "embedding" and op != "enroll":
+            path, query = f"/api/face/{op}/embedding", urlencode(fields)
+            body = frame_embedding(index, request["variant"], self.model_name)
+            timestamp = f"{time.time():.6f}"
+            headers.update({
+                "Content-Type": "application/octet-stream",
+                "X-Device-Id": self.device["device_id"],
+                "X-Device-Timestamp": timestamp,
+                "X-Device-Signature": sign(self.device["secret"], self.device["device_id"], timestamp, path, query, body),
+            })
+            path = f"{path}?{query}"
+        else:
+            body, headers["Content-Type"] = multipart_body(fields, photo)
+            path = f"/api/face/{op}"
+
+        sent = time.perf_counter()
+        result = {"op": op, "outcome": "ok", "matched": None}
+        try:
+            status, response = self.client.request("POST", path, body, headers)
+        except socket.timeout:
+            result["outcome"] = "timeout"
+        except (OSError, http.client.HTTPException) as e:
+            result["outcome"] = "connection_error"
+            logger.debug(f"{op} failed: {e}")
+        else:
+            if status != 200:
+                result["outcome"] = "db_locked" if DB_LOCKED in response.decode("utf-8", "replace").lower() else f"http_{status}"
+            elif op == "verify":
+                result["matched"] = bool(json.loads(response).get("verified"))
+            elif op == "identify":
+                result["matched"] = json.loads(response).get("student_id") == self.student_id(index)
+        finished = time.perf_counter()
+        result["latency_ms"] = (finished - scheduled) * 1000
+        result["service_ms"] = (finished - sent) * 1000
+        result["finished"] = finished
+        return result
+
+
+def _enrollment_frame(index: int) -> bytes:
+    # Enrollment photos are sent once each, so they bypass the frame cache
+    return student_frame.__wrapped__(index, 0)
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(","):
+        op, _, weight = item.partition("=")
+        op = op.strip()
+        if op not in ("enroll", "verify", "identify"):
+            raise argparse.ArgumentTypeError(f"Unknown operation in mix: {op}")
+        weights[op] = float(weight or 1)
+    return weights
+
+
+def seed_students(workload: Workload, concurrency: int) -> List[Dict[str, Any]]:
+    """Enroll the base students that verify and identify requests pick from"""
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(
+            lambda index: workload.send({"op": "enroll", "index": index, "variant": 0}, time.perf_counter()),
+            range(workload.students)
+        ))
+
+
+def run_load(workload: Workload, mix: Dict[str, float], rps: float, duration: float,
+             concurrency: int) -> Tuple[List[Dict[str, Any]], float]:
+    """Send requests open-loop at rps for duration seconds; returns results and elapsed seconds"""
+    ops, weights = list(mix), list(mix.values())
+    futures = []
+    with ThreadPoolExecutor(concurrency) as pool:
+        started = time.perf_counter()
+        for i in range(int(rps * duration)):
+            scheduled = started + i / rps
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            request = workload.plan(workload.rng.choices(ops, weights)[0])
+            futures.append(pool.submit(workload.send, request, scheduled))
+        results = [future.result() for future in futures]
+    elapsed = max((result["finished"] for result in results), default=started) - started
+    return results, elapsed
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    summary = {}
+    for op in sorted({result["op"] for result in results}):
+        op_results = [result for result in results if result["op"] == op]
+        latencies = np.array([result["latency_ms"] for result in op_results])
+        outcomes: Dict[str, int] = {}
+        for result in op_results:
+            outcomes[result["outcome"]] = outcomes.get(result["outcome"], 0) + 1
+        matched = [result["matched"] for result in op_results if result["matched"] is not None]
+        ok = outcomes.pop("ok", 0)
+        summary[op] = {
+            "requests": len(op_results),
+            "ok": ok,
+            "throughput_rps": round(ok / elapsed, 2) if elapsed else None,
+            "latency_ms": {
+                "p50": round(float(np.percentile(latencies, 50)), 1),
+                "p90": round(float(np.percentile(latencies, 90)), 1),
+                "p99": round(float(np.percentile(latencies, 99)), 1),
+                "max": round(float(latencies.max()), 1),
+            },
+            "service_p99_ms": round(float(np.percentile([result["service_ms"] for result in op_results], 99)), 1),
+            "errors": outcomes,
+            "match_rate": round(sum(matched) / len(matched), 4) if matched else None,
+        }
+    return summary
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{report['requests']} requests in {report['elapsed_seconds']:.1f}s "
+          f"(target {report['target_rps']} rps, achieved {report['throughput_rps']} rps ok)")
+    print(f"{'op':<10}{'sent':>7}{'ok':>7}{'rps':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'match':>8}  errors")
+    for op, stats in report["operations"].items():
+        latency = stats["latency_ms"]
+        match = f"{stats['match_rate']:.3f}" if stats["match_rate"] is not None else "-"
+        errors = ", ".join(f"{kind}={count}" for kind, count in stats["errors"].items()) or "-"
+        print(f"{op:<10}{stats['requests']:>7}{stats['ok']:>7}{stats['throughput_rps']:>8}"
+              f"{latency['p50']:>9}{latency['p90']:>9}{latency['p99']:>9}{latency['max']:>9}{match:>8}  {errors}")
+    print(f"Database lock errors: {report['db_locked']}")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(client: Client, server: Optional[subprocess.Popen], log_path: Optional[str]) -> None:
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            with open(log_path) as f:
+                raise RuntimeError(f"Server exited with {server.returncode}:\n{f.read()[-4000:]}")
+        try:
+            if client.request("GET", "/")[0] == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Server not ready after {READY_TIMEOUT:.0f}s")
+
+
+def start_server(args: argparse.Namespace, port: int) -> Tuple[subprocess.Popen, str]:
+    """Start `loadtest.py serve` under args.workdir, on a copy of args.database or a fresh database"""
+    # main.py keeps its database at ../backend/database relative to its working directory
+    cwd = os.path.join(args.workdir, "python-backend")
+    database_dir = os.path.join(args.workdir, "backend", "database")
+    os.makedirs(cwd, exist_ok=True)
+    os.makedirs(database_dir, exist_ok=True)
+    database_path = os.path.join(database_dir, "attendance.db")
+    if args.database:
+        shutil.copyfile(args.database, database_path)
+    conn = sqlite3.connect(database_path)
+    try:
+        conn.execute(ENROLLMENTS_SCHEMA)
+        conn.commit()
+    finally:
+        conn.close()
+
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [script_dir, env.get("PYTHONPATH")]))
+    env["FACE_ADMIN_TOKEN"] = args.admin_token  # To register the embedding transport's device
+    env.setdefault("FACE_VERIFY_CACHE_TTL", "0")  # Measure inference, not cache hits, unless asked to
+
+    log_path = os.path.join(args.workdir, "server.log")
+    command = [
+        sys.executable, os.path.join(script_dir, "loadtest.py"), "serve",
+        "--port", str(port), "--workers", str(args.workers),
+        "--detect-ms", str(args.detect_ms), "--embed-ms", str(args.embed_ms), "--jitter", str(args.jitter),
+    ]
+    with open(log_path, "w") as log:
+        server = subprocess.Popen(command, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return server, log_path
+
+
+def run(args: argparse.Namespace) -> None:
+    mix = parse_mix(args.mix)
+    server = None
+    temporary_workdir = not args.url and not args.workdir
+    args.admin_token = os.environ.get("FACE_ADMIN_TOKEN") or secrets.token_hex(16)
+    if temporary_workdir:
+        args.workdir = tempfile.mkdtemp(prefix="face-loadtest-")
+
+    try:
+        if args.url:
+            client = Client(args.url, args.timeout)
+            log_path = None
+        else:
+            port = free_port()
+            server, log_path = start_server(args, port)
+            client = Client(f"http://127.0.0.1:{port}", args.timeout)
+            logger.info(f"Server starting in {args.workdir} (log: {log_path})")
+        wait_until_ready(client, server, log_path)
+
+        workload = Workload(client, args.students, args.model, args.seed, args.transport)
+        if args.transport == "embedding":
+            status, body = client.request("POST", "/api/face/admin/devices", urlencode({"name": "loadtest"}).encode("utf-8"),
+                                          {"Content-Type": "application/x-www-form-urlencoded",
+                                           "X-Admin-Token": args.admin_token})
+            if status != 200:
+                raise RuntimeError(f"Could not register a device: {status} {body[:200]!r}")
+            workload.device = json.loads(body)
+        started = time.perf_counter()
+        seeded = seed_students(workload, args.concurrency)
+        enrolled = sum(result["outcome"] == "ok" for result in seeded)
+        logger.info(f"Enrolled {enrolled}/{args.students} students in {time.perf_counter() - started:.1f}s")
+        if enrolled < args.students:
+            failures = {result["outcome"] for result in seeded if result["outcome"] != "ok"}
+            logger.warning(f"Seeding errors: {', '.join(sorted(failures))}")
+        if not enrolled and set(mix) - {"enroll"}:
+            raise RuntimeError("No students enrolled; verify and identify would all fail")
+
+        logger.info(f"Sending {args.rps} rps for {args.duration}s with up to {args.concurrency} concurrent requests")
+        results, elapsed = run_load(workload, mix, args.rps, args.duration, args.concurrency)
+        operations = summarize(results, elapsed)
+        report = {
+            "requests": len(results),
+            "elapsed_seconds": round(elapsed, 3),
+            "target_rps": args.rps,
+            "throughput_rps": round(sum(stats["ok"] for stats in operations.values()) / elapsed, 2) if elapsed else None,
+            "concurrency": args.concurrency,
+            "transport": args.transport,
+            "students": args.students,
+            "seeded": enrolled,
+            "fake_model": None if args.url else {"detect_ms": args.detect_ms, "embed_ms": args.embed_ms,
+                                                 "workers": args.workers},
+            "db_locked": sum(stats["errors"].get("db_locked", 0) for stats in operations.values()),
+            "operations": operations,
+        }
+        try:
+            report["server_metrics"] = client.get_json("/api/face/metrics")
+        except (OSError, RuntimeError, ValueError) as e:
+            logger.warning(f"Could not read server metrics: {e}")
+
+        print_report(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if server is not None:
+            server.terminate()
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        if temporary_workdir and not args.keep_workdir:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+
+def serve(args: argparse.Namespace) -> None:
+    import uvicorn
+
+    os.environ["FACE_FAKE_DETECT_MS"] = str(args.detect_ms)
+    os.environ["FACE_FAKE_EMBED_MS"] = str(args.embed_ms)
+    os.environ["FACE_FAKE_JITTER"] = str(args.jitter)
+    uvicorn.run("loadtest:create_app", factory=True, host=args.host, port=args.port,
+                workers=args.workers, log_level="warning")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the face API with a fake DeepFace model")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def fake_model_options(command: argparse.ArgumentParser) -> None:
+        command.add_argument("--workers", type=int, default=1, help="Server worker processes")
+        command.add_argument("--detect-ms", type=float, default=30.0, help="Simulated face detection time")
+        command.add_argument("--embed-ms", type=float, default=50.0, help="Simulated embedding time")
+        command.add_argument("--jitter", type=float, default=0.2, help="Relative random variation of both")
+
+    run_command = commands.add_parser("run", help="Seed students and drive the API at a target rate")
+    run_command.add_argument("--url", help="Test an already running server instead of starting one")
+    run_command.add_argument("--workdir", help="Server working directory (default: a temporary one)")
+    run_command.add_argument("--keep-workdir", action="store_true")
+    run_command.add_argument("--database", help="Copy this database for the server, e.g. to test a large gallery")
+    run_command.add_argument("--students", type=int, default=200)
+    run_command.add_argument("--rps", type=float, default=20.0)
+    run_command.add_argument("--duration", type=float, default=30.0, help="Seconds")
+    run_command.add_argument("--concurrency", type=int, default=32, help="Maximum requests in flight")
+    run_command.add_argument("--mix", default=DEFAULT_MIX, help="Relative weights of enroll, verify and identify")
+    run_command.add_argument("--model", default="Facenet512")
+    run_command.add_argument("--transport", choices=["multipart", "raw", "embedding"], default="multipart",
+                             help="Send verify/identify frames as multipart forms, raw JPEG bodies, "
+                                  "or signed precomputed embeddings")
+    run_command.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    run_command.add_argument("--seed", type=int, default=0)
+    run_command.add_argument("--json", help="Also write the report to this file")
+    fake_model_options(run_command)
+
+    serve_command = commands.add_parser("serve", help="Run main.py with the fake model")
+    serve_command.add_argument("--host", default="127.0.0.1")
+    serve_command.add_argument("--port", type=int, default=8100)
+    fake_model_options(serve_command)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "run":
+        run(args)
+    else:
+        serve(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import cv2
 import numpy as np
 import sqlite3
@@ -10,15 +11,32 @@ from PIL import Image
 import io
 import os
 import hashlib
+import hmac
 import aiofiles
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, Union
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
 from deepface import DeepFace
 import tensorflow as tf
 from sklearn.metrics.pairwise import cosine_similarity
 import matplotlib.pyplot as plt
+from gallery import SharedGallery, GALLERY_SCHEMA, CHANGE_TRIGGERS
+from enrollment_jobs import EnrollmentJobQueue, JOBS_SCHEMA as ENROLLMENT_JOBS_SCHEMA
+from scheduler import InferenceScheduler, VERIFY, ENROLL, MAINTENANCE
+from reembed import ReembeddingJob, job_key as reembedding_job_key, read_checkpoint as read_reembedding_checkpoint
+from migrate import enrollments_keyed_per_photo
+from budget import RequestBudget, DeadlineExceeded
+from profiling import SlowRequestProfiler
+from photo_store import PhotoStore, THUMBNAIL
+from face_quality import assess_face_quality
+from calibrate import CalibrationJob, MIN_GENUINE_PAIRS, StudentThresholds, latest_run
+from audit import AuditJob, read_status as read_audit_status
+from verify_cache import VerificationCache
+from devices import DeviceAuthError, DeviceRegistry, add_device, list_devices, revoke_device
+from projection import METHODS as PROJECTION_METHODS, ProjectionJob, check_dim as check_projection_dim, ProjectionRegistry, active_projection, disable_projections
+from presence import PresenceCache, IF_PRESENT_CHOICES, IF_PRESENT_VERIFY, IF_PRESENT_SKIP, IF_PRESENT_DOWNGRADE
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,6 +46,12 @@ logger = logging.getLogger(__name__)
 tf.get_logger().setLevel('ERROR')
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 
+# Limit TensorFlow threads per process when running several inference workers
+INFERENCE_THREADS = int(os.environ.get("FACE_INFERENCE_THREADS", "0"))
+if INFERENCE_THREADS > 0:
+    tf.config.threading.set_intra_op_parallelism_threads(INFERENCE_THREADS)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
@@ -43,10 +67,35 @@ async def lifespan(app: FastAPI):
         init_database()
         logger.info("Database initialized successfully")
         
+        # Map the gallery snapshot, apply changes logged since it was written
+        # and keep polling the change log for writes from other services
+        try:
+            gallery_view = gallery.sync(DEFAULT_MODEL)
+            logger.info(f"Embedding gallery ready: {len(gallery_view)} embeddings (generation {gallery_view.generation})")
+            projection = projections.warm(DEFAULT_MODEL)
+            if projection is not None:
+                logger.info(f"Identification projection ready: version {projection.version} ({projection.dim}-D)")
+        except sqlite3.OperationalError as e:
+            # No enrollments table yet; the gallery is built on first use once it exists
+            logger.warning(f"Embedding gallery not loaded, starting empty: {e}")
+        gallery.start_sync(GALLERY_SYNC_INTERVAL)
+        gallery.start_compaction(GALLERY_COMPACT_INTERVAL)
+        
+        # Calibrated per-student thresholds, so the first verification doesn't load them
+        logger.info(f"Per-student thresholds loaded: {student_thresholds.warm(DEFAULT_MODEL)} students")
+        
+        # Students already marked present today, so repeat verifications can be skipped
+        logger.info(f"Presence cache ready: {presence.warm()} students present today")
+        
         # Create uploads directory
         os.makedirs("uploads/photos", exist_ok=True)
+        os.makedirs(ENROLLMENT_JOB_DIR, exist_ok=True)
         logger.info("Upload directories created")
         
+        # Resume queued enrollment jobs
+        enrollment_jobs.start()
+        logger.info(f"Enrollment job workers started ({ENROLLMENT_JOB_WORKERS})")
+        
         logger.info("DeepFace Face Recognition API started successfully")
     except Exception as e:
         logger.error(f"Failed to initialize: {e}")
@@ -55,6 +104,11 @@ async def lifespan(app: FastAPI):
     yield
     
     # Shutdown
+    enrollment_jobs.stop()
+    if reembedding_job:
+        reembedding_job.stop()
+    gallery.stop_sync()
+    gallery.stop_compaction()
     logger.info("DeepFace Face Recognition API shutting down")
 
 app = FastAPI(title="DeepFace Face Recognition API", version="2.0.0", lifespan=lifespan)
@@ -76,6 +130,78 @@ DEFAULT_MODEL = "Facenet512"
 DETECTOR_BACKEND = "opencv"
 SIMILARITY_THRESHOLD = 0.92  # Cosine similarity threshold (0.92+ for very high security and accuracy)
 CONFIDENCE_THRESHOLD = 0.8  # Face detection confidence threshold
+GALLERY_DIR = os.environ.get("FACE_GALLERY_DIR", "gallery")
+GALLERY_SYNC_INTERVAL = float(os.environ.get("FACE_GALLERY_SYNC_INTERVAL", "2.0"))  # Seconds between change-log polls
+GALLERY_COMPACT_INTERVAL = float(os.environ.get("FACE_GALLERY_COMPACT_INTERVAL", "30"))  # Seconds between compaction checks
+VERIFICATION_THRESHOLD = 0.6  # Default cosine similarity threshold for 1:1 verification and identification
+FACE_QUALITY_MIN = float(os.environ.get("FACE_QUALITY_MIN", "0"))  # Reject live frames whose face crop scores lower (0 = off until tuned on your cameras)
+VERIFY_CACHE_TTL = float(os.environ.get("FACE_VERIFY_CACHE_TTL", "10"))  # Seconds a verify frame's embedding is reused (0 = off)
+PROJECTION_CANDIDATES = int(os.environ.get("FACE_PROJECTION_CANDIDATES", "64"))  # Rows re-ranked at full size when a projection is active
+PRESENCE_REFRESH_INTERVAL = float(os.environ.get("FACE_PRESENCE_REFRESH_INTERVAL", "30"))  # Seconds between daily_attendance reloads
+VERIFY_CACHE_HASH_DISTANCE = int(os.environ.get("FACE_VERIFY_CACHE_HASH_DISTANCE", "4"))  # dHash bits for near-identical frames (-1 = exact only)
+RAW_IMAGE_MAX_BYTES = int(os.environ.get("FACE_RAW_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))  # Body cap for the raw image endpoints
+RAW_IMAGE_INITIAL_BYTES = 256 * 1024  # Starting buffer for raw bodies sent without Content-Length
+ADMIN_TOKEN = os.environ.get("FACE_ADMIN_TOKEN", "")  # Required as X-Admin-Token by admin endpoints that expose secrets or internals
+EMBEDDING_MAX_BYTES = 4096 * 4  # Largest supported embedding (VGG-Face/DeepFace) as float32
+RELAXED_RETRY_MIN_MS = 300  # Skip relaxed detection/embedding retries with less time than this left
+INFERENCE_CONCURRENCY = int(os.environ.get("FACE_INFERENCE_CONCURRENCY", "2"))  # Concurrent DeepFace calls per process
+ENROLL_CONCURRENCY = int(os.environ.get("FACE_ENROLL_CONCURRENCY", "1"))
+MAINTENANCE_CONCURRENCY = int(os.environ.get("FACE_MAINTENANCE_CONCURRENCY", "1"))
+ENROLLMENT_JOB_DIR = "uploads/jobs"
+AUDIT_DIR = os.environ.get("FACE_AUDIT_DIR", "audits")
+PHOTO_STORE_DIR = os.environ.get("FACE_PHOTO_STORE_DIR", "uploads/store")
+KEEP_ORIGINAL_PHOTOS = os.environ.get("FACE_KEEP_ORIGINAL_PHOTOS", "0") == "1"  # Also store full-resolution uploads
+ENROLLMENT_LIST_PAGE_SIZE = 100  # Default page size for /api/face/enrollments
+ENROLLMENT_LIST_MAX_PAGE_SIZE = 1000
+ENROLLMENT_JOB_WORKERS = int(os.environ.get("FACE_ENROLLMENT_JOB_WORKERS", "1"))  # Per process, so verification keeps priority
+ENROLLMENT_JOB_RETENTION_HOURS = float(os.environ.get("FACE_ENROLLMENT_JOB_RETENTION_HOURS", "168"))  # Finished jobs kept for polling
+PROFILE_DIR = os.environ.get("FACE_PROFILE_DIR", "profiles")
+SLOW_REQUEST_MS = float(os.environ.get("FACE_SLOW_REQUEST_MS", "0"))  # Save a report for slower requests (0 = off)
+PROFILE_SAMPLE_RATE = float(os.environ.get("FACE_PROFILE_SAMPLE_RATE", "0.01"))  # Fraction of requests run under cProfile
+
+# Normalized embedding matrices shared read-only by all worker processes
+gallery = SharedGallery(DATABASE_PATH, GALLERY_DIR)
+
+# Enrollment photos: face crop + thumbnail per SHA-256, shared by identical uploads
+photo_store = PhotoStore(PHOTO_STORE_DIR, keep_originals=KEEP_ORIGINAL_PHOTOS)
+
+# Per-student verification thresholds from the offline calibration job (calibrate.py)
+student_thresholds = StudentThresholds(DATABASE_PATH)
+
+# Reduced-dimension projections for the coarse identification search (projection.py)
+projections = ProjectionRegistry(DATABASE_PATH, gallery=gallery)
+
+# Embedding results of recent verify frames, for retries that resend the same frame
+verify_cache = VerificationCache(VERIFY_CACHE_TTL, max_hash_distance=VERIFY_CACHE_HASH_DISTANCE)
+
+# Students present today (daily_attendance), for if_present=skip|downgrade on verify
+presence = PresenceCache(DATABASE_PATH, PRESENCE_REFRESH_INTERVAL)
+
+# Secrets of kiosks allowed to upload precomputed embeddings (devices.py)
+device_registry = DeviceRegistry(DATABASE_PATH)
+
+# Inference slots: verify/identify first, then enrollment, then background maintenance
+scheduler = InferenceScheduler(
+    INFERENCE_CONCURRENCY,
+    {ENROLL: ENROLL_CONCURRENCY, MAINTENANCE: MAINTENANCE_CONCURRENCY}
+)
+
+def run_maintenance(func: Callable[..., Any], *args) -> Any:
+    """Runner for background jobs: one maintenance slot per batch or tile, so enrollments interleave"""
+    return scheduler.run_sync(MAINTENANCE, func, *args)
+
+# Slow-request reports; the middleware is only installed when FACE_SLOW_REQUEST_MS is set
+slow_requests = SlowRequestProfiler(PROFILE_DIR, SLOW_REQUEST_MS, PROFILE_SAMPLE_RATE)
+
+async def capture_slow_requests(request, call_next):
+    """Save the stage breakdown (and sampled profile) of requests above the latency threshold"""
+    with slow_requests.trace(request.method, request.url.path) as trace:
+        response = await call_next(request)
+        trace.status_code = response.status_code
+    return response
+
+if slow_requests.enabled:
+    app.middleware("http")(capture_slow_requests)
 
 def get_db_connection():
     """Get database connection to the main attendance database"""
@@ -99,8 +225,24 @@ def init_database():
             WHERE type='table' AND name='photo_face_enrollments'
         """)
         
-        if not cursor.fetchone():
+        enrollments_table_exists = cursor.fetchone() is not None
+        if not enrollments_table_exists:
             logger.warning("photo_face_enrollments table not found. Please run database reset script.")
+        elif not enrollments_keyed_per_photo(conn):
+            logger.warning("photo_face_enrollments is keyed per student; run `python migrate.py` before re-embedding")
+        
+        # Generation counter and change log for the shared embedding gallery
+        cursor.executescript(GALLERY_SCHEMA)
+        # Background enrollment jobs, persisted so a restart doesn't lose them
+        cursor.executescript(ENROLLMENT_JOBS_SCHEMA)
+        
+        if enrollments_table_exists:
+            # Listing by status/date and the per-student lookups in enroll, delete and verify
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_photo_enrollments_active_date ON photo_face_enrollments(is_active, enrollment_date)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_photo_enrollments_student_id ON photo_face_enrollments(student_id)")
+            
+            cursor.executescript(CHANGE_TRIGGERS)
+        conn.commit()
         
         conn.close()
         logger.info("Database initialization completed")
@@ -182,27 +324,59 @@ def assess_photo_quality(image_path: str) -> Dict[str, Any]:
         logger.error(f"Photo quality assessment failed: {e}")
         return {"quality_score": 0.0, "issues": [f"Quality assessment failed: {str(e)}"]}
 
-def extract_face_embedding(image_path: str, model_name: str = DEFAULT_MODEL) -> Dict[str, Any]:
-    """Extract face embedding using DeepFace with improved error handling"""
+def timed_out_result(stage: str) -> Dict[str, Any]:
+    """Embedding result for a request whose time budget ran out"""
+    return {
+        "success": False,
+        "timed_out": True,
+        "stage": stage,
+        "error": f"Time budget exhausted before {stage}. Please retry."
+    }
+
+def face_area(face_obj: Any) -> int:
+    """Pixel area of a detected face (DeepFace returns dicts or bare arrays depending on version)"""
+    if isinstance(face_obj, dict) and face_obj.get("facial_area"):
+        return face_obj["facial_area"]["w"] * face_obj["facial_area"]["h"]
+    return face_obj.shape[0] * face_obj.shape[1] if hasattr(face_obj, 'shape') else 1
+
+def extract_face_embedding(
+    image_path: Union[str, np.ndarray],
+    model_name: str = DEFAULT_MODEL,
+    budget: Optional[RequestBudget] = None,
+    min_face_quality: float = 0.0
+) -> Dict[str, Any]:
+    """Extract face embedding using DeepFace with improved error handling.
+
+    image_path is a file path or an already decoded BGR image.
+    With a budget, the relaxed detection/embedding retries are skipped when
+    too little time is left, and each stage's duration is recorded. Faces whose
+    aligned crop scores below min_face_quality are rejected before embedding.
+    """
+    budget = budget or RequestBudget()
     try:
         # First, try with strict detection
         try:
-            face_objs = DeepFace.extract_faces(
-                img_path=image_path,
-                detector_backend=DETECTOR_BACKEND,
-                enforce_detection=True,
-                align=True
-            )
-        except Exception as strict_error:
-            # If strict detection fails, try with relaxed detection
-            logger.warning(f"Strict face detection failed, trying relaxed detection: {strict_error}")
-            try:
+            with budget.stage("detection"):
                 face_objs = DeepFace.extract_faces(
                     img_path=image_path,
                     detector_backend=DETECTOR_BACKEND,
-                    enforce_detection=False,
+                    enforce_detection=True,
                     align=True
                 )
+        except Exception as strict_error:
+            if not budget.allows(RELAXED_RETRY_MIN_MS):
+                return timed_out_result("relaxed_detection")
+            
+            # If strict detection fails, try with relaxed detection
+            logger.warning(f"Strict face detection failed, trying relaxed detection: {strict_error}")
+            try:
+                with budget.stage("relaxed_detection"):
+                    face_objs = DeepFace.extract_faces(
+                        img_path=image_path,
+                        detector_backend=DETECTOR_BACKEND,
+                        enforce_detection=False,
+                        align=True
+                    )
             except Exception as relaxed_error:
                 return {
                     "success": False, 
@@ -216,7 +390,7 @@ def extract_face_embedding(image_path: str, model_name: str = DEFAULT_MODEL) ->
             }
         
         # Get the largest face (most prominent)
-        largest_face = max(face_objs, key=lambda x: x.shape[0] * x.shape[1] if hasattr(x, 'shape') else 1)
+        largest_face = max(face_objs, key=face_area)
         
         # Calculate face confidence (area ratio)
         if hasattr(largest_face, 'shape'):
@@ -232,23 +406,43 @@ def extract_face_embedding(image_path: str, model_name: str = DEFAULT_MODEL) ->
                 "error": f"Face too small or unclear (confidence: {face_confidence:.3f}). Please use a larger, clearer image where the face occupies more of the frame."
             }
         
+        # Score the aligned crop itself, so a sharp background can't hide a blurry face
+        with budget.stage("face_quality"):
+            face_quality = assess_face_quality(largest_face)
+        if face_quality["quality_score"] < min_face_quality:
+            return {
+                "success": False,
+                "low_quality": True,
+                "face_quality": face_quality,
+                "error": f"Face quality too low ({face_quality['quality_score']:.2f}): "
+                         f"{'; '.join(face_quality['issues']) or 'unclear face'}. Please retry."
+            }
+        
+        if budget.expired():
+            return timed_out_result("embedding")
+        
         # Extract embedding with fallback
         try:
-            embedding = DeepFace.represent(
-                img_path=image_path,
-                model_name=model_name,
-                detector_backend=DETECTOR_BACKEND,
-                enforce_detection=True
-            )
+            with budget.stage("embedding"):
+                embedding = DeepFace.represent(
+                    img_path=image_path,
+                    model_name=model_name,
+                    detector_backend=DETECTOR_BACKEND,
+                    enforce_detection=True
+                )
         except Exception as embed_error:
+            if not budget.allows(RELAXED_RETRY_MIN_MS):
+                return timed_out_result("relaxed_embedding")
+            
             # Try with relaxed detection for embedding
             logger.warning(f"Strict embedding extraction failed, trying relaxed: {embed_error}")
-            embedding = DeepFace.represent(
-                img_path=image_path,
-                model_name=model_name,
-                detector_backend=DETECTOR_BACKEND,
-                enforce_detection=False
-            )
+            with budget.stage("relaxed_embedding"):
+                embedding = DeepFace.represent(
+                    img_path=image_path,
+                    model_name=model_name,
+                    detector_backend=DETECTOR_BACKEND,
+                    enforce_detection=False
+                )
         
         if not embedding:
             return {"success": False, "error": "Failed to extract face embedding"}
@@ -259,7 +453,9 @@ def extract_face_embedding(image_path: str, model_name: str = DEFAULT_MODEL) ->
         return {
             "success": True,
             "embedding": face_embedding,
+            "facial_area": embedding[0].get("facial_area"),
             "face_confidence": round(face_confidence, 3),
+            "face_quality": face_quality,
             "model_name": model_name,
             "detector_backend": DETECTOR_BACKEND,
             "embedding_size": len(face_embedding)
@@ -283,6 +479,18 @@ def calculate_similarity(embedding1: List[float], embedding2: List[float]) -> fl
         logger.error(f"Similarity calculation failed: {e}")
         return 0.0
 
+def has_active_enrollment(student_id: str) -> bool:
+    """Check whether a student has any active enrollment, for any model"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM photo_face_enrollments WHERE student_id = ? AND is_active = 1 LIMIT 1",
+            (student_id,)
+        ).fetchone()
+        return row is not None
+    finally:
+        conn.close()
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -310,25 +518,18 @@ async def enroll_face(
         if not photo.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Read and save photo
+        # Read the upload into a temporary file; only the face crop is kept on success
         photo_data = await photo.read()
         photo_hash = calculate_photo_hash(photo_data)
+        temp_photo_path = os.path.join(UPLOAD_DIR, f"temp_enroll_{student_id}_{os.getpid()}_{time.time_ns()}.jpg")
         
-        # Create unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{student_id}_{timestamp}_{photo_hash[:8]}.jpg"
-        photo_path = os.path.join(UPLOAD_DIR, filename)
-        
-        # Save photo to disk
-        async with aiofiles.open(photo_path, 'wb') as f:
+        async with aiofiles.open(temp_photo_path, 'wb') as f:
             await f.write(photo_data)
         
         # Assess photo quality
-        quality_assessment = assess_photo_quality(photo_path)
+        quality_assessment = assess_photo_quality(temp_photo_path)
         
         if quality_assessment["quality_score"] < 0.5:
-            # Clean up saved file
-            os.remove(photo_path)
             return JSONResponse(
                 status_code=400,
                 content={
@@ -339,11 +540,9 @@ async def enroll_face(
             )
         
         # Extract face embedding
-        embedding_result = extract_face_embedding(photo_path, model_name)
+        embedding_result = await scheduler.run(ENROLL, extract_face_embedding, temp_photo_path, model_name)
         
         if not embedding_result["success"]:
-            # Clean up saved file
-            os.remove(photo_path)
             return JSONResponse(
                 status_code=400,
                 content={
@@ -365,7 +564,6 @@ async def enroll_face(
         
         if existing:
             conn.close()
-            os.remove(photo_path)
             return JSONResponse(
                 status_code=409,  # Conflict status code is more appropriate
                 content={
@@ -379,34 +577,26 @@ async def enroll_face(
             )
 
         # Check for face uniqueness - prevent same face from being enrolled for different students
-        cursor.execute("""
-            SELECT student_id, deepface_embedding 
-            FROM photo_face_enrollments 
-            WHERE is_active = 1
-        """)
-        all_enrollments = cursor.fetchall()
-        
         new_embedding = embedding_result["embedding"]
-        
-        for enrollment in all_enrollments:
-            stored_embedding = json.loads(enrollment["deepface_embedding"])
-            similarity = calculate_similarity(new_embedding, stored_embedding)
-            
-            # If similarity is above threshold, this face is already enrolled
-            if similarity >= SIMILARITY_THRESHOLD:
-                conn.close()
-                os.remove(photo_path)
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": f"This face is already enrolled for student {enrollment['student_id']}. Each face can only be enrolled once.",
-                        "duplicate_student_id": enrollment["student_id"],
-                        "similarity_score": round(similarity, 3),
-                        "threshold_used": SIMILARITY_THRESHOLD
-                    }
-                )
+        duplicate = await run_in_threadpool(gallery.view(model_name).best_match, new_embedding)
+
+        # If similarity is above threshold, this face is already enrolled
+        if duplicate and duplicate["similarity"] >= SIMILARITY_THRESHOLD:
+            conn.close()
+            return JSONResponse(
+                status_code=400,
+                content={
+                    "success": False,
+                    "error": f"This face is already enrolled for student {duplicate['student_id']}. Each face can only be enrolled once.",
+                    "duplicate_student_id": duplicate["student_id"],
+                    "similarity_score": round(duplicate["similarity"], 3),
+                    "threshold_used": SIMILARITY_THRESHOLD
+                }
+            )
 
+        # Keep the face crop; the photo GC removes it if the insert below fails
+        photo_path = await run_in_threadpool(photo_store.put, photo_hash, photo_data, embedding_result.get("facial_area"))
+        
         # Store enrollment in database
         cursor.execute("""
             INSERT INTO photo_face_enrollments (
@@ -427,7 +617,10 @@ async def enroll_face(
         conn.commit()
         enrollment_id = cursor.lastrowid
         conn.close()
-        
+
+        # Publish the new embedding to every worker
+        await run_in_threadpool(gallery.update, model_name)
+
         logger.info(f"Successfully enrolled student {student_id} with enrollment ID {enrollment_id}")
         
         return {
@@ -442,39 +635,52 @@ async def enroll_face(
         
     except Exception as e:
         logger.error(f"Enrollment failed: {e}")
-        # Clean up photo if it was saved
-        if 'photo_path' in locals() and os.path.exists(photo_path):
-            os.remove(photo_path)
         raise HTTPException(status_code=500, detail=f"Enrollment failed: {str(e)}")
+    finally:
+        if 'temp_photo_path' in locals() and os.path.exists(temp_photo_path):
+            os.remove(temp_photo_path)
 
-@app.post("/api/face/enroll-multi")
-async def enroll_multi_face(
-    student_id: str = Form(...),
-    front_photo: UploadFile = File(...),
-    left_profile_photo: UploadFile = File(...),
-    right_profile_photo: UploadFile = File(...),
-    model_name: str = Form(DEFAULT_MODEL)
-):
-    """Enroll a student's face using three different angle photos (front, left profile, right profile)"""
-    saved_files = []
+async def read_multi_enrollment_photos(
+    front_photo: UploadFile,
+    left_profile_photo: UploadFile,
+    right_profile_photo: UploadFile,
+    model_name: str
+) -> List[Tuple[str, bytes]]:
+    """Validate the model and the three angle uploads, and read their bytes"""
+    # Validate model
+    if model_name not in SUPPORTED_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+
+    # Validate all file types
+    uploads = [
+        ("front", front_photo),
+        ("left_profile", left_profile_photo),
+        ("right_profile", right_profile_photo)
+    ]
+
+    for angle, photo in uploads:
+        if not photo.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail=f"{angle} photo must be an image")
+
+    return [(angle, await photo.read()) for angle, photo in uploads]
+
+def process_multi_enrollment(
+    student_id: str,
+    photos: List[Tuple[str, bytes]],
+    model_name: str = DEFAULT_MODEL,
+    progress: Optional[Callable[[str, str], None]] = None
+) -> Tuple[int, Dict[str, Any]]:
+    """Run the multi-angle enrollment pipeline on uploaded photo bytes.
+
+    Returns (status_code, response body). Used by the synchronous endpoint and
+    by the background enrollment job workers.
+    """
+    def report(angle: str, stage: str):
+        if progress:
+            progress(angle, stage)
+
+    temp_files = []
     try:
-        logger.info(f"Starting multi-photo enrollment for student {student_id}")
-        
-        # Validate model
-        if model_name not in SUPPORTED_MODELS:
-            raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
-        
-        # Validate all file types
-        photos = [
-            ("front", front_photo),
-            ("left_profile", left_profile_photo), 
-            ("right_profile", right_profile_photo)
-        ]
-        
-        for angle, photo in photos:
-            if not photo.content_type.startswith('image/'):
-                raise HTTPException(status_code=400, detail=f"{angle} photo must be an image")
-        
         # Check for existing enrollment
         conn = get_db_connection()
         cursor = conn.cursor()
@@ -487,17 +693,14 @@ async def enroll_multi_face(
         
         if existing:
             conn.close()
-            return JSONResponse(
-                status_code=409,  # Conflict status code is more appropriate
-                content={
-                    "success": False,
-                    "error": f"Student {student_id} is already enrolled (enrolled on {existing[1]}). To re-enroll, please delete the existing enrollment first or contact an administrator.",
-                    "error_code": "ALREADY_ENROLLED",
-                    "student_id": student_id,
-                    "existing_enrollment_date": existing[1],
-                    "suggestion": "Use the delete endpoint first, then re-enroll, or contact support for assistance."
-                }
-            )
+            return 409, {  # Conflict status code is more appropriate
+                "success": False,
+                "error": f"Student {student_id} is already enrolled (enrolled on {existing[1]}). To re-enroll, please delete the existing enrollment first or contact an administrator.",
+                "error_code": "ALREADY_ENROLLED",
+                "student_id": student_id,
+                "existing_enrollment_date": existing[1],
+            "suggestion": "Use the delete endpoint first, then re-enroll, or contact support for assistance."
+            }
         
         # Process each photo
         photo_results = []
@@ -505,69 +708,54 @@ async def enroll_multi_face(
         total_quality_score = 0
         total_face_confidence = 0
         
-        for angle, photo in photos:
+        for angle, photo_data in photos:
             logger.info(f"Processing {angle} photo for student {student_id}")
+            report(angle, "processing")
             
-            # Read and save photo
-            photo_data = await photo.read()
+            # Save a temporary copy for processing
             photo_hash = calculate_photo_hash(photo_data)
+            temp_photo_path = os.path.join(UPLOAD_DIR, f"temp_enroll_{student_id}_{angle}_{os.getpid()}_{time.time_ns()}.jpg")
+            temp_files.append(temp_photo_path)
             
-            # Create unique filename
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{student_id}_{angle}_{timestamp}_{photo_hash[:8]}.jpg"
-            photo_path = os.path.join(UPLOAD_DIR, filename)
-            saved_files.append(photo_path)
-            
-            # Save photo to disk
-            async with aiofiles.open(photo_path, 'wb') as f:
-                await f.write(photo_data)
+            with open(temp_photo_path, 'wb') as f:
+                f.write(photo_data)
             
             # Assess photo quality
-            quality_assessment = assess_photo_quality(photo_path)
+            quality_assessment = assess_photo_quality(temp_photo_path)
             
             if quality_assessment["quality_score"] < 0.4:  # Slightly lower threshold for profile photos
-                # Clean up all saved files
-                for file_path in saved_files:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": f"{angle} photo quality too low for enrollment",
-                        "quality_assessment": quality_assessment,
-                        "angle": angle
-                    }
-                )
+                return 400, {
+                    "success": False,
+                    "error": f"{angle} photo quality too low for enrollment",
+                    "quality_assessment": quality_assessment,
+                    "angle": angle
+                }
+            
+            report(angle, "quality_checked")
             
             # Extract face embedding
-            embedding_result = extract_face_embedding(photo_path, model_name)
+            embedding_result = scheduler.run_sync(ENROLL, extract_face_embedding, temp_photo_path, model_name)
             
             if not embedding_result["success"]:
-                # Clean up all saved files
-                for file_path in saved_files:
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                return JSONResponse(
-                    status_code=400,
-                    content={
-                        "success": False,
-                        "error": f"Failed to extract face from {angle} photo: {embedding_result['error']}",
-                        "quality_assessment": quality_assessment,
-                        "angle": angle
-                    }
-                )
+                return 400, {
+                    "success": False,
+                    "error": f"Failed to extract face from {angle} photo: {embedding_result['error']}",
+                    "quality_assessment": quality_assessment,
+                    "angle": angle
+                }
             
             # Store results for this photo
             photo_results.append({
                 "angle": angle,
-                "photo_path": photo_path,
+                "photo_data": photo_data,
+                "facial_area": embedding_result.get("facial_area"),
                 "photo_hash": photo_hash,
                 "embedding": embedding_result["embedding"],
                 "face_confidence": embedding_result["face_confidence"],
                 "quality_score": quality_assessment["quality_score"]
             })
             
+            report(angle, "embedded")
             embeddings.append(embedding_result["embedding"])
             total_quality_score += quality_assessment["quality_score"]
             total_face_confidence += embedding_result["face_confidence"]
@@ -576,38 +764,26 @@ async def enroll_multi_face(
         avg_quality_score = total_quality_score / len(photos)
         avg_face_confidence = total_face_confidence / len(photos)
         
-        # Check for face uniqueness against existing enrollments
-        cursor.execute("""
-            SELECT student_id, deepface_embedding 
-            FROM photo_face_enrollments 
-            WHERE is_active = 1
-        """)
-        all_enrollments = cursor.fetchall()
-        
-        # Check each new embedding against existing ones
+        # Check each new embedding against existing enrollments
+        gallery_view = gallery.view(model_name)
         for i, new_embedding in enumerate(embeddings):
-            for enrollment in all_enrollments:
-                stored_embedding = json.loads(enrollment["deepface_embedding"])
-                similarity = calculate_similarity(new_embedding, stored_embedding)
-                
-                # If similarity is above threshold, this face is already enrolled
-                if similarity >= SIMILARITY_THRESHOLD:
-                    # Clean up all saved files
-                    for file_path in saved_files:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                    conn.close()
-                    return JSONResponse(
-                        status_code=400,
-                        content={
-                            "success": False,
-                            "error": f"Face from {photo_results[i]['angle']} photo is already enrolled for student {enrollment['student_id']}",
-                            "duplicate_student_id": enrollment["student_id"],
-                            "similarity_score": round(similarity, 3),
-                            "threshold_used": SIMILARITY_THRESHOLD,
-                            "detected_angle": photo_results[i]['angle']
-                        }
-                    )
+            duplicate = gallery_view.best_match(new_embedding)
+
+            # If similarity is above threshold, this face is already enrolled
+            if duplicate and duplicate["similarity"] >= SIMILARITY_THRESHOLD:
+                conn.close()
+                return 400, {
+                    "success": False,
+                    "error": f"Face from {photo_results[i]['angle']} photo is already enrolled for student {duplicate['student_id']}",
+                    "duplicate_student_id": duplicate["student_id"],
+                    "similarity_score": round(duplicate["similarity"], 3),
+                    "threshold_used": SIMILARITY_THRESHOLD,
+                    "detected_angle": photo_results[i]['angle']
+                }
+        
+        # Keep the face crops; the photo GC removes them if the inserts below fail
+        for result in photo_results:
+            result["photo_path"] = photo_store.put(result["photo_hash"], result["photo_data"], result["facial_area"])
         
         # Store all enrollments in database
         enrollment_ids = []
@@ -656,10 +832,15 @@ async def enroll_multi_face(
         
         conn.commit()
         conn.close()
-        
+
+        # Publish the new embeddings to every worker
+        gallery.update(model_name)
+        for result in photo_results:
+            report(result["angle"], "stored")
+
         logger.info(f"Successfully enrolled student {student_id} with {len(photos)} photos")
         
-        return {
+        return 200, {
             "success": True,
             "message": f"Student {student_id} enrolled successfully with {len(photos)} photos",
             "enrollment_ids": enrollment_ids,
@@ -678,36 +859,200 @@ async def enroll_multi_face(
             ]
         }
         
-    except Exception as e:
-        logger.error(f"Multi-photo enrollment failed: {e}")
-        # Clean up all saved files on error
-        for file_path in saved_files:
+    finally:
+        for file_path in temp_files:
             if os.path.exists(file_path):
                 os.remove(file_path)
-        raise HTTPException(status_code=500, detail=f"Multi-photo enrollment failed: {str(e)}")
 
+# Background workers for job-based enrollment
+enrollment_jobs = EnrollmentJobQueue(
+    DATABASE_PATH,
+    ENROLLMENT_JOB_DIR,
+    process_multi_enrollment,
+    max_workers=ENROLLMENT_JOB_WORKERS,
+    retention_seconds=ENROLLMENT_JOB_RETENTION_HOURS * 3600
+)
+
+@app.post("/api/face/enroll-multi")
+async def enroll_multi_face(
+    student_id: str = Form(...),
+    front_photo: UploadFile = File(...),
+    left_profile_photo: UploadFile = File(...),
+    right_profile_photo: UploadFile = File(...),
+    model_name: str = Form(DEFAULT_MODEL)
+):
+    """Enroll a student's face using three different angle photos (front, left profile, right profile)"""
+    try:
+        logger.info(f"Starting multi-photo enrollment for student {student_id}")
+        
+        photos = await read_multi_enrollment_photos(front_photo, left_profile_photo, right_profile_photo, model_name)
+        status_code, content = await run_in_threadpool(process_multi_enrollment, student_id, photos, model_name)
+        
+        if status_code != 200:
+            return JSONResponse(status_code=status_code, content=content)
+        return content
+        
+    except Exception as e:
+        logger.error(f"Multi-photo enrollment failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Multi-photo enrollment failed: {str(e)}")
 
-@app.get("/api/face/enrollments")
-async def get_enrollments():
-    """Get all face enrollments"""
+@app.post("/api/face/enroll-multi/jobs", status_code=202)
+async def submit_enrollment_job(
+    student_id: str = Form(...),
+    front_photo: UploadFile = File(...),
+    left_profile_photo: UploadFile = File(...),
+    right_profile_photo: UploadFile = File(...),
+    model_name: str = Form(DEFAULT_MODEL)
+):
+    """Queue a multi-angle enrollment and return a job id immediately"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        photos = await read_multi_enrollment_photos(front_photo, left_profile_photo, right_profile_photo, model_name)
+        job = enrollment_jobs.submit(student_id, model_name, photos)
         
-        cursor.execute("""
-            SELECT student_id, face_confidence, photo_quality_score, 
+        return {
+            "success": True,
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "progress": job["progress"],
+            "status_url": f"/api/face/enroll-multi/jobs/{job['job_id']}"
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to queue enrollment job: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to queue enrollment job: {str(e)}")
+
+@app.get("/api/face/enroll-multi/jobs/{job_id}")
+async def get_enrollment_job(job_id: str):
+    """Report an enrollment job's status, per-angle progress and final result"""
+    job = enrollment_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Enrollment job {job_id} not found")
+    return {"success": True, **job}
+
+def parse_date_bound(value: str, end: bool = False) -> str:
+    """Parse a date or datetime filter; a bare end date includes that whole day"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+def encode_enrollment_cursor(row: sqlite3.Row) -> str:
+    raw = json.dumps([row["enrollment_date"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_enrollment_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        enrollment_date, enrollment_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(enrollment_date), int(enrollment_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def build_enrollment_query(
+    active: Optional[bool],
+    model_name: Optional[str],
+    enrolled_from: Optional[str],
+    enrolled_to: Optional[str],
+    after: Optional[str] = None
+) -> Tuple[str, List[Any]]:
+    """WHERE clause and parameters for the enrollment listing filters and keyset cursor"""
+    conditions, params = [], []
+    if active is not None:
+        conditions.append("is_active = ?")
+        params.append(1 if active else 0)
+    if model_name:
+        conditions.append("model_name = ?")
+        params.append(model_name)
+    if enrolled_from:
+        conditions.append("enrollment_date >= ?")
+        params.append(parse_date_bound(enrolled_from))
+    if enrolled_to:
+        conditions.append("enrollment_date < ?" if len(enrolled_to) == 10 else "enrollment_date <= ?")
+        params.append(parse_date_bound(enrolled_to, end=True))
+    if after:
+        # Newest first, with id breaking ties between rows enrolled in the same second
+        after_date, after_id = decode_enrollment_cursor(after)
+        conditions.append("(enrollment_date < ? OR (enrollment_date = ? AND id < ?))")
+        params.extend([after_date, after_date, after_id])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+def stream_enrollments(where: str, params: List[Any], limit: Optional[int]):
+    """Yield matching enrollments as NDJSON lines without loading them all"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(f"""
+            SELECT id, student_id, face_confidence, photo_quality_score,
                    model_name, enrollment_date, is_active
             FROM photo_face_enrollments
-            ORDER BY enrollment_date DESC
-        """)
-        
-        enrollments = [dict(row) for row in cursor.fetchall()]
+            {where}
+            ORDER BY enrollment_date DESC, id DESC
+            {"LIMIT ?" if limit else ""}
+        """, params + ([limit] if limit else []))
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            yield "".join(json.dumps(dict(row)) + "\n" for row in rows)
+    finally:
         conn.close()
+
+@app.get("/api/face/enrollments")
+async def get_enrollments(
+    active: Optional[bool] = None,
+    model_name: Optional[str] = None,
+    enrolled_from: Optional[str] = None,
+    enrolled_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    format: str = "json"
+):
+    """List face enrollments, newest first, one page at a time or streamed as NDJSON"""
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'ndjson'")
+    if limit is not None and (limit < 1 or (format == "json" and limit > ENROLLMENT_LIST_MAX_PAGE_SIZE)):
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {ENROLLMENT_LIST_MAX_PAGE_SIZE}")
+    
+    where, params = build_enrollment_query(active, model_name, enrolled_from, enrolled_to, cursor)
+    
+    if format == "ndjson":
+        return StreamingResponse(stream_enrollments(where, params, limit), media_type="application/x-ndjson")
+    
+    page_size = limit or ENROLLMENT_LIST_PAGE_SIZE
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(f"""
+                SELECT id, student_id, face_confidence, photo_quality_score,
+                       model_name, enrollment_date, is_active
+                FROM photo_face_enrollments
+                {where}
+                ORDER BY enrollment_date DESC, id DESC
+                LIMIT ?
+            """, params + [page_size + 1]).fetchall()
+            
+            # Total for the filters only, not the cursor position
+            count_where, count_params = build_enrollment_query(active, model_name, enrolled_from, enrolled_to)
+            total_count = conn.execute(
+                f"SELECT COUNT(*) FROM photo_face_enrollments {count_where}", count_params
+            ).fetchone()[0]
+        finally:
+            conn.close()
+        
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
         
         return {
             "success": True,
-            "enrollments": enrollments,
-            "total_count": len(enrollments)
+            "enrollments": [dict(row) for row in rows],
+            "count": len(rows),
+            "total_count": total_count,
+            "has_more": has_more,
+            "next_cursor": encode_enrollment_cursor(rows[-1]) if has_more else None
         }
         
     except Exception as e:
@@ -721,19 +1066,23 @@ async def delete_enrollment(student_id: str):
         conn = get_db_connection()
         cursor = conn.cursor()
         
-        # Get photo path before deletion
+        # Get photo paths before deletion
         cursor.execute(
-            "SELECT photo_path FROM photo_face_enrollments WHERE student_id = ?",
+            "SELECT photo_path, photo_hash FROM photo_face_enrollments WHERE student_id = ?",
             (student_id,)
         )
-        result = cursor.fetchone()
+        photos = [(row["photo_path"], row["photo_hash"]) for row in cursor.fetchall()]
         
-        if not result:
+        if not photos:
             conn.close()
             raise HTTPException(status_code=404, detail=f"No enrollment found for student {student_id}")
-        
-        photo_path = result["photo_path"]
-        
+
+        cursor.execute(
+            "SELECT DISTINCT model_name FROM photo_face_enrollments WHERE student_id = ?",
+            (student_id,)
+        )
+        affected_models = [row["model_name"] for row in cursor.fetchall()]
+
         # Delete from database
         cursor.execute(
             "DELETE FROM photo_face_enrollments WHERE student_id = ?",
@@ -745,11 +1094,14 @@ async def delete_enrollment(student_id: str):
             raise HTTPException(status_code=404, detail=f"No enrollment found for student {student_id}")
         
         conn.commit()
-        conn.close()
         
-        # Delete photo file
-        if os.path.exists(photo_path):
-            os.remove(photo_path)
+        # Delete photo files no other enrollment still uses
+        photo_store.release(conn, photos)
+        conn.close()
+
+        # Drop the student's embeddings from every worker's gallery
+        for affected_model in affected_models:
+            await run_in_threadpool(gallery.update, affected_model)
         
         logger.info(f"Successfully deleted enrollment for student {student_id}")
         
@@ -764,13 +1116,301 @@ async def delete_enrollment(student_id: str):
         logger.error(f"Failed to delete enrollment: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to delete enrollment: {str(e)}")
 
+def decode_image(image_data) -> np.ndarray:
+    """Decode an uploaded image (bytes or a memoryview of the request buffer) to BGR"""
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise HTTPException(status_code=400, detail="Could not decode image")
+    return image
+
+async def read_request_body(request: Request, max_bytes: int) -> memoryview:
+    """Read a request body into one preallocated buffer, capped at max_bytes"""
+    content_length = request.headers.get("content-length")
+    try:
+        expected = int(content_length) if content_length is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if expected is not None and expected > max_bytes:
+        raise HTTPException(status_code=413, detail=f"Body larger than {max_bytes} bytes")
+    
+    # Sized from Content-Length; chunked uploads start small and double up to the cap
+    buffer = bytearray(expected if expected is not None else min(RAW_IMAGE_INITIAL_BYTES, max_bytes))
+    received = 0
+    async for chunk in request.stream():
+        end = received + len(chunk)
+        if end > len(buffer):
+            if expected is not None:
+                raise HTTPException(status_code=400, detail="Body longer than Content-Length")
+            if end > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Body larger than {max_bytes} bytes")
+            buffer.extend(bytes(min(max_bytes, max(end, 2 * len(buffer))) - len(buffer)))
+        buffer[received:end] = chunk
+        received = end
+    
+    if received == 0:
+        raise HTTPException(status_code=400, detail="Empty request body")
+    return memoryview(buffer)[:received]
+
+async def read_raw_image(request: Request) -> memoryview:
+    """Read a raw image request body, capped at RAW_IMAGE_MAX_BYTES"""
+    if not request.headers.get("content-type", "").startswith("image/"):
+        raise HTTPException(status_code=415, detail="Body must be an image (Content-Type: image/jpeg)")
+    return await read_request_body(request, RAW_IMAGE_MAX_BYTES)
+
+async def read_device_embedding(
+    request: Request,
+    model_name: str,
+    device_id: Optional[str],
+    timestamp: Optional[str],
+    signature: Optional[str]
+) -> np.ndarray:
+    """Read and authenticate a signed float32 embedding uploaded by a registered kiosk"""
+    body = await read_request_body(request, EMBEDDING_MAX_BYTES)
+    try:
+        await run_in_threadpool(
+            device_registry.authenticate, device_id, timestamp, signature, request.url.path, request.url.query, body
+        )
+    except DeviceAuthError as e:
+        logger.warning(f"Rejected embedding upload from device {device_id}: {e}")
+        raise HTTPException(status_code=401, detail=str(e))
+    
+    if len(body) % 4:
+        raise HTTPException(status_code=400, detail="Embedding must be little-endian float32")
+    embedding = np.frombuffer(body, dtype="<f4")
+    expected_dim = gallery.view(model_name).dim
+    if expected_dim and embedding.shape[0] != expected_dim:
+        raise HTTPException(status_code=400,
+                            detail=f"{model_name} embeddings have {expected_dim} dimensions, got {embedding.shape[0]}")
+    if not np.all(np.isfinite(embedding)) or not np.any(embedding):
+        raise HTTPException(status_code=400, detail="Embedding must be finite and non-zero")
+    return embedding
+
+def match_student(student_id: str, model_name: str, live_embedding: Any, budget: RequestBudget) -> Dict[str, Any]:
+    """Match an embedding against one student's enrollments"""
+    with budget.stage("matching"):
+        # Compare with this student's enrolled embeddings from the same model
+        gallery_view = gallery.view(model_name)
+        student_rows = gallery_view.rows_for_student(student_id)
+
+        if student_rows.size == 0 and not has_active_enrollment(student_id):
+            raise HTTPException(status_code=404, detail=f"No face enrollment found for student {student_id}")
+
+        logger.info(f"Found {student_rows.size} {model_name} enrollment(s) for student {student_id}")
+
+        best_similarity = 0.0
+        verification_threshold, calibrated = student_thresholds.get(
+            model_name, student_id, VERIFICATION_THRESHOLD
+        )
+
+        # Any row above the threshold verifies, so stop at the first one
+        match = gallery_view.best_match(live_embedding, student_id, stop_at=verification_threshold)
+        if match and match["similarity"] > best_similarity:
+            best_similarity = match["similarity"]
+
+    # Determine verification result
+    verified = best_similarity >= verification_threshold
+    if verified:
+        presence.mark(student_id)
+    
+    logger.info(f"Verification result for {student_id}: {verified} (confidence: {best_similarity:.4f})")
+    
+    return {
+        "verified": verified,
+        "confidence": float(best_similarity),
+        "threshold": verification_threshold,
+        "threshold_source": "calibrated" if calibrated else "default",
+        "student_id": student_id,
+        "model_name": model_name,
+        "message": "Identity verified successfully" if verified else "Identity verification failed"
+    }
+
+def match_gallery(model_name: str, live_embedding: Any, budget: RequestBudget) -> Dict[str, Any]:
+    """Match an embedding against the whole gallery"""
+    with budget.stage("matching"):
+        gallery_view = gallery.view(model_name)
+        projection = projections.get(model_name)
+        match = gallery_view.best_match(live_embedding, projection=projection, candidates=PROJECTION_CANDIDATES)
+    identified = match is not None and match["similarity"] >= VERIFICATION_THRESHOLD
+
+    logger.info(f"Identification result: {match['student_id'] if identified else None} "
+                f"(searched {len(gallery_view)} embeddings)")
+
+    return {
+        "identified": identified,
+        "student_id": match["student_id"] if identified else None,
+        "confidence": float(match["similarity"]) if match else 0.0,
+        "threshold": VERIFICATION_THRESHOLD,
+        "model_name": model_name,
+        "gallery_size": len(gallery_view),
+        "projection_version": projection.version if projection else None,
+        "message": "Student identified successfully" if identified else "No matching student found"
+    }
+
+async def verify_frame(
+    student_id: str,
+    model_name: str,
+    photo_data,
+    budget: RequestBudget,
+    raw: bool = False,
+    if_present: str = IF_PRESENT_VERIFY
+) -> Dict[str, Any]:
+    """Verify one live frame against a student's enrollments.
+
+    Multipart uploads go to DeepFace through a temporary file; raw bodies are
+    decoded in memory. A verify cache hit skips both. For a student already
+    present today, if_present decides whether to verify, skip or verify at
+    enrollment priority.
+    """
+    if if_present not in IF_PRESENT_CHOICES:
+        raise HTTPException(status_code=400, detail=f"if_present must be one of {', '.join(IF_PRESENT_CHOICES)}")
+    
+    already_present = presence.is_present(student_id)
+    workload = VERIFY
+    if already_present and if_present == IF_PRESENT_SKIP:
+        presence.record_short_circuit(IF_PRESENT_SKIP)
+        logger.info(f"Skipped verification for {student_id}: already present today")
+        return {
+            "verified": False,
+            "skipped": True,
+            "already_present": True,
+            "student_id": student_id,
+            "model_name": model_name,
+            "message": "Student is already marked present today",
+            "timings_ms": budget.report()
+        }
+    if already_present and if_present == IF_PRESENT_DOWNGRADE:
+        # Queue behind students who are not checked in yet
+        presence.record_short_circuit(IF_PRESENT_DOWNGRADE)
+        workload = ENROLL
+    
+    # A retry that resends the same (or a near-identical) frame reuses its embedding
+    cached = None
+    if verify_cache.enabled:
+        with budget.stage("cache"):
+            # SHA-256 and the perceptual hash's image decode stay off the event loop
+            cache_key, frame_hash = await run_in_threadpool(verify_cache.key, student_id, model_name, photo_data)
+            embedding_result, cached = verify_cache.get(cache_key, frame_hash)
+    
+    temp_photo_path = os.path.join(UPLOAD_DIR, f"temp_verify_{student_id}_{os.getpid()}_{time.time_ns()}.jpg")
+    try:
+        if cached is None:
+            if raw:
+                with budget.stage("decode"):
+                    image = await run_in_threadpool(decode_image, photo_data)
+            else:
+                # Save a temporary copy and extract the face embedding from it
+                with budget.stage("upload"):
+                    with open(temp_photo_path, "wb") as f:
+                        f.write(photo_data)
+                image = temp_photo_path
+            try:
+                embedding_result = await scheduler.run(
+                    workload, extract_face_embedding, image, model_name, budget,
+                    budget=budget, min_face_quality=FACE_QUALITY_MIN
+                )
+            except DeadlineExceeded as e:
+                embedding_result = timed_out_result(e.stage)
+            if verify_cache.enabled:
+                verify_cache.put(cache_key, frame_hash, embedding_result)
+        else:
+            logger.info(f"Verify cache hit ({cached}) for student {student_id}")
+        
+        if embedding_result.get("timed_out"):
+            logger.warning(f"Verification for {student_id} ran out of time before {embedding_result['stage']}")
+            return {
+                "verified": False,
+                "timed_out": True,
+                "retry": True,
+                "stage": embedding_result["stage"],
+                "already_present": already_present,
+                "student_id": student_id,
+                "model_name": model_name,
+                "message": "Verification timed out, please retry",
+                "timings_ms": budget.report()
+            }
+        
+        if embedding_result.get("low_quality"):
+            logger.info(f"Rejected low-quality frame for {student_id}: {embedding_result['face_quality']}")
+            return {
+                "verified": False,
+                "low_quality": True,
+                "retry": True,
+                "face_quality": embedding_result["face_quality"],
+                "already_present": already_present,
+                "student_id": student_id,
+                "model_name": model_name,
+                "message": embedding_result["error"],
+                "cached": cached,
+                "timings_ms": budget.report()
+            }
+        
+        if not embedding_result["success"]:
+            raise HTTPException(status_code=400, detail=embedding_result["error"])
+        
+        match = await run_in_threadpool(match_student, student_id, model_name, embedding_result["embedding"], budget)
+        return {
+            **match,
+            "already_present": already_present,
+            "face_quality": embedding_result["face_quality"],
+            "cached": cached,
+            "timings_ms": budget.report()
+        }
+        
+    finally:
+        # Clean up temporary file
+        if os.path.exists(temp_photo_path):
+            os.remove(temp_photo_path)
+
+async def identify_frame(model_name: str, photo_data, budget: RequestBudget, raw: bool = False) -> Dict[str, Any]:
+    """Match one live frame against the whole gallery"""
+    temp_photo_path = os.path.join(UPLOAD_DIR, f"temp_identify_{os.getpid()}_{time.time_ns()}.jpg")
+    try:
+        if raw:
+            with budget.stage("decode"):
+                image = await run_in_threadpool(decode_image, photo_data)
+        else:
+            with budget.stage("upload"):
+                with open(temp_photo_path, "wb") as f:
+                    f.write(photo_data)
+            image = temp_photo_path
+
+        embedding_result = await scheduler.run(
+            VERIFY, extract_face_embedding, image, model_name, budget,
+            budget=budget, min_face_quality=FACE_QUALITY_MIN
+        )
+
+        if embedding_result.get("low_quality"):
+            return {
+                "identified": False,
+                "low_quality": True,
+                "retry": True,
+                "face_quality": embedding_result["face_quality"],
+                "model_name": model_name,
+                "message": embedding_result["error"],
+                "timings_ms": budget.report()
+            }
+
+        if not embedding_result["success"]:
+            raise HTTPException(status_code=400, detail=embedding_result["error"])
+
+        match = await run_in_threadpool(match_gallery, model_name, embedding_result["embedding"], budget)
+        return {**match, "timings_ms": budget.report()}
+
+    finally:
+        if os.path.exists(temp_photo_path):
+            os.remove(temp_photo_path)
+
 @app.post("/api/face/verify")
 async def verify_face(
     student_id: str = Form(...),
     photo: UploadFile = File(...),
-    model_name: str = Form(DEFAULT_MODEL)
+    model_name: str = Form(DEFAULT_MODEL),
+    deadline_ms: Optional[int] = Form(None),
+    if_present: str = Form(IF_PRESENT_VERIFY),
+    x_deadline_ms: Optional[int] = Header(None)
 ):
     """Verify a student's identity using live camera photo"""
+    budget = RequestBudget(deadline_ms or x_deadline_ms)
     try:
         logger.info(f"Starting face verification for student {student_id} using model {model_name}")
         
@@ -782,81 +1422,36 @@ async def verify_face(
         if not photo.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # Read photo data
-        photo_data = await photo.read()
+        with budget.stage("upload"):
+            photo_data = await photo.read()
         
-        # Save temporary photo for processing
-        temp_photo_path = os.path.join(UPLOAD_DIR, f"temp_verify_{student_id}_{int(time.time())}.jpg")
-        with open(temp_photo_path, "wb") as f:
-            f.write(photo_data)
+        return await verify_frame(student_id, model_name, photo_data, budget, if_present=if_present)
         
-        try:
-            # Extract face embedding from live photo
-            embedding_result = extract_face_embedding(temp_photo_path, model_name)
-            
-            if not embedding_result["success"]:
-                raise HTTPException(status_code=400, detail=embedding_result["error"])
-            
-            live_embedding = embedding_result["embedding"]
-            
-            # Get enrolled embeddings for this student
-            conn = sqlite3.connect(DATABASE_PATH)
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "SELECT deepface_embedding, model_name FROM photo_face_enrollments WHERE student_id = ? AND is_active = 1",
-                (student_id,)
-            )
-            
-            enrollments = cursor.fetchall()
-            conn.close()
-            
-            if not enrollments:
-                raise HTTPException(status_code=404, detail=f"No face enrollment found for student {student_id}")
-            
-            logger.info(f"Found {len(enrollments)} enrollment(s) for student {student_id}")
-            
-            # Compare with enrolled embeddings
-            best_similarity = 0.0
-            verification_threshold = 0.6  # Cosine similarity threshold
-            
-            for enrollment_data, enrolled_model in enrollments:
-                # Only compare with embeddings from the same model
-                if enrolled_model == model_name:
-                    try:
-                        # Deserialize enrolled embedding from JSON
-                        enrolled_embedding = np.array(json.loads(enrollment_data))
-                        
-                        # Calculate similarity
-                        similarity = calculate_similarity(live_embedding, enrolled_embedding)
-                        
-                        if similarity > best_similarity:
-                            best_similarity = similarity
-                            
-                        logger.info(f"Similarity with enrolled embedding: {similarity:.4f}")
-                        
-                    except Exception as e:
-                        logger.warning(f"Failed to process enrolled embedding: {e}")
-                        continue
-            
-            # Determine verification result
-            verified = best_similarity >= verification_threshold
-            
-            logger.info(f"Verification result for {student_id}: {verified} (confidence: {best_similarity:.4f})")
-            
-            return {
-                "verified": verified,
-                "confidence": float(best_similarity),
-                "threshold": verification_threshold,
-                "student_id": student_id,
-                "model_name": model_name,
-                "message": "Identity verified successfully" if verified else "Identity verification failed"
-            }
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_photo_path):
-                os.remove(temp_photo_path)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Face verification failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Face verification failed: {str(e)}")
+
+@app.post("/api/face/verify/raw")
+async def verify_face_raw(
+    request: Request,
+    student_id: str,
+    model_name: str = DEFAULT_MODEL,
+    deadline_ms: Optional[int] = None,
+    if_present: str = IF_PRESENT_VERIFY,
+    x_deadline_ms: Optional[int] = Header(None)
+):
+    """Verify a student's identity from a raw JPEG/PNG request body (no multipart or base64)"""
+    budget = RequestBudget(deadline_ms or x_deadline_ms)
+    try:
+        if model_name not in SUPPORTED_MODELS:
+            raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+        
+        with budget.stage("upload"):
+            photo_data = await read_raw_image(request)
+        
+        return await verify_frame(student_id, model_name, photo_data, budget, raw=True, if_present=if_present)
         
     except HTTPException:
         raise
@@ -864,6 +1459,461 @@ async def verify_face(
         logger.error(f"Face verification failed: {e}")
         raise HTTPException(status_code=500, detail=f"Face verification failed: {str(e)}")
 
+@app.post("/api/face/identify")
+async def identify_face(
+    photo: UploadFile = File(...),
+    model_name: str = Form(DEFAULT_MODEL)
+):
+    """Identify a student by matching a live photo against the whole gallery"""
+    try:
+        # Validate model
+        if model_name not in SUPPORTED_MODELS:
+            raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+
+        # Validate file type
+        if not photo.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="File must be an image")
+
+        budget = RequestBudget()
+        with budget.stage("upload"):
+            photo_data = await photo.read()
+
+        return await identify_frame(model_name, photo_data, budget)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Face identification failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Face identification failed: {str(e)}")
+
+@app.post("/api/face/identify/raw")
+async def identify_face_raw(request: Request, model_name: str = DEFAULT_MODEL):
+    """Identify a student from a raw JPEG/PNG request body"""
+    try:
+        if model_name not in SUPPORTED_MODELS:
+            raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+
+        budget = RequestBudget()
+        with budget.stage("upload"):
+            photo_data = await read_raw_image(request)
+
+        return await identify_frame(model_name, photo_data, budget, raw=True)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Face identification failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Face identification failed: {str(e)}")
+
+@app.post("/api/face/verify/embedding")
+async def verify_embedding(
+    request: Request,
+    student_id: str,
+    model_name: str = DEFAULT_MODEL,
+    x_device_id: Optional[str] = Header(None),
+    x_device_timestamp: Optional[str] = Header(None),
+    x_device_signature: Optional[str] = Header(None)
+):
+    """Verify a precomputed embedding from a registered kiosk; only matching runs on the server"""
+    budget = RequestBudget()
+    try:
+        if model_name not in SUPPORTED_MODELS:
+            raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+        
+        with budget.stage("upload"):
+            embedding = await read_device_embedding(
+                request, model_name, x_device_id, x_device_timestamp, x_device_signature
+            )
+        
+        match = await run_in_threadpool(match_student, student_id, model_name, embedding, budget)
+        return {
+            **match,
+            "device_id": x_device_id,
+            "timings_ms": budget.report()
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Embedding verification failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Face verification failed: {str(e)}")
+
+@app.post("/api/face/identify/embedding")
+async def identify_embedding(
+    request: Request,
+    model_name: str = DEFAULT_MODEL,
+    x_device_id: Optional[str] = Header(None),
+    x_device_timestamp: Optional[str] = Header(None),
+    x_device_signature: Optional[str] = Header(None)
+):
+    """Identify a precomputed embedding from a registered kiosk against the whole gallery"""
+    budget = RequestBudget()
+    try:
+        if model_name not in SUPPORTED_MODELS:
+            raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+
+        with budget.stage("upload"):
+            embedding = await read_device_embedding(
+                request, model_name, x_device_id, x_device_timestamp, x_device_signature
+            )
+
+        match = await run_in_threadpool(match_gallery, model_name, embedding, budget)
+        return {**match, "device_id": x_device_id, "timings_ms": budget.report()}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Embedding identification failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Face identification failed: {str(e)}")
+
+def require_admin_token(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Admin endpoints that hand out secrets, expose internals or delete data need FACE_ADMIN_TOKEN"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403,
+                            detail="This admin endpoint is disabled; set FACE_ADMIN_TOKEN or use the command-line tools")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token")
+
+@app.post("/api/face/admin/devices", dependencies=[Depends(require_admin_token)])
+async def register_device(name: Optional[str] = Form(None), device_id: Optional[str] = Form(None)):
+    """Register a kiosk for embedding uploads; the secret is only returned here"""
+    try:
+        device = add_device(DATABASE_PATH, name, device_id)
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail=f"Device {device_id} is already registered")
+    device_registry.invalidate()
+    return {"success": True, **device, "message": "Store the secret on the device; it is not shown again"}
+
+@app.get("/api/face/admin/devices", dependencies=[Depends(require_admin_token)])
+async def get_devices():
+    """Registered kiosks, without their secrets"""
+    return {"success": True, "devices": list_devices(DATABASE_PATH)}
+
+@app.delete("/api/face/admin/devices/{device_id}", dependencies=[Depends(require_admin_token)])
+async def delete_device(device_id: str):
+    """Revoke a kiosk; other worker processes stop accepting it within a refresh interval"""
+    if not revoke_device(DATABASE_PATH, device_id):
+        raise HTTPException(status_code=404, detail=f"No active device {device_id}")
+    device_registry.invalidate()
+    return {"success": True, "device_id": device_id, "message": "Device revoked"}
+
+# Background re-embedding for model migrations (one job at a time per process)
+reembedding_job: Optional[ReembeddingJob] = None
+reembedding_thread: Optional[threading.Thread] = None
+
+@app.post("/api/face/admin/reembed", status_code=202, dependencies=[Depends(require_admin_token)])
+async def start_reembedding(
+    target_model: str = Form(...),
+    source_model: Optional[str] = Form(None),
+    batch_size: int = Form(32),
+    cpu_budget: float = Form(0.5)
+):
+    """Start (or resume) re-embedding stored photos with a new model"""
+    global reembedding_job, reembedding_thread
+    
+    if target_model not in SUPPORTED_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unsupported model: {target_model}")
+    if source_model is not None and source_model not in SUPPORTED_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unsupported model: {source_model}")
+    if not 0 < cpu_budget <= 1:
+        raise HTTPException(status_code=400, detail="cpu_budget must be between 0 and 1")
+    if reembedding_thread and reembedding_thread.is_alive():
+        raise HTTPException(status_code=409, detail=f"Re-embedding job {reembedding_job.job_key} is already running")
+    
+    reembedding_job = ReembeddingJob(
+        DATABASE_PATH,
+        target_model,
+        source_model=source_model,
+        batch_size=batch_size,
+        cpu_budget=cpu_budget,
+        detector_backend=DETECTOR_BACKEND,
+        runner=lambda func, *args: scheduler.run_sync(MAINTENANCE, func, *args)
+    )
+    if not await run_in_threadpool(reembedding_job.schema_ready):
+        raise HTTPException(
+            status_code=409,
+            detail="photo_face_enrollments is not keyed per photo and model; run `python migrate.py` first"
+        )
+    
+    def run_job():
+        try:
+            reembedding_job.run()
+        except Exception as e:
+            logger.error(f"Re-embedding job failed: {e}")
+    
+    reembedding_thread = threading.Thread(target=run_job, name="reembedding", daemon=True)
+    reembedding_thread.start()
+    
+    return {"success": True, "job_key": reembedding_job.job_key, "status": "running"}
+
+@app.get("/api/face/admin/reembed", dependencies=[Depends(require_admin_token)])
+async def get_reembedding_status(target_model: str, source_model: Optional[str] = None):
+    """Checkpointed progress and throughput (images/sec) of a re-embedding job"""
+    key = reembedding_job_key(target_model, source_model)
+    checkpoint = await run_in_threadpool(read_reembedding_checkpoint, DATABASE_PATH, key)
+    checkpoint["running"] = bool(
+        reembedding_thread and reembedding_thread.is_alive() and reembedding_job.job_key == key
+    )
+    return {"success": True, **checkpoint}
+
+@app.delete("/api/face/admin/reembed", dependencies=[Depends(require_admin_token)])
+async def stop_reembedding():
+    """Stop the running re-embedding job after its current batch; it resumes from the checkpoint"""
+    if not (reembedding_thread and reembedding_thread.is_alive()):
+        raise HTTPException(status_code=404, detail="No re-embedding job is running")
+    reembedding_job.stop()
+    return {"success": True, "job_key": reembedding_job.job_key, "status": "stopping"}
+
+# Offline threshold calibration (one run at a time per process)
+calibration_thread: Optional[threading.Thread] = None
+calibration_model: Optional[str] = None
+
+@app.post("/api/face/admin/calibrate", status_code=202)
+async def start_calibration(
+    model_name: str = Form(DEFAULT_MODEL),
+    base_threshold: float = Form(VERIFICATION_THRESHOLD),
+    target_far: float = Form(1e-4),
+    min_genuine_pairs: int = Form(MIN_GENUINE_PAIRS)
+):
+    """Recompute per-student verification thresholds from the whole gallery"""
+    global calibration_thread, calibration_model
+    
+    if model_name not in SUPPORTED_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+    if not 0 < target_far < 1:
+        raise HTTPException(status_code=400, detail="target_far must be between 0 and 1")
+    if calibration_thread and calibration_thread.is_alive():
+        raise HTTPException(status_code=409, detail=f"Calibration for {calibration_model} is already running")
+    
+    job = CalibrationJob(DATABASE_PATH, gallery, model_name, base_threshold=base_threshold,
+                         target_far=target_far, min_genuine_pairs=min_genuine_pairs, runner=run_maintenance)
+    
+    def run_job():
+        try:
+            job.run()
+            student_thresholds.invalidate(model_name)
+        except Exception as e:
+            logger.error(f"Calibration for {model_name} failed: {e}")
+    
+    calibration_model = model_name
+    calibration_thread = threading.Thread(target=run_job, name="calibration", daemon=True)
+    calibration_thread.start()
+    
+    return {"success": True, "model_name": model_name, "status": "running"}
+
+@app.get("/api/face/admin/calibrate")
+async def get_calibration(model_name: str = DEFAULT_MODEL):
+    """Latest calibration run for a model"""
+    return {
+        "success": True,
+        "running": bool(calibration_thread and calibration_thread.is_alive() and calibration_model == model_name),
+        "latest_run": latest_run(DATABASE_PATH, model_name)
+    }
+
+# Offline projection fitting (one run at a time per process)
+projection_thread: Optional[threading.Thread] = None
+projection_model: Optional[str] = None
+
+@app.post("/api/face/admin/projection", status_code=202)
+async def start_projection_fit(
+    model_name: str = Form(DEFAULT_MODEL),
+    dim: int = Form(128),
+    method: str = Form("pca"),
+    activate: bool = Form(True)
+):
+    """Fit a reduced-dimension projection for identification and compute its recall report"""
+    global projection_thread, projection_model
+    
+    if model_name not in SUPPORTED_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+    if method not in PROJECTION_METHODS:
+        raise HTTPException(status_code=400, detail=f"method must be one of {', '.join(PROJECTION_METHODS)}")
+    if projection_thread and projection_thread.is_alive():
+        raise HTTPException(status_code=409, detail=f"Projection fit for {projection_model} is already running")
+    
+    gallery_view = await run_in_threadpool(gallery.sync, model_name)
+    try:
+        check_projection_dim(dim, method, len(gallery_view), gallery_view.dim)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{model_name}: {e}")
+    
+    job = ProjectionJob(DATABASE_PATH, gallery, model_name, dim=dim, method=method, activate=activate,
+                        runner=run_maintenance)
+    
+    def run_job():
+        try:
+            job.run()
+            # Apply the new projection to the gallery here, before searches pick it up
+            projections.warm(model_name)
+        except Exception as e:
+            logger.error(f"Projection fit for {model_name} failed: {e}")
+    
+    projection_model = model_name
+    projection_thread = threading.Thread(target=run_job, name="projection", daemon=True)
+    projection_thread.start()
+    
+    return {"success": True, "model_name": model_name, "status": "running"}
+
+@app.get("/api/face/admin/projection")
+async def get_projection(model_name: str = DEFAULT_MODEL):
+    """Active projection for a model, with its recall report"""
+    return {
+        "success": True,
+        "running": bool(projection_thread and projection_thread.is_alive() and projection_model == model_name),
+        "active": active_projection(DATABASE_PATH, model_name)
+    }
+
+@app.delete("/api/face/admin/projection")
+async def delete_projection(model_name: str = DEFAULT_MODEL):
+    """Switch a model's identification back to exact full-size search"""
+    if not disable_projections(DATABASE_PATH, model_name):
+        raise HTTPException(status_code=404, detail=f"No active projection for {model_name}")
+    await run_in_threadpool(projections.warm, model_name)
+    return {"success": True, "model_name": model_name}
+
+# Duplicate face audits (one run at a time per process)
+audit_thread: Optional[threading.Thread] = None
+audit_job: Optional[AuditJob] = None
+
+@app.post("/api/face/admin/audit", status_code=202)
+async def start_duplicate_audit(
+    model_name: str = Form(DEFAULT_MODEL),
+    threshold: float = Form(0.8)
+):
+    """Start a background scan for the same face enrolled under different students"""
+    global audit_thread, audit_job
+    
+    if model_name not in SUPPORTED_MODELS:
+        raise HTTPException(status_code=400, detail=f"Unsupported model: {model_name}")
+    if not -1 <= threshold <= 1:
+        raise HTTPException(status_code=400, detail="threshold must be between -1 and 1")
+    if audit_thread and audit_thread.is_alive():
+        raise HTTPException(status_code=409, detail=f"Duplicate audit {audit_job.audit_id} is already running")
+    
+    job = AuditJob(gallery, model_name, threshold, AUDIT_DIR, runner=run_maintenance)
+    status = job.submit()
+    
+    def run_job():
+        try:
+            job.run()
+        except Exception as e:
+            logger.error(f"Duplicate audit {job.audit_id} failed: {e}")
+    
+    audit_job = job
+    audit_thread = threading.Thread(target=run_job, name=f"audit-{job.audit_id[:8]}", daemon=True)
+    audit_thread.start()
+    return {"success": True, **status}
+
+@app.get("/api/face/admin/audit/{audit_id}")
+async def get_duplicate_audit(audit_id: str):
+    """Progress and pair count of a duplicate audit"""
+    status = read_audit_status(AUDIT_DIR, audit_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Audit {audit_id} not found")
+    return {"success": True, **status}
+
+@app.get("/api/face/admin/audit/{audit_id}/report")
+async def get_duplicate_audit_report(audit_id: str):
+    """Stream the cross-student pairs found so far as NDJSON"""
+    status = read_audit_status(AUDIT_DIR, audit_id)
+    report_path = os.path.join(AUDIT_DIR, f"{audit_id}.ndjson")
+    if status is None or not os.path.exists(report_path):
+        raise HTTPException(status_code=404, detail=f"No report for audit {audit_id}")
+    
+    def stream_report():
+        with open(report_path) as f:
+            for line in f:
+                # A running audit may have a partially written last line
+                if line.endswith("\n"):
+                    yield line
+    
+    return StreamingResponse(
+        stream_report(),
+        media_type="application/x-ndjson",
+        headers={"X-Audit-Status": status["status"]}
+    )
+
+@app.get("/api/face/metrics")
+async def get_metrics():
+    """Inference scheduler and background job metrics for this worker process"""
+    return {
+        "success": True,
+        "pid": os.getpid(),
+        "scheduler": scheduler.stats(),
+        "enrollment_jobs": enrollment_jobs.counts(),
+        "verify_cache": verify_cache.stats(),
+        "presence": presence.stats()
+    }
+
+@app.get("/api/face/photos/{photo_hash}/thumbnail")
+async def get_photo_thumbnail(photo_hash: str):
+    """Thumbnail of an enrolled photo's face crop"""
+    if len(photo_hash) != 64 or any(c not in "0123456789abcdef" for c in photo_hash):
+        raise HTTPException(status_code=400, detail="Invalid photo hash")
+    path = photo_store.path(photo_hash, THUMBNAIL)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return FileResponse(path, media_type="image/jpeg")
+
+@app.post("/api/face/admin/photos/gc", dependencies=[Depends(require_admin_token)])
+async def collect_photo_garbage(grace_seconds: float = Form(3600)):
+    """Delete stored photos that no enrollment references"""
+    def collect():
+        conn = get_db_connection()
+        try:
+            return photo_store.collect_garbage(conn, [UPLOAD_DIR], grace_seconds)
+        finally:
+            conn.close()
+    
+    try:
+        return {"success": True, **await run_in_threadpool(collect)}
+    except Exception as e:
+        logger.error(f"Photo garbage collection failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Photo garbage collection failed: {str(e)}")
+
+@app.get("/api/face/admin/profiles", dependencies=[Depends(require_admin_token)])
+async def list_slow_requests(limit: int = 50):
+    """List saved slow-request reports, newest first"""
+    return {
+        "success": True,
+        "enabled": slow_requests.enabled,
+        "threshold_ms": slow_requests.threshold_ms,
+        "sample_rate": slow_requests.sample_rate,
+        "reports": slow_requests.list_reports(max(1, min(limit, 500)))
+    }
+
+@app.get("/api/face/admin/profiles/{report_id}", dependencies=[Depends(require_admin_token)])
+async def get_slow_request(report_id: str):
+    """Stage breakdown and top functions of one slow request"""
+    report = slow_requests.get_report(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail=f"Slow request report {report_id} not found")
+    return report
+
+@app.get("/api/face/admin/profiles/{report_id}/download", dependencies=[Depends(require_admin_token)])
+async def download_slow_request_profile(report_id: str):
+    """Download the cProfile output of a sampled slow request (open with pstats or snakeviz)"""
+    path = slow_requests.profile_path(report_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No profile saved for report {report_id}")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{report_id}.prof")
+
 if __name__ == "__main__":
+    import argparse
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="DeepFace Face Recognition API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("FACE_API_WORKERS", "1")),
+                        help="Number of inference worker processes")
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # The uvicorn supervisor is the front process; each worker loads its own model
+        # and maps the shared gallery files read-only.
+        if "FACE_INFERENCE_THREADS" not in os.environ:
+            os.environ["FACE_INFERENCE_THREADS"] = str(max(1, (os.cpu_count() or 1) // args.workers))
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
@@ -0,0 +1,156 @@
+"""Versioned schema migrations for tables the Node backend creates.
+
+photo_face_enrollments is owned by the Node backend and written by it while
+the Python service runs, so nothing here runs at service startup. Apply
+pending migrations once, with both services stopped or idle:
+    python migrate.py
+Applied versions are recorded in face_schema_migrations, so running it again
+is a no-op. Databases created by the current reset scripts already have the
+final schema; their migrations are recorded without rebuilding anything.
+
+1  enrollments_unique_per_photo
+   UNIQUE(student_id) -> UNIQUE(student_id, model_name, photo_hash), so a
+   student can have one row per enrolled photo (front and profile angles from
+   /api/face/enroll-multi) and per model (re-embedding, see reembed.py).
+"""
+
+import argparse
+import logging
+import re
+import sqlite3
+from typing import Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_PATH = "../backend/database/attendance.db"
+
+MIGRATIONS_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+ENROLLMENT_KEY = ("student_id", "model_name", "photo_hash")
+
+
+def _unique_keys(conn: sqlite3.Connection, table: str) -> List[Tuple[str, ...]]:
+    """Column lists of a table's UNIQUE constraints and unique indexes, primary key excluded"""
+    keys = []
+    for _, name, unique, origin, _ in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        if unique and origin != "pk":
+            keys.append(tuple(row[2] for row in conn.execute(f"PRAGMA index_info({name})").fetchall()))
+    return keys
+
+
+def enrollments_keyed_per_photo(conn: sqlite3.Connection) -> bool:
+    """Whether photo_face_enrollments accepts several photos per student and one row per model for each"""
+    return all(set(key) >= set(ENROLLMENT_KEY) for key in _unique_keys(conn, "photo_face_enrollments"))
+
+
+def _rebuild_table(conn: sqlite3.Connection, table: str, table_sql: str) -> None:
+    """Replace a table's definition, keeping rows, ids, the AUTOINCREMENT sequence, indexes and triggers.
+
+    SQLite cannot alter a constraint, so the new table is created under a
+    temporary name, filled, and swapped in. The caller holds the write lock.
+    """
+    dependents = [sql for (sql,) in conn.execute("""
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    """, (table,))]
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+
+    staging = f"{table}_migrating"
+    conn.execute(table_sql.replace(table, staging, 1))
+    conn.execute(f"INSERT INTO {staging} SELECT * FROM {table}")
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+    if sequence is not None:
+        # Never hand out the id of a deleted row again
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (sequence[0], table))
+    for sql in dependents:
+        conn.execute(sql)
+
+
+def enrollments_unique_per_photo(conn: sqlite3.Connection) -> bool:
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'photo_face_enrollments'"
+    ).fetchone()
+    if row is None:
+        # The Node backend hasn't created it yet
+        return False
+    if enrollments_keyed_per_photo(conn):
+        return True
+    table_sql, count = re.subn(
+        r"UNIQUE\s*\(\s*student_id\s*(?:,\s*model_name\s*)?\)",
+        f"UNIQUE({', '.join(ENROLLMENT_KEY)})",
+        row[0]
+    )
+    if count != 1:
+        raise RuntimeError(f"Unexpected photo_face_enrollments constraints: {_unique_keys(conn, 'photo_face_enrollments')}")
+    _rebuild_table(conn, "photo_face_enrollments", table_sql)
+    return True
+
+
+# (version, name, apply); apply returns False when it can't run yet (table missing).
+# Append only, never renumber.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Connection], bool]]] = [
+    (1, "enrollments_unique_per_photo", enrollments_unique_per_photo),
+]
+
+
+def pending(conn: sqlite3.Connection) -> List[Tuple[int, str]]:
+    conn.execute(MIGRATIONS_SCHEMA)
+    applied = {version for (version,) in conn.execute("SELECT version FROM face_schema_migrations")}
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in applied]
+
+
+def migrate(database_path: str) -> List[str]:
+    """Apply pending migrations in order, each in its own transaction; returns the names applied"""
+    conn = sqlite3.connect(database_path, timeout=30, isolation_level=None)
+    applied = []
+    try:
+        todo = {version for version, _ in pending(conn)}
+        for version, name, apply in MIGRATIONS:
+            if version not in todo:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not apply(conn):
+                    conn.execute("ROLLBACK")
+                    logger.warning(f"Migration {version} ({name}) can't run yet; stopping")
+                    break
+                conn.execute("INSERT INTO face_schema_migrations (version, name) VALUES (?, ?)", (version, name))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            logger.info(f"Applied migration {version} ({name})")
+            applied.append(name)
+    finally:
+        conn.close()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations to the attendance database")
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    parser.add_argument("--status", action="store_true", help="Only list pending migrations")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.status:
+        conn = sqlite3.connect(args.database, timeout=30)
+        try:
+            todo = pending(conn)
+        finally:
+            conn.close()
+        print("\n".join(f"{version} {name}" for version, name in todo) or "Up to date")
+        return
+    applied = migrate(args.database)
+    print(f"Applied: {', '.join(applied)}" if applied else "Up to date")
+
+
+if __name__ == "__main__":
+    main()
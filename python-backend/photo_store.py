@@ -0,0 +1,229 @@
+"""Content-addressed storage for enrollment photos.
+
+Files are keyed by the SHA-256 photo_hash already stored with each enrollment
+and sharded into two levels of subdirectories:
+
+    <root>/crops/ab/cd/abcd...ef.jpg    face crop (what photo_path points at)
+    <root>/thumbs/ab/cd/abcd...ef.jpg   small thumbnail for dashboards
+    <root>/originals/ab/cd/abcd...ef.jpg  full upload, only if keep_originals
+
+The same photo enrolled twice is stored once. Deleting an enrollment releases
+its files once no other row references them, and collect_garbage sweeps up
+anything else unreferenced: files from failed or interrupted enrollments and
+files left by the old flat uploads/photos layout.
+
+Run standalone:
+    python photo_store.py gc --grace-seconds 3600
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_PATH = "../backend/database/attendance.db"
+DEFAULT_STORE_DIR = "uploads/store"
+DEFAULT_LEGACY_DIR = "uploads/photos"
+
+CROP = "crops"
+THUMBNAIL = "thumbs"
+ORIGINAL = "originals"
+KINDS = (CROP, THUMBNAIL, ORIGINAL)
+
+CROP_MARGIN = 0.4  # Context kept around the face on each side, as a fraction of its size
+CROP_MAX_SIDE = 512
+CROP_JPEG_QUALITY = 90
+THUMBNAIL_SIDE = 128
+THUMBNAIL_JPEG_QUALITY = 80
+GC_GRACE_SECONDS = 3600  # Younger files may belong to an enrollment that is still in progress
+
+
+def _resize_to_fit(image: np.ndarray, max_side: int) -> np.ndarray:
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (max(1, round(width * scale)), max(1, round(height * scale))), interpolation=cv2.INTER_AREA)
+
+
+def _encode_jpeg(image: np.ndarray, quality: int) -> bytes:
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Failed to encode JPEG")
+    return encoded.tobytes()
+
+
+def crop_face(image: np.ndarray, facial_area: Optional[Dict[str, Any]]) -> np.ndarray:
+    """Crop the detected face with some margin so it can be re-detected and aligned later"""
+    height, width = image.shape[:2]
+    if not facial_area or not facial_area.get("w") or not facial_area.get("h"):
+        return _resize_to_fit(image, CROP_MAX_SIDE)
+
+    x, y, w, h = (int(facial_area[key]) for key in ("x", "y", "w", "h"))
+    margin_x, margin_y = int(w * CROP_MARGIN), int(h * CROP_MARGIN)
+    left, top = max(0, x - margin_x), max(0, y - margin_y)
+    right, bottom = min(width, x + w + margin_x), min(height, y + h + margin_y)
+    if right <= left or bottom <= top:
+        return _resize_to_fit(image, CROP_MAX_SIDE)
+    return _resize_to_fit(image[top:bottom, left:right], CROP_MAX_SIDE)
+
+
+class PhotoStore:
+    """Deduplicated, sharded photo files keyed by SHA-256"""
+
+    def __init__(self, root: str, keep_originals: bool = False):
+        self.root = root
+        self.keep_originals = keep_originals
+
+    def path(self, photo_hash: str, kind: str = CROP) -> str:
+        return os.path.join(self.root, kind, photo_hash[:2], photo_hash[2:4], f"{photo_hash}.jpg")
+
+    def owns(self, path: str) -> bool:
+        root = os.path.abspath(self.root) + os.sep
+        return os.path.abspath(path).startswith(root)
+
+    def _write(self, path: str, data: bytes) -> None:
+        """Write atomically; an existing file is only touched so GC sees it as in use"""
+        if os.path.exists(path):
+            os.utime(path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def put(self, photo_hash: str, image_data: bytes, facial_area: Optional[Dict[str, Any]] = None) -> str:
+        """Store the face crop and thumbnail (and original if enabled); returns the crop path"""
+        crop_path = self.path(photo_hash, CROP)
+        if self.keep_originals:
+            self._write(self.path(photo_hash, ORIGINAL), image_data)
+        if os.path.exists(crop_path) and os.path.exists(self.path(photo_hash, THUMBNAIL)):
+            os.utime(crop_path)
+            os.utime(self.path(photo_hash, THUMBNAIL))
+            return crop_path
+
+        image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Failed to decode image")
+        crop = crop_face(image, facial_area)
+        self._write(crop_path, _encode_jpeg(crop, CROP_JPEG_QUALITY))
+        self._write(self.path(photo_hash, THUMBNAIL), _encode_jpeg(_resize_to_fit(crop, THUMBNAIL_SIDE), THUMBNAIL_JPEG_QUALITY))
+        return crop_path
+
+    def delete(self, photo_hash: str) -> int:
+        """Remove every stored variant of a photo; returns bytes freed"""
+        freed = 0
+        for kind in KINDS:
+            path = self.path(photo_hash, kind)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def release(self, conn: sqlite3.Connection, photos: Iterable[Tuple[str, str]]) -> int:
+        """Remove files of deleted enrollments that no remaining row references.
+
+        photos holds (photo_path, photo_hash) pairs of the deleted rows; legacy
+        paths outside the store are removed directly. Returns files removed.
+        """
+        removed = 0
+        for photo_path, photo_hash in set(photos):
+            if not photo_path:
+                continue
+            stored = self.owns(photo_path)
+            still_used = conn.execute(
+                f"SELECT 1 FROM photo_face_enrollments WHERE {'photo_hash' if stored else 'photo_path'} = ? LIMIT 1",
+                (photo_hash if stored else photo_path,)
+            ).fetchone()
+            if still_used:
+                continue
+            if stored:
+                self.delete(photo_hash)
+                removed += 1
+            elif os.path.exists(photo_path):
+                os.remove(photo_path)
+                removed += 1
+        return removed
+
+    def _stored_files(self) -> Iterator[Tuple[str, str]]:
+        """(path, photo_hash) of every file in the store, including stray temp files"""
+        for kind in KINDS:
+            for directory, _, filenames in os.walk(os.path.join(self.root, kind)):
+                for filename in filenames:
+                    yield os.path.join(directory, filename), filename.split(".", 1)[0]
+
+    def collect_garbage(self, conn: sqlite3.Connection, legacy_dirs: Iterable[str] = (),
+                        grace_seconds: float = GC_GRACE_SECONDS) -> Dict[str, int]:
+        """Delete store and legacy files that no enrollment references"""
+        referenced_hashes = {row[0] for row in conn.execute("SELECT DISTINCT photo_hash FROM photo_face_enrollments")}
+        referenced_paths = {
+            os.path.abspath(row[0])
+            for row in conn.execute("SELECT DISTINCT photo_path FROM photo_face_enrollments")
+            if row[0]
+        }
+        cutoff = time.time() - grace_seconds
+        stats = {"scanned": 0, "removed": 0, "bytes_freed": 0}
+
+        def remove(path: str) -> None:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            stats["removed"] += 1
+            stats["bytes_freed"] += size
+
+        for path, photo_hash in self._stored_files():
+            stats["scanned"] += 1
+            if path.endswith(".tmp") or photo_hash not in referenced_hashes:
+                if os.path.getmtime(path) < cutoff:
+                    remove(path)
+
+        for legacy_dir in legacy_dirs:
+            if not os.path.isdir(legacy_dir):
+                continue
+            for entry in os.scandir(legacy_dir):
+                if not entry.is_file():
+                    continue
+                stats["scanned"] += 1
+                if os.path.abspath(entry.path) not in referenced_paths and entry.stat().st_mtime < cutoff:
+                    remove(entry.path)
+
+        logger.info(f"Photo store GC removed {stats['removed']} of {stats['scanned']} files "
+                    f"({stats['bytes_freed'] / 1e6:.1f} MB)")
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed enrollment photo store")
+    parser.add_argument("command", choices=["gc"])
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    parser.add_argument("--store-dir", default=DEFAULT_STORE_DIR)
+    parser.add_argument("--legacy-dir", default=DEFAULT_LEGACY_DIR, help="Old flat upload directory to clean as well")
+    parser.add_argument("--grace-seconds", type=float, default=GC_GRACE_SECONDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    conn = sqlite3.connect(args.database, timeout=30)
+    try:
+        stats = PhotoStore(args.store_dir).collect_garbage(conn, [args.legacy_dir], args.grace_seconds)
+    finally:
+        conn.close()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
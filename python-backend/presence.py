@@ -0,0 +1,141 @@
+"""Students already present today, so repeat verifications can be short-circuited.
+
+daily_attendance holds one row per (student_id, date), written by the Node
+backend once a verification succeeds. During the morning rush many students
+retry or walk past a second kiosk after they are already marked present, and
+each of those requests would otherwise pay full inference.
+
+PresenceCache keeps the set of student IDs present on the current day. It is
+loaded from daily_attendance at startup (warm), reloaded on a daemon thread
+after the day rolls over and every refresh_interval seconds to pick up
+attendance recorded by the Node backend or other workers, and extended by this
+process as soon as it verifies a student. Requests only read the in-memory
+sets and never wait on SQLite. Days are UTC dates, like the ones the Node
+backend writes (new Date().toISOString()).
+
+Clients choose what happens to an already-present student with if_present:
+    verify     run the full verification (default); the response says already_present
+    skip       answer immediately without inference
+    downgrade  verify at enrollment priority, behind students not yet checked in
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+IF_PRESENT_VERIFY = "verify"
+IF_PRESENT_SKIP = "skip"
+IF_PRESENT_DOWNGRADE = "downgrade"
+IF_PRESENT_CHOICES = (IF_PRESENT_VERIFY, IF_PRESENT_SKIP, IF_PRESENT_DOWNGRADE)
+
+
+def today() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+class PresenceCache:
+    """Day-partitioned set of present students, warmed from daily_attendance"""
+
+    def __init__(self, database_path: str, refresh_interval: float = 30.0):
+        self.database_path = database_path
+        self.refresh_interval = refresh_interval
+        self._day: Optional[str] = None
+        self._recorded: Set[str] = set()  # Present in daily_attendance at the last refresh
+        self._verified: Set[str] = set()  # Verified by this process today, maybe not recorded yet
+        self._checked = -float("inf")
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()  # Held by the reload thread
+        self._counts = {IF_PRESENT_SKIP: 0, IF_PRESENT_DOWNGRADE: 0}
+
+    def _load(self, day: str) -> Set[str]:
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            rows = conn.execute(
+                "SELECT student_id FROM daily_attendance WHERE date = ? AND status = 'present'", (day,)
+            ).fetchall()
+        except sqlite3.OperationalError:
+            # Attendance tables not set up yet
+            rows = []
+        finally:
+            conn.close()
+        return {row[0] for row in rows}
+
+    def _refresh_in_background(self, day: str) -> None:
+        """Reload a day's attendance on a daemon thread; the caller holds _refreshing and the thread releases it"""
+        def run():
+            try:
+                recorded = self._load(day)
+                with self._lock:
+                    if day == self._day:
+                        self._recorded = recorded
+            except Exception as e:
+                logger.warning(f"Reloading attendance for {day} failed: {e}")
+            finally:
+                if day == self._day:
+                    self._checked = time.monotonic()
+                self._refreshing.release()
+
+        threading.Thread(target=run, name="presence-refresh", daemon=True).start()
+
+    def _current_day(self) -> str:
+        """Today's date; rolls the sets over at midnight and starts a reload once they are stale"""
+        day = today()
+        if day != self._day:
+            with self._lock:
+                if day != self._day:
+                    # Midnight rollover: yesterday's partition is dropped whole
+                    self._day = day
+                    self._recorded = set()
+                    self._verified = set()
+                    self._checked = -float("inf")
+        if time.monotonic() - self._checked > self.refresh_interval and self._refreshing.acquire(blocking=False):
+            self._refresh_in_background(day)
+        return day
+
+    def warm(self) -> int:
+        """Load today's attendance now rather than after the first verification"""
+        day = today()
+        with self._refreshing:
+            recorded = self._load(day)
+            with self._lock:
+                if day != self._day:
+                    self._day = day
+                    self._verified = set()
+                self._recorded = recorded
+                self._checked = time.monotonic()
+        return len(self._recorded | self._verified)
+
+    def is_present(self, student_id: str) -> bool:
+        self._current_day()
+        return student_id in self._recorded or student_id in self._verified
+
+    def mark(self, student_id: str) -> None:
+        """Record a successful verification by this process"""
+        day = self._current_day()
+        with self._lock:
+            if day == self._day:
+                self._verified.add(student_id)
+
+    def record_short_circuit(self, choice: str) -> None:
+        with self._lock:
+            self._counts[choice] += 1
+
+    def invalidate(self) -> None:
+        self._checked = -float("inf")
+
+    def stats(self) -> Dict[str, Any]:
+        day = self._current_day()
+        with self._lock:
+            return {
+                "day": day,
+                "present": len(self._recorded | self._verified),
+                "recorded": len(self._recorded),
+                "verified_here": len(self._verified - self._recorded),
+                "skipped": self._counts[IF_PRESENT_SKIP],
+                "downgraded": self._counts[IF_PRESENT_DOWNGRADE],
+            }
@@ -0,0 +1,170 @@
+"""Opt-in capture of slow requests.
+
+SlowRequestProfiler times every request and saves a report for any request
+slower than the threshold: method, path, status, wall time and the stage
+breakdown recorded by the request's RequestBudget (upload, queue, detection,
+embedding, matching). A sampled fraction of requests also runs its inference
+under cProfile; when such a request turns out to be slow, the .prof file is
+saved next to the report. At most one request per process is profiled at a
+time, so with a low sample rate the overhead stays negligible.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from budget import RequestBudget, trace_hook
+
+logger = logging.getLogger(__name__)
+
+REPORT_ID_PATTERN = re.compile(r"^\d{8}-\d{6}-\d{6}-[0-9a-f]{6}$")
+TOP_FUNCTIONS = 25  # Functions by cumulative time included in a report
+
+
+class RequestTrace:
+    """Budgets created while handling one request, and its profiler if sampled"""
+
+    def __init__(self, profile: bool):
+        self.budgets: List[RequestBudget] = []
+        self.profiler = cProfile.Profile() if profile else None
+        self.status_code: Optional[int] = None
+
+    def attach(self, budget: RequestBudget) -> None:
+        budget.profiler = self.profiler
+        self.budgets.append(budget)
+
+    def stages(self) -> Dict[str, float]:
+        merged: Dict[str, float] = {}
+        for budget in self.budgets:
+            for stage, ms in budget.timings.items():
+                merged[stage] = merged.get(stage, 0.0) + ms
+        return {stage: round(ms, 1) for stage, ms in merged.items()}
+
+
+def _top_functions(profiler: cProfile.Profile) -> List[Dict[str, Any]]:
+    stats = pstats.Stats(profiler).stats
+    ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+    return [
+        {
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": calls,
+            "total_ms": round(total * 1000, 2),
+            "cumulative_ms": round(cumulative * 1000, 2),
+        }
+        for (filename, line, name), (_, calls, total, cumulative, _) in ranked
+    ]
+
+
+class SlowRequestProfiler:
+    """Saves stage timings (and sampled cProfile output) for requests above a latency threshold"""
+
+    def __init__(self, output_dir: str, threshold_ms: float, sample_rate: float = 0.0, max_reports: int = 200):
+        self.output_dir = output_dir
+        self.threshold_ms = threshold_ms
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.max_reports = max_reports
+        self._profile_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    @contextmanager
+    def trace(self, method: str, path: str) -> Iterator[RequestTrace]:
+        """Trace one request; the caller sets trace.status_code"""
+        profile = (
+            self.sample_rate > 0
+            and random.random() < self.sample_rate
+            and self._profile_lock.acquire(blocking=False)
+        )
+        trace = RequestTrace(profile)
+        token = trace_hook.set(trace.attach)
+        started_at = datetime.now()
+        started = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            trace_hook.reset(token)
+            try:
+                if duration_ms >= self.threshold_ms:
+                    self._save(trace, method, path, started_at, duration_ms)
+            except Exception as e:
+                logger.warning(f"Failed to save slow request report for {method} {path}: {e}")
+            finally:
+                if profile:
+                    self._profile_lock.release()
+
+    def _save(self, trace: RequestTrace, method: str, path: str,
+              started_at: datetime, duration_ms: float) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        report_id = f"{started_at.strftime('%Y%m%d-%H%M%S-%f')}-{uuid.uuid4().hex[:6]}"
+        report = {
+            "report_id": report_id,
+            "method": method,
+            "path": path,
+            "status_code": trace.status_code,
+            "started_at": started_at.isoformat(),
+            "duration_ms": round(duration_ms, 1),
+            "pid": os.getpid(),
+            "stages_ms": trace.stages(),
+            "profiled": trace.profiler is not None,
+        }
+        if trace.profiler is not None:
+            trace.profiler.dump_stats(os.path.join(self.output_dir, f"{report_id}.prof"))
+            report["top_functions"] = _top_functions(trace.profiler)
+
+        with open(os.path.join(self.output_dir, f"{report_id}.json"), "w") as f:
+            json.dump(report, f, indent=2)
+        logger.warning(f"Slow request {method} {path}: {duration_ms:.0f}ms {report['stages_ms']} (report {report_id})")
+        self._prune()
+
+    def _prune(self) -> None:
+        """Keep only the newest max_reports reports"""
+        reports = sorted(name for name in os.listdir(self.output_dir) if name.endswith(".json"))
+        for name in reports[:-self.max_reports]:
+            report_id = name[:-len(".json")]
+            for suffix in (".json", ".prof"):
+                try:
+                    os.remove(os.path.join(self.output_dir, report_id + suffix))
+                except FileNotFoundError:
+                    pass
+
+    def list_reports(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Newest reports first, without the per-function breakdown"""
+        if not os.path.isdir(self.output_dir):
+            return []
+        names = sorted((name for name in os.listdir(self.output_dir) if name.endswith(".json")), reverse=True)
+        summaries = []
+        for name in names[:limit]:
+            report = self.get_report(name[:-len(".json")])
+            if report is not None:
+                report.pop("top_functions", None)
+                summaries.append(report)
+        return summaries
+
+    def get_report(self, report_id: str) -> Optional[Dict[str, Any]]:
+        if not REPORT_ID_PATTERN.match(report_id):
+            return None
+        try:
+            with open(os.path.join(self.output_dir, f"{report_id}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def profile_path(self, report_id: str) -> Optional[str]:
+        """Path of the saved cProfile output for a report, if there is one"""
+        if not REPORT_ID_PATTERN.match(report_id):
+            return None
+        path = os.path.join(self.output_dir, f"{report_id}.prof")
+        return path if os.path.exists(path) else None
@@ -0,0 +1,416 @@
+"""Reduced-dimension projections for the coarse 1:N search.
+
+Identification scores a live embedding against every gallery row, so its cost
+and memory traffic grow with N x 512 for Facenet512. A projection fitted
+offline on the current gallery maps embeddings to fewer dimensions (128 by
+default): the whole gallery is scored in the reduced space, and only the top
+candidates are re-ranked with the full embeddings, so results stay exact
+whenever the true best match is among them.
+
+Two methods are supported:
+
+    pca     top eigenvectors of the gallery's (uncentered) second-moment
+            matrix, which best preserve dot products and hence cosine scores
+    random  a random orthonormal basis; needs no fit, kept as a baseline
+
+Each fit is stored as a new version in face_projections together with a
+recall report: for a sample of gallery rows used as queries (leave-one-out),
+how often coarse search plus re-ranking finds the same best match (recall@1)
+and top 10 as an exact search, for several candidate counts. Projections are
+float32; int8 was not worth it, since numpy has no BLAS path for integer
+matmuls and the coarse scores are re-ranked anyway.
+
+Run standalone:
+    python projection.py --model Facenet512 --dim 128
+or start it from the API via POST /api/face/admin/projection.
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from gallery import PAIRWISE_BLOCK_ROWS, PROJECTION_CANDIDATES, SharedGallery, run_inline
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_PATH = "../backend/database/attendance.db"
+DEFAULT_GALLERY_DIR = "gallery"
+
+DEFAULT_DIM = 128
+METHODS = ("pca", "random")
+RECALL_SAMPLE = 1000  # Gallery rows used as leave-one-out queries in the recall report
+RECALL_CANDIDATES = (16, 32, 64, 128, 256)
+RECALL_QUERY_BLOCK = 64  # Queries scored at once (64 x 100k float32 = 25 MB per score matrix)
+RECALL_TOP = 10
+
+PROJECTION_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_projections (
+        version INTEGER PRIMARY KEY AUTOINCREMENT,
+        model_name TEXT NOT NULL,
+        method TEXT NOT NULL,
+        source_dim INTEGER NOT NULL,
+        dim INTEGER NOT NULL,
+        components BLOB NOT NULL,
+        explained_variance REAL,
+        embeddings INTEGER NOT NULL,
+        recall_report TEXT,
+        is_active INTEGER NOT NULL DEFAULT 1,
+        duration_seconds REAL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+class Projection:
+    """A fitted source_dim -> dim linear map, applied as vectors @ components"""
+
+    def __init__(self, version: int, model_name: str, method: str, components: np.ndarray):
+        self.version = version
+        self.model_name = model_name
+        self.method = method
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+
+    @property
+    def source_dim(self) -> int:
+        return int(self.components.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.components.shape[1])
+
+    def project(self, vectors: Any) -> np.ndarray:
+        return np.asarray(vectors, dtype=np.float32) @ self.components
+
+
+def _block_moment(block: np.ndarray) -> np.ndarray:
+    block = np.asarray(block, dtype=np.float64)
+    return block.T @ block
+
+
+def second_moment(matrix: np.ndarray, runner: Callable[..., Any] = run_inline) -> np.ndarray:
+    """matrix.T @ matrix / N, accumulated in row blocks so a memory-mapped gallery is read once"""
+    dim = matrix.shape[1]
+    moment = np.zeros((dim, dim), dtype=np.float64)
+    for start in range(0, matrix.shape[0], PAIRWISE_BLOCK_ROWS):
+        moment += runner(_block_moment, matrix[start:start + PAIRWISE_BLOCK_ROWS])
+    return moment / max(matrix.shape[0], 1)
+
+
+def check_dim(dim: int, method: str, count: int, source_dim: int) -> None:
+    """Raise ValueError unless a dim-D projection can be fitted to count source_dim-D embeddings"""
+    if count < 2:
+        raise ValueError(f"Not enough embeddings to fit a projection ({count})")
+    if not 0 < dim < source_dim:
+        raise ValueError(f"Projection size must be between 1 and {source_dim - 1}, got {dim}")
+    if method == "pca" and dim > count:
+        # The second moment of count rows has at most count non-zero directions
+        raise ValueError(f"A PCA projection can't have more dimensions than the gallery has embeddings ({count})")
+
+
+def fit_components(matrix: np.ndarray, dim: int, method: str, seed: int = 0,
+                   runner: Callable[..., Any] = run_inline) -> Tuple[np.ndarray, float]:
+    """(source_dim x dim components, fraction of the gallery's energy they keep)"""
+    source_dim = matrix.shape[1]
+    check_dim(dim, method, matrix.shape[0], source_dim)
+    moment = second_moment(matrix, runner)
+    if method == "pca":
+        _, eigenvectors = runner(np.linalg.eigh, moment)
+        components = eigenvectors[:, ::-1][:, :dim]
+    elif method == "random":
+        components, _ = np.linalg.qr(np.random.default_rng(seed).normal(size=(source_dim, dim)))
+    else:
+        raise ValueError(f"Unknown projection method {method}")
+    total = float(np.trace(moment))
+    kept = float(np.einsum("ij,ik,kj->", components, moment, components))
+    return components.astype(np.float32), (kept / total if total > 0 else 0.0)
+
+
+def recall_report(matrix: np.ndarray, projection: Projection, candidates: Sequence[int] = RECALL_CANDIDATES,
+                  sample: int = RECALL_SAMPLE, seed: int = 0,
+                  runner: Callable[..., Any] = run_inline) -> Dict[str, Any]:
+    """Accuracy and cost of coarse search plus re-ranking against an exact search.
+
+    Each sampled row is a query against the rest of the gallery. A query counts
+    towards recall@1 when the re-ranked best match scores as high as the exact
+    best (so ties between duplicate rows aren't misses), and recall@10 is the
+    overlap of the re-ranked and exact top 10. Each block of queries, and each
+    latency measurement, runs through runner(func, *args).
+    """
+    count = matrix.shape[0]
+    candidates = [c for c in candidates if c < count - 1]
+    if not candidates:
+        return {"queries": 0, "candidates": {}}
+    queries = np.sort(np.random.default_rng(seed).choice(count, size=min(sample, count), replace=False))
+    reduced = runner(projection.project, matrix)
+    top = min(RECALL_TOP, min(candidates))
+    hits = {c: 0 for c in candidates}
+    top_overlap = {c: 0 for c in candidates}
+
+    def score_block(block: np.ndarray) -> None:
+        rows = np.arange(block.size)
+        exact = np.asarray(matrix[block]) @ np.asarray(matrix).T
+        exact[rows, block] = -np.inf
+        coarse = reduced[block] @ reduced.T
+        coarse[rows, block] = -np.inf
+
+        exact_best = exact.max(axis=1)
+        exact_top = np.argpartition(-exact, top - 1, axis=1)[:, :top]
+        for c in candidates:
+            shortlist = np.argpartition(-coarse, c - 1, axis=1)[:, :c]
+            shortlist_scores = np.take_along_axis(exact, shortlist, axis=1)
+            hits[c] += int(np.sum(shortlist_scores.max(axis=1) >= exact_best))
+            reranked_top = np.take_along_axis(
+                shortlist, np.argpartition(-shortlist_scores, top - 1, axis=1)[:, :top], axis=1
+            )
+            top_overlap[c] += sum(len(np.intersect1d(a, b)) for a, b in zip(reranked_top, exact_top))
+
+    for start in range(0, queries.size, RECALL_QUERY_BLOCK):
+        runner(score_block, queries[start:start + RECALL_QUERY_BLOCK])
+
+    # Single-query latency, as identification runs it
+    timed = queries[:min(50, queries.size)]
+
+    def ms_per_query(c: Optional[int]) -> float:
+        started = time.perf_counter()
+        for row in timed:
+            if c is None:
+                np.argmax(np.asarray(matrix) @ np.asarray(matrix[row]))
+            else:
+                shortlist = np.argpartition(reduced @ projection.project(matrix[row]), -c)[-c:]
+                np.argmax(np.asarray(matrix[shortlist]) @ np.asarray(matrix[row]))
+        return (time.perf_counter() - started) * 1000 / timed.size
+
+    exact_ms = runner(ms_per_query, None)
+    coarse_ms = {c: runner(ms_per_query, c) for c in candidates}
+
+    return {
+        "queries": int(queries.size),
+        "embeddings": int(count),
+        "bytes_per_embedding": {"full": projection.source_dim * 4, "reduced": projection.dim * 4},
+        "exact_ms_per_query": round(exact_ms, 3),
+        "candidates": {
+            str(c): {
+                "recall_at_1": round(hits[c] / queries.size, 4),
+                f"recall_at_{top}": round(top_overlap[c] / (queries.size * top), 4),
+                "ms_per_query": round(coarse_ms[c], 3),
+            }
+            for c in candidates
+        },
+    }
+
+
+class ProjectionJob:
+    """Fits, evaluates and stores a projection for one model's gallery"""
+
+    def __init__(self, database_path: str, gallery: SharedGallery, model_name: str,
+                 dim: int = DEFAULT_DIM, method: str = "pca", activate: bool = True,
+                 runner: Callable[..., Any] = run_inline):
+        self.database_path = database_path
+        self.gallery = gallery
+        self.model_name = model_name
+        self.dim = dim
+        self.method = method
+        self.activate = activate
+        self.runner = runner  # Runs each block of the fit and the recall report, e.g. through the inference scheduler
+
+    def run(self) -> Dict[str, Any]:
+        started = time.perf_counter()
+        view = self.gallery.sync(self.model_name)
+        if len(view) < 2:
+            raise ValueError(f"Not enough {self.model_name} embeddings to fit a projection")
+        logger.info(f"Fitting {self.dim}-D {self.method} projection for {self.model_name} over {len(view)} embeddings")
+
+        matrix = view.matrix
+        components, explained = fit_components(matrix, self.dim, self.method, runner=self.runner)
+        report = recall_report(matrix, Projection(0, self.model_name, self.method, components), runner=self.runner)
+        duration = time.perf_counter() - started
+
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            conn.execute(PROJECTION_SCHEMA)
+            if self.activate:
+                conn.execute("UPDATE face_projections SET is_active = 0 WHERE model_name = ?", (self.model_name,))
+            cursor = conn.execute("""
+                INSERT INTO face_projections (
+                    model_name, method, source_dim, dim, components, explained_variance,
+                    embeddings, recall_report, is_active, duration_seconds
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                self.model_name, self.method, components.shape[0], self.dim, components.astype("<f4").tobytes(),
+                round(explained, 4), len(view), json.dumps(report), int(self.activate), round(duration, 3)
+            ))
+            version = cursor.lastrowid
+            conn.commit()
+        finally:
+            conn.close()
+
+        summary = {
+            "version": version,
+            "model_name": self.model_name,
+            "method": self.method,
+            "dim": self.dim,
+            "explained_variance": round(explained, 4),
+            "embeddings": len(view),
+            "active": self.activate,
+            "recall_report": report,
+            "duration_seconds": round(duration, 3),
+        }
+        logger.info(f"Projection version {version} for {self.model_name}: "
+                    f"{json.dumps(report['candidates'].get(str(PROJECTION_CANDIDATES)))}")
+        return summary
+
+
+def active_projection(database_path: str, model_name: str) -> Optional[Dict[str, Any]]:
+    """Summary and recall report of a model's active projection, without the components"""
+    conn = sqlite3.connect(database_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        row = conn.execute("""
+            SELECT version, model_name, method, source_dim, dim, explained_variance, embeddings,
+                   recall_report, duration_seconds, created_at
+            FROM face_projections WHERE model_name = ? AND is_active = 1 ORDER BY version DESC LIMIT 1
+        """, (model_name,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    summary = dict(row)
+    summary["recall_report"] = json.loads(summary["recall_report"]) if summary["recall_report"] else None
+    return summary
+
+
+def disable_projections(database_path: str, model_name: str) -> bool:
+    """Switch a model back to exact search; returns False if no projection was active"""
+    conn = sqlite3.connect(database_path, timeout=30)
+    try:
+        cursor = conn.execute(
+            "UPDATE face_projections SET is_active = 0 WHERE model_name = ? AND is_active = 1", (model_name,)
+        )
+        conn.commit()
+        return cursor.rowcount > 0
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+class ProjectionRegistry:
+    """In-memory active projection per model, reloaded when a newer version is activated.
+
+    Only a model's first load reads SQLite on the caller's thread; after that a
+    daemon thread picks up new versions. With a gallery, a new projection is
+    applied to the current view before it is published, so no search pays for
+    projecting the whole gallery.
+    """
+
+    def __init__(self, database_path: str, refresh_interval: float = 30.0,
+                 gallery: Optional[SharedGallery] = None):
+        self.database_path = database_path
+        self.refresh_interval = refresh_interval
+        self.gallery = gallery
+        self._projections: Dict[str, Optional[Projection]] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self, model_name: str) -> None:
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        try:
+            version = conn.execute(
+                "SELECT MAX(version) FROM face_projections WHERE model_name = ? AND is_active = 1", (model_name,)
+            ).fetchone()[0]
+            current = self._projections.get(model_name)
+            if version is None:
+                self._projections[model_name] = None
+            elif current is None or current.version != version:
+                method, source_dim, dim, components = conn.execute(
+                    "SELECT method, source_dim, dim, components FROM face_projections WHERE version = ?", (version,)
+                ).fetchone()
+                projection = Projection(
+                    version, model_name, method, np.frombuffer(components, dtype="<f4").reshape(source_dim, dim)
+                )
+                if self.gallery is not None:
+                    try:
+                        self.gallery.view(model_name).prepare(projection)
+                    except Exception as e:
+                        logger.warning(f"Could not apply {model_name} projection {version} ahead of searches: {e}")
+                self._projections[model_name] = projection
+        except sqlite3.OperationalError:
+            # No projection has been fitted yet
+            self._projections[model_name] = None
+        finally:
+            conn.close()
+
+    def _refresh_in_background(self, model_name: str) -> None:
+        """Reload a model on a daemon thread; the caller holds _lock and the thread releases it"""
+        def run():
+            try:
+                self._refresh(model_name)
+            except Exception as e:
+                logger.warning(f"Reloading {model_name} projection failed: {e}")
+            finally:
+                self._checked[model_name] = time.monotonic()
+                self._lock.release()
+
+        threading.Thread(target=run, name="projection-refresh", daemon=True).start()
+
+    def warm(self, model_name: str) -> Optional[Projection]:
+        """Load (and apply) a model's projection now rather than on its first search"""
+        with self._lock:
+            self._refresh(model_name)
+            self._checked[model_name] = time.monotonic()
+        return self._projections.get(model_name)
+
+    def get(self, model_name: str) -> Optional[Projection]:
+        now = time.monotonic()
+        if now - self._checked.get(model_name, -np.inf) > self.refresh_interval:
+            if model_name not in self._projections:
+                # Nothing cached to answer with yet
+                with self._lock:
+                    if model_name not in self._projections:
+                        self._refresh(model_name)
+                        self._checked[model_name] = now
+            elif self._lock.acquire(blocking=False):
+                self._refresh_in_background(model_name)
+        return self._projections.get(model_name)
+
+    def invalidate(self, model_name: str) -> None:
+        self._checked.pop(model_name, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit a reduced-dimension projection for coarse gallery search")
+    parser.add_argument("--model", required=True)
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--method", choices=METHODS, default="pca")
+    parser.add_argument("--no-activate", action="store_true", help="Only store the projection and its recall report")
+    parser.add_argument("--disable", action="store_true", help="Switch the model back to exact search")
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    parser.add_argument("--gallery-dir", default=DEFAULT_GALLERY_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.disable:
+        if not disable_projections(args.database, args.model):
+            parser.exit(1, f"No active projection for {args.model}\n")
+        return
+    job = ProjectionJob(
+        args.database,
+        SharedGallery(args.database, args.gallery_dir),
+        args.model,
+        dim=args.dim,
+        method=args.method,
+        activate=not args.no_activate
+    )
+    print(json.dumps(job.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Background re-embedding of stored enrollment photos for model migrations.
+
+verify_face only compares against rows enrolled with the requested model, so
+switching DEFAULT_MODEL would strand every existing enrollment. This job reads
+the stored photo_path files, embeds them in batches with the target model and
+inserts the new rows next to the old ones. Progress is checkpointed in SQLite
+so an interrupted run resumes where it stopped, and a CPU budget throttles the
+job between batches. Rows that fail are recorded and retried on the next run
+(up to max_attempts) instead of being left behind the checkpoint.
+
+The target-model twin of a row shares its student and photo, so the job needs
+photo_face_enrollments keyed on (student_id, model_name, photo_hash). Older
+databases are keyed on student_id alone; run `python migrate.py` once first.
+The job refuses to start until then.
+
+Run standalone:
+    python reembed.py --target-model Facenet --source-model Facenet512
+or start it from the API via POST /api/face/admin/reembed.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from migrate import enrollments_keyed_per_photo
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_PATH = "../backend/database/attendance.db"
+DEFAULT_DETECTOR_BACKEND = "opencv"
+
+CHECKPOINT_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_reembedding_checkpoints (
+        job_key TEXT PRIMARY KEY,
+        source_model TEXT,
+        target_model TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        last_enrollment_id INTEGER NOT NULL DEFAULT 0,
+        processed INTEGER NOT NULL DEFAULT 0,
+        succeeded INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        images_per_second REAL,
+        started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+FAILURES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS face_reembedding_failures (
+        job_key TEXT NOT NULL,
+        enrollment_id INTEGER NOT NULL,
+        reason TEXT,
+        attempts INTEGER NOT NULL DEFAULT 1,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (job_key, enrollment_id)
+    )
+"""
+
+# runner(func, *args) executes one batch of inference (e.g. through the scheduler)
+InferenceRunner = Callable[..., Any]
+
+
+def _direct_runner(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return func(*args, **kwargs)
+
+
+def job_key(target_model: str, source_model: Optional[str] = None) -> str:
+    return f"{source_model or '*'}->{target_model}"
+
+
+def read_checkpoint(database_path: str, key: str) -> Dict[str, Any]:
+    """A job's checkpoint, without creating the table (status polling must not take the write lock)"""
+    conn = sqlite3.connect(database_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    try:
+        row = conn.execute("SELECT * FROM face_reembedding_checkpoints WHERE job_key = ?", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        # No job has run yet
+        row = None
+    finally:
+        conn.close()
+    return dict(row) if row else {"job_key": key, "status": "not_started"}
+
+
+class BatchEmbedder:
+    """Embeds many photos with one model.predict call per batch.
+
+    Detection and alignment run per photo exactly as DeepFace.represent does,
+    then the aligned faces are stacked and embedded together.
+    """
+
+    def __init__(self, model_name: str, detector_backend: str = DEFAULT_DETECTOR_BACKEND):
+        from deepface import DeepFace
+        from deepface.commons import functions
+
+        self.model_name = model_name
+        self.detector_backend = detector_backend
+        self.model = DeepFace.build_model(model_name)
+        self.target_size = functions.find_target_size(model_name=model_name)
+        self._functions = functions
+
+    def prepare(self, photo_path: str) -> np.ndarray:
+        """Detect, align and normalize the first face in a photo"""
+        face_objs = self._functions.extract_faces(
+            img=photo_path,
+            target_size=self.target_size,
+            detector_backend=self.detector_backend,
+            grayscale=False,
+            enforce_detection=True,
+            align=True
+        )
+        face, _, _ = face_objs[0]
+        return self._functions.normalize_input(img=face, normalization="base")
+
+    def embed(self, faces: List[np.ndarray]) -> np.ndarray:
+        return self.model.predict(np.concatenate(faces, axis=0), verbose=0)
+
+
+class ReembeddingJob:
+    """Resumable re-embedding of one source model's enrollments into a target model"""
+
+    def __init__(self, database_path: str, target_model: str, source_model: Optional[str] = None,
+                 batch_size: int = 32, cpu_budget: float = 0.5,
+                 detector_backend: str = DEFAULT_DETECTOR_BACKEND,
+                 runner: InferenceRunner = _direct_runner, max_attempts: int = 3):
+        if not 0 < cpu_budget <= 1:
+            raise ValueError("cpu_budget must be in (0, 1]")
+        self.database_path = database_path
+        self.target_model = target_model
+        self.source_model = source_model
+        self.batch_size = batch_size
+        self.cpu_budget = cpu_budget
+        self.detector_backend = detector_backend
+        self.runner = runner
+        self.max_attempts = max_attempts
+        self.job_key = job_key(target_model, source_model)
+        self._stop = threading.Event()
+        self._embedder: Optional[BatchEmbedder] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.database_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def checkpoint(self) -> Dict[str, Any]:
+        return read_checkpoint(self.database_path, self.job_key)
+
+    def schema_ready(self) -> bool:
+        """Whether photo_face_enrollments can hold the target-model twins (see migrate.py)"""
+        conn = self._connect()
+        try:
+            return enrollments_keyed_per_photo(conn)
+        finally:
+            conn.close()
+
+    def _load_checkpoint(self, conn: sqlite3.Connection) -> sqlite3.Row:
+        conn.execute(CHECKPOINT_SCHEMA)
+        conn.execute(FAILURES_SCHEMA)
+        conn.execute("""
+            INSERT OR IGNORE INTO face_reembedding_checkpoints (job_key, source_model, target_model)
+            VALUES (?, ?, ?)
+        """, (self.job_key, self.source_model, self.target_model))
+        conn.execute("""
+            UPDATE face_reembedding_checkpoints
+            SET status = 'running', updated_at = CURRENT_TIMESTAMP
+            WHERE job_key = ?
+        """, (self.job_key,))
+        conn.commit()
+        return conn.execute(
+            "SELECT * FROM face_reembedding_checkpoints WHERE job_key = ?",
+            (self.job_key,)
+        ).fetchone()
+
+    def _next_batch(self, conn: sqlite3.Connection, after_id: int, retrying: bool = False) -> List[sqlite3.Row]:
+        """Active source rows after after_id with no target-model twin yet
+
+        With retrying, only rows that failed in an earlier run and still have
+        attempts left.
+        """
+        source_filter = "AND src.model_name = ?" if self.source_model else "AND src.model_name != ?"
+        params: List[Any] = [after_id, self.source_model or self.target_model]
+        retry_filter = ""
+        if retrying:
+            retry_filter = """AND src.id IN (
+                SELECT enrollment_id FROM face_reembedding_failures WHERE job_key = ? AND attempts < ?
+            )"""
+            params += [self.job_key, self.max_attempts]
+        return conn.execute(f"""
+            SELECT src.*
+            FROM photo_face_enrollments src
+            WHERE src.id > ? AND src.is_active = 1 {source_filter} {retry_filter}
+              AND NOT EXISTS (
+                  SELECT 1 FROM photo_face_enrollments dst
+                  WHERE dst.student_id = src.student_id
+                    AND dst.photo_hash = src.photo_hash
+                    AND dst.model_name = ?
+              )
+            ORDER BY src.id
+            LIMIT ?
+        """, (*params, self.target_model, self.batch_size)).fetchall()
+
+    def _embed_batch(self, rows: List[sqlite3.Row]) -> Tuple[List[Tuple[sqlite3.Row, List[float]]], List[Tuple[sqlite3.Row, str]]]:
+        """Embed a batch; returns (row, embedding) pairs and (row, reason) failures"""
+        if self._embedder is None:
+            self._embedder = BatchEmbedder(self.target_model, self.detector_backend)
+
+        prepared, faces, failures = [], [], []
+        for row in rows:
+            if not os.path.exists(row["photo_path"]):
+                logger.warning(f"Re-embedding: photo missing for enrollment {row['id']}: {row['photo_path']}")
+                failures.append((row, "photo missing"))
+                continue
+            try:
+                faces.append(self._embedder.prepare(row["photo_path"]))
+                prepared.append(row)
+            except Exception as e:
+                logger.warning(f"Re-embedding: no face in enrollment {row['id']}: {e}")
+                failures.append((row, f"no face: {e}"))
+
+        if not faces:
+            return [], failures
+
+        embeddings = self._embedder.embed(faces)
+        return [(row, embedding.tolist()) for row, embedding in zip(prepared, embeddings)], failures
+
+    def _insert(self, conn: sqlite3.Connection, row: sqlite3.Row, embedding: List[float]) -> Optional[str]:
+        """Insert the target-model twin of a source row; returns the failure reason, if any"""
+        columns = ["student_id", "photo_path", "photo_hash", "deepface_embedding",
+                   "face_confidence", "photo_quality_score", "enrollment_method",
+                   "model_name", "detector_backend"]
+        values = [row["student_id"], row["photo_path"], row["photo_hash"], json.dumps(embedding),
+                  row["face_confidence"], row["photo_quality_score"], "reembedding",
+                  self.target_model, self.detector_backend]
+        if "photo_angle" in row.keys():
+            columns.append("photo_angle")
+            values.append(row["photo_angle"])
+
+        try:
+            conn.execute(
+                f"INSERT INTO photo_face_enrollments ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                values
+            )
+            return None
+        except sqlite3.IntegrityError as e:
+            # e.g. the photo was already enrolled with the target model
+            logger.warning(f"Re-embedding: could not insert {self.target_model} row for enrollment {row['id']}: {e}")
+            return str(e)
+
+    def _record(self, conn: sqlite3.Connection, enrollment_id: int, reason: Optional[str]) -> None:
+        """Clear or count a failure for one source row"""
+        if reason is None:
+            conn.execute(
+                "DELETE FROM face_reembedding_failures WHERE job_key = ? AND enrollment_id = ?",
+                (self.job_key, enrollment_id)
+            )
+        else:
+            conn.execute("""
+                INSERT INTO face_reembedding_failures (job_key, enrollment_id, reason) VALUES (?, ?, ?)
+                ON CONFLICT (job_key, enrollment_id) DO UPDATE
+                SET attempts = attempts + 1, reason = excluded.reason, updated_at = CURRENT_TIMESTAMP
+            """, (self.job_key, enrollment_id, reason))
+
+    def run(self) -> Dict[str, Any]:
+        """Process batches until done or stopped; safe to call again to resume"""
+        self._stop.clear()
+        if not self.schema_ready():
+            raise RuntimeError("photo_face_enrollments has no room for model twins; run `python migrate.py` first")
+        conn = self._connect()
+        try:
+            checkpoint = self._load_checkpoint(conn)
+            last_id = checkpoint["last_enrollment_id"]
+            run_started = time.perf_counter()
+            run_processed = 0
+            retry_after: Optional[int] = 0
+            logger.info(f"Re-embedding {self.job_key} resuming after enrollment {last_id}")
+
+            while not self._stop.is_set():
+                # Earlier failures behind the checkpoint first, then new rows after it
+                rows = self._next_batch(conn, retry_after, retrying=True) if retry_after is not None else []
+                if rows:
+                    retry_after = rows[-1]["id"]
+                else:
+                    retry_after = None
+                    rows = self._next_batch(conn, last_id)
+                    if not rows:
+                        break
+                    last_id = rows[-1]["id"]
+
+                batch_started = time.perf_counter()
+                results, failures = self.runner(self._embed_batch, rows)
+                reasons = {row["id"]: reason for row, reason in failures}
+                for row, embedding in results:
+                    reasons[row["id"]] = self._insert(conn, row, embedding)
+                for row in rows:
+                    self._record(conn, row["id"], reasons.get(row["id"]))
+                succeeded = sum(1 for reason in reasons.values() if reason is None)
+                batch_time = time.perf_counter() - batch_started
+
+                run_processed += len(rows)
+                throughput = run_processed / max(time.perf_counter() - run_started, 1e-9)
+                # failed counts rows still without a twin, not every failed attempt
+                conn.execute("""
+                    UPDATE face_reembedding_checkpoints
+                    SET last_enrollment_id = ?, processed = processed + ?, succeeded = succeeded + ?,
+                        failed = (SELECT COUNT(*) FROM face_reembedding_failures WHERE job_key = ?),
+                        images_per_second = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE job_key = ?
+                """, (last_id, len(rows), succeeded, self.job_key, round(throughput, 3), self.job_key))
+                conn.commit()
+                logger.info(f"Re-embedding {self.job_key}: batch of {len(rows)} in {batch_time:.2f}s "
+                            f"({len(rows) / batch_time:.2f} images/sec, {throughput:.2f} overall)")
+
+                # Stay within the CPU budget by idling in proportion to the work done
+                idle = batch_time * (1 - self.cpu_budget) / self.cpu_budget
+                if idle > 0:
+                    self._stop.wait(idle)
+
+            status = "stopped" if self._stop.is_set() else "completed"
+            conn.execute("""
+                UPDATE face_reembedding_checkpoints
+                SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE job_key = ?
+            """, (status, self.job_key))
+            conn.commit()
+        except Exception:
+            conn.execute(
+                "UPDATE face_reembedding_checkpoints SET status = 'failed', updated_at = CURRENT_TIMESTAMP WHERE job_key = ?",
+                (self.job_key,)
+            )
+            conn.commit()
+            raise
+        finally:
+            conn.close()
+
+        result = self.checkpoint()
+        logger.info(f"Re-embedding {self.job_key} {result['status']}: {result['succeeded']} embedded, "
+                    f"{result['failed']} failed, {result['images_per_second']} images/sec")
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed stored enrollment photos with a new model")
+    parser.add_argument("--target-model", required=True)
+    parser.add_argument("--source-model", default=None, help="Only re-embed rows from this model (default: any other model)")
+    parser.add_argument("--database", default=DEFAULT_DATABASE_PATH)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--cpu-budget", type=float, default=0.5, help="Fraction of wall time spent working (0-1]")
+    parser.add_argument("--detector-backend", default=DEFAULT_DETECTOR_BACKEND)
+    parser.add_argument("--max-attempts", type=int, default=3, help="Attempts per photo, across runs, before it is left alone")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    job = ReembeddingJob(
+        args.database,
+        args.target_model,
+        source_model=args.source_model,
+        batch_size=args.batch_size,
+        cpu_budget=args.cpu_budget,
+        detector_backend=args.detector_backend,
+        max_attempts=args.max_attempts
+    )
+    print(json.dumps(job.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
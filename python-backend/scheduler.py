@@ -0,0 +1,203 @@
+"""Priority scheduling for inference work.
+
+Verification and identification are latency-critical (a student is waiting at
+the door), enrollment is not, and background maintenance such as re-embedding
+can wait indefinitely. Every DeepFace call goes through one InferenceScheduler
+per process, which hands out a fixed number of inference slots by priority,
+caps how many slots each class may hold, and keeps some slots free for the
+highest class so a bulk import can never occupy them all.
+"""
+
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+import numpy as np
+
+from budget import DeadlineExceeded, RequestBudget
+
+logger = logging.getLogger(__name__)
+
+# Workload classes in priority order (lower value runs first)
+VERIFY = "verify"
+ENROLL = "enroll"
+MAINTENANCE = "maintenance"
+PRIORITIES = {VERIFY: 0, ENROLL: 1, MAINTENANCE: 2}
+
+METRICS_WINDOW = 1000  # Recent samples kept per class for percentiles
+
+
+class _ClassStats:
+    def __init__(self):
+        self.running = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.queue_times: Deque[float] = deque(maxlen=METRICS_WINDOW)
+        self.run_times: Deque[float] = deque(maxlen=METRICS_WINDOW)
+
+
+def _percentiles(samples: Deque[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    values = np.fromiter(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+class InferenceScheduler:
+    """Hands out inference slots by priority class with per-class caps"""
+
+    def __init__(self, max_concurrency: int, class_limits: Optional[Dict[str, int]] = None,
+                 reserved_for_verify: int = 1, max_waiting_threads: int = 64):
+        self.max_concurrency = max(1, max_concurrency)
+        # Lower classes may never take the slots kept free for verification
+        self.reserved_for_verify = min(reserved_for_verify, self.max_concurrency - 1)
+        self.class_limits = {workload: self.max_concurrency for workload in PRIORITIES}
+        self.class_limits.update(class_limits or {})
+
+        self._cond = threading.Condition()
+        self._waiting: List[tuple] = []
+        self._sequence = itertools.count()
+        self._running_total = 0
+        self._stats = {workload: _ClassStats() for workload in PRIORITIES}
+        # Threads that wait for a slot on behalf of async callers
+        self._executor = ThreadPoolExecutor(max_workers=max_waiting_threads, thread_name_prefix="inference")
+
+    def _limit(self, workload: str) -> int:
+        limit = self.class_limits[workload]
+        if workload != VERIFY:
+            limit = min(limit, self.max_concurrency - self.reserved_for_verify)
+        return limit
+
+    def _has_capacity(self, workload: str) -> bool:
+        if self._running_total >= self.max_concurrency:
+            return False
+        if self._stats[workload].running >= self._limit(workload):
+            return False
+        if workload != VERIFY:
+            lower_running = sum(self._stats[w].running for w in PRIORITIES if w != VERIFY)
+            if lower_running >= self.max_concurrency - self.reserved_for_verify:
+                return False
+        return True
+
+    def _is_next(self, ticket: tuple) -> bool:
+        """A ticket may start if it fits and no earlier/higher-priority ticket that fits is waiting"""
+        if not self._has_capacity(ticket[2]):
+            return False
+        for other in self._waiting:
+            if other < ticket and self._has_capacity(other[2]):
+                return False
+        return True
+
+    def _acquire(self, workload: str, deadline: Optional[float] = None) -> float:
+        """Block until a slot is granted; returns the time spent queued.
+
+        Raises DeadlineExceeded if the deadline (a perf_counter value) passes first.
+        """
+        if workload not in PRIORITIES:
+            raise ValueError(f"Unknown workload class: {workload}")
+
+        enqueued = time.perf_counter()
+        ticket = (PRIORITIES[workload], next(self._sequence), workload)
+        with self._cond:
+            self._waiting.append(ticket)
+            self._stats[workload].waiting += 1
+            try:
+                while not self._is_next(ticket):
+                    timeout = None if deadline is None else deadline - time.perf_counter()
+                    if timeout is not None and timeout <= 0:
+                        self._stats[workload].timed_out += 1
+                        raise DeadlineExceeded("inference slot")
+                    self._cond.wait(timeout)
+            finally:
+                self._waiting.remove(ticket)
+                self._stats[workload].waiting -= 1
+                # Our departure may let a lower-priority ticket start
+                self._cond.notify_all()
+            self._stats[workload].running += 1
+            self._running_total += 1
+            queue_time = time.perf_counter() - enqueued
+            self._stats[workload].queue_times.append(queue_time)
+        return queue_time
+
+    def _release(self, workload: str, run_time: float, failed: bool) -> None:
+        with self._cond:
+            stats = self._stats[workload]
+            stats.running -= 1
+            self._running_total -= 1
+            stats.run_times.append(run_time)
+            if failed:
+                stats.failed += 1
+            else:
+                stats.completed += 1
+            self._cond.notify_all()
+
+    def run_sync(self, workload: str, func: Callable[..., Any], *args,
+                 budget: Optional[RequestBudget] = None, **kwargs) -> Any:
+        """Run func in the calling thread once a slot for the workload class is free.
+
+        With a budget, queueing gives up at the request deadline, the time
+        spent waiting is recorded as the "queue" stage, and func runs under the
+        request's profiler when the request was sampled for profiling.
+        """
+        queue_time = self._acquire(workload, budget.deadline if budget else None)
+        if budget:
+            budget.record("queue", queue_time)
+        started = time.perf_counter()
+        failed = False
+        try:
+            if budget:
+                with budget.profiled():
+                    return func(*args, **kwargs)
+            return func(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._release(workload, time.perf_counter() - started, failed)
+
+    async def run(self, workload: str, func: Callable[..., Any], *args,
+                  budget: Optional[RequestBudget] = None, **kwargs) -> Any:
+        """Run blocking func off the event loop under the scheduler"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(self.run_sync, workload, func, *args, budget=budget, **kwargs)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            classes = {
+                workload: {
+                    "priority": PRIORITIES[workload],
+                    "limit": self._limit(workload),
+                    "running": stats.running,
+                    "waiting": stats.waiting,
+                    "completed": stats.completed,
+                    "failed": stats.failed,
+                    "timed_out": stats.timed_out,
+                    "queue_time": _percentiles(stats.queue_times),
+                    "run_time": _percentiles(stats.run_times),
+                }
+                for workload, stats in self._stats.items()
+            }
+            running_total = self._running_total
+
+        return {
+            "max_concurrency": self.max_concurrency,
+            "reserved_for_verify": self.reserved_for_verify,
+            "running": running_total,
+            "classes": classes,
+        }
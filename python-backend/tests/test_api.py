@@ -0,0 +1,126 @@
+"""API tests against main.app with loadtest's FakeDeepFace in place of the real models"""
+
+import os
+import sqlite3
+
+import cv2
+import numpy as np
+import pytest
+
+import loadtest
+
+# main imports these at module level even though FakeDeepFace replaces DeepFace
+for module in ("tensorflow", "sklearn", "matplotlib"):
+    pytest.importorskip(module)
+
+DATABASE = "../backend/database/attendance.db"
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    """One app for the module, in a fresh working directory laid out like the repo"""
+    from fastapi.testclient import TestClient
+
+    root = tmp_path_factory.mktemp("app")
+    os.makedirs(root / "backend" / "database")
+    os.makedirs(root / "python-backend")
+    conn = sqlite3.connect(root / "backend" / "database" / "attendance.db")
+    conn.executescript(loadtest.ENROLLMENTS_SCHEMA)
+    conn.close()
+
+    patch = pytest.MonkeyPatch()
+    patch.setenv("FACE_FAKE_DETECT_MS", "0")
+    patch.setenv("FACE_FAKE_EMBED_MS", "0")
+    patch.chdir(root / "python-backend")
+    try:
+        with TestClient(loadtest.create_app()) as client:
+            yield client
+    finally:
+        patch.undo()
+
+
+def reencoded(frame, quality=80):
+    image = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    assert ok
+    return encoded.tobytes()
+
+
+def enroll(client, index):
+    response = client.post(
+        "/api/face/enroll",
+        data={"student_id": f"C{index}"},
+        files={"photo": ("photo.jpg", loadtest.student_frame(index, 0), "image/jpeg")}
+    )
+    assert response.status_code == 200, response.text
+    return response.json()["enrollment_id"]
+
+
+def verify(client, index, frame):
+    response = client.post(
+        "/api/face/verify",
+        data={"student_id": f"C{index}"},
+        files={"photo": ("frame.jpg", frame, "image/jpeg")}
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def pages(client, limit, **filters):
+    cursor = None
+    while True:
+        params = {"limit": limit, **filters}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/api/face/enrollments", params=params)
+        assert response.status_code == 200, response.text
+        page = response.json()
+        yield page
+        cursor = page["next_cursor"]
+        if not page["has_more"]:
+            assert cursor is None
+            return
+
+
+def test_enrollment_keyset_cursor(client):
+    ids = [enroll(client, index) for index in range(100, 107)]
+    conn = sqlite3.connect(DATABASE)
+    # Rows enrolled in the same second are ordered by id
+    conn.execute("UPDATE photo_face_enrollments SET enrollment_date = '2026-01-01 08:00:00' WHERE id IN (?, ?, ?)",
+                 ids[1:4])
+    conn.commit()
+    expected = [row[0] for row in conn.execute(
+        "SELECT id FROM photo_face_enrollments ORDER BY enrollment_date DESC, id DESC"
+    )]
+    conn.close()
+
+    listed = []
+    for page in pages(client, 3):
+        if not listed:
+            assert page["total_count"] == len(expected)
+        listed.extend(row["id"] for row in page["enrollments"])
+        if len(listed) == 3:
+            # Enrolled mid-listing: newer than the cursor, so it neither shows up nor shifts later pages
+            enroll(client, 107)
+
+    assert listed == expected
+
+
+def test_invalid_enrollment_cursor(client):
+    response = client.get("/api/face/enrollments", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_verify_reuses_the_embedding_of_a_repeated_frame(client):
+    enroll(client, 200)
+    frame = loadtest.student_frame(200, 1)
+
+    first = verify(client, 200, frame)
+    assert first["verified"] and first["cached"] is None
+    again = verify(client, 200, frame)
+    assert again["verified"] and again["cached"] == "exact"
+    resent = verify(client, 200, reencoded(frame))
+    assert resent["verified"] and resent["cached"] == "perceptual"
+
+    cache = client.get("/api/face/metrics").json()["verify_cache"]
+    assert cache["exact_hits"] >= 1 and cache["perceptual_hits"] >= 1
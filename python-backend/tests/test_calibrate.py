@@ -0,0 +1,70 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from calibrate import CalibrationJob, latest_run
+from gallery import GalleryView
+
+
+class FixedGallery:
+    """SharedGallery stand-in that always serves the same view"""
+
+    def __init__(self, view):
+        self.view = view
+
+    def sync(self, model_name):
+        return self.view
+
+
+def make_view(rows_per_student):
+    """Students S0..Sn, each with its own direction plus small per-photo noise"""
+    rng = np.random.default_rng(0)
+    student_ids, vectors = [], []
+    for index, rows in enumerate(rows_per_student):
+        center = rng.standard_normal(128)
+        for _ in range(rows):
+            student_ids.append(f"S{index}")
+            vectors.append(center + 0.3 * rng.standard_normal(128))
+    matrix = np.array(vectors, dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    ids = np.arange(1, len(student_ids) + 1, dtype=np.int64)
+    return GalleryView("Facenet512", 1, ids, np.array(student_ids, dtype="S"), matrix)
+
+
+def stored_thresholds(database):
+    conn = sqlite3.connect(database)
+    try:
+        return dict(conn.execute("SELECT student_id, run_id FROM face_student_thresholds").fetchall())
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def database(tmp_path):
+    return str(tmp_path / "attendance.db")
+
+
+def test_single_enrollment_students_are_skipped(database):
+    view = make_view([3] * 30 + [1] * 5)
+
+    summary = CalibrationJob(database, FixedGallery(view), "Facenet512").run()
+
+    assert summary["skipped_reason"] is None
+    assert summary["genuine_pairs"] == 90
+    assert (summary["students"], summary["skipped_students"]) == (30, 5)
+    assert set(stored_thresholds(database)) == {f"S{index}" for index in range(30)}
+
+
+def test_run_without_enough_genuine_pairs_keeps_previous_thresholds(database):
+    first = CalibrationJob(database, FixedGallery(make_view([3] * 30)), "Facenet512").run()
+
+    # One row per student, as before multi-angle enrollments were kept
+    summary = CalibrationJob(database, FixedGallery(make_view([1] * 100)), "Facenet512").run()
+
+    assert summary["skipped_reason"] == "0 genuine pairs, need at least 50"
+    assert (summary["students"], summary["skipped_students"]) == (0, 100)
+    assert set(stored_thresholds(database).values()) == {first["run_id"]}
+    run = latest_run(database, "Facenet512")
+    assert run["run_id"] == summary["run_id"]
+    assert run["skipped_reason"] == summary["skipped_reason"]
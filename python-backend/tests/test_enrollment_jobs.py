@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from enrollment_jobs import JOBS_SCHEMA, EnrollmentJobQueue
+
+PHOTOS = [("front", b"front-bytes"), ("left_profile", b"left-bytes"), ("right_profile", b"right-bytes")]
+
+
+class FakeEnrollments:
+    """Handler that enrolls a student once, like process_multi_enrollment with its duplicate check"""
+
+    def __init__(self):
+        self.enrolled = set()
+        self.calls = []
+
+    def __call__(self, student_id, photos, model_name, progress):
+        self.calls.append(student_id)
+        for angle, _ in photos:
+            progress(angle, "stored")
+        if student_id in self.enrolled:
+            return 409, {"success": False, "error": f"Student {student_id} already enrolled"}
+        self.enrolled.add(student_id)
+        return 200, {"success": True, "student_id": student_id}
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "attendance.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(JOBS_SCHEMA)
+    conn.close()
+    return path
+
+
+def wait_until_finished(queue, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Job {job_id} did not finish: {queue.get(job_id)}")
+
+
+def test_retry_while_queued_reuses_job(database, tmp_path):
+    queue = EnrollmentJobQueue(database, str(tmp_path / "jobs"), FakeEnrollments())
+    first = queue.submit("S1", "Facenet512", PHOTOS)
+    retry = queue.submit("S1", "Facenet512", PHOTOS)
+    other = queue.submit("S1", "Facenet512", PHOTOS[:2])
+    assert retry["job_id"] == first["job_id"]
+    assert other["job_id"] != first["job_id"]
+    assert queue.counts() == {"queued": 2}
+
+
+def test_resubmit_after_delete_enrolls_again(database, tmp_path):
+    handler = FakeEnrollments()
+    queue = EnrollmentJobQueue(database, str(tmp_path / "jobs"), handler, poll_interval=0.01)
+    queue.start()
+    try:
+        first = queue.submit("S1", "Facenet512", PHOTOS)
+        assert wait_until_finished(queue, first["job_id"])["status"] == "completed"
+
+        # The student is deleted, then the same photos are uploaded again
+        handler.enrolled.discard("S1")
+        second = queue.submit("S1", "Facenet512", PHOTOS)
+        assert second["job_id"] != first["job_id"]
+        finished = wait_until_finished(queue, second["job_id"])
+    finally:
+        queue.stop()
+
+    assert finished["status"] == "completed"
+    assert finished["result"] == {"success": True, "student_id": "S1"}
+    assert handler.calls == ["S1", "S1"]
+    assert "S1" in handler.enrolled
+    assert os.listdir(tmp_path / "jobs") == []
+
+
+def test_purge_removes_expired_jobs_and_orphaned_staging(database, tmp_path):
+    staging = tmp_path / "jobs"
+    queue = EnrollmentJobQueue(database, str(staging), FakeEnrollments(), lease_seconds=0,
+                               retention_seconds=3600)
+    old = queue.submit("OLD", "Facenet512", PHOTOS)
+    recent = queue.submit("RECENT", "Facenet512", PHOTOS)
+    queued = queue.submit("QUEUED", "Facenet512", PHOTOS)
+
+    conn = sqlite3.connect(database)
+    conn.execute("UPDATE face_enrollment_jobs SET status = 'completed', finished_at = datetime('now', '-2 hours') "
+                 "WHERE job_id = ?", (old["job_id"],))
+    conn.execute("UPDATE face_enrollment_jobs SET status = 'failed', finished_at = CURRENT_TIMESTAMP "
+                 "WHERE job_id = ?", (recent["job_id"],))
+    conn.commit()
+    conn.close()
+    time.sleep(0.01)
+
+    assert queue.purge() == 1
+    assert queue.get(old["job_id"]) is None
+    assert queue.get(recent["job_id"])["status"] == "failed"
+    # Only the queued job still needs its photos
+    assert sorted(os.listdir(staging)) == [queued["job_id"]]
@@ -0,0 +1,127 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import cv2
+import numpy as np
+import pytest
+
+from gallery import CHANGE_TRIGGERS, GALLERY_SCHEMA, SharedGallery
+from loadtest import ENROLLMENTS_SCHEMA, FakeDeepFace, student_frame
+
+MODEL = "Facenet512"
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+fake = FakeDeepFace(detect_ms=0, embed_ms=0, jitter=0)
+
+
+def embedding(index, variant=0):
+    image = cv2.imdecode(np.frombuffer(student_frame(index, variant), dtype=np.uint8), cv2.IMREAD_COLOR)
+    return fake.represent(image, MODEL)[0]["embedding"]
+
+
+def enroll(database, index):
+    conn = sqlite3.connect(database)
+    conn.execute("""
+        INSERT INTO photo_face_enrollments (student_id, photo_path, photo_hash, deepface_embedding,
+                                            face_confidence, photo_quality_score, model_name)
+        VALUES (?, 'photo.jpg', ?, ?, 1.0, 1.0, ?)
+    """, (f"S{index}", f"hash-{index}", json.dumps(embedding(index)), MODEL))
+    conn.commit()
+    conn.close()
+
+
+def unenroll(database, index):
+    conn = sqlite3.connect(database)
+    conn.execute("DELETE FROM photo_face_enrollments WHERE student_id = ?", (f"S{index}",))
+    conn.commit()
+    conn.close()
+
+
+def students(view):
+    return sorted(view.student_ids)
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "attendance.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(ENROLLMENTS_SCHEMA)
+    conn.executescript(GALLERY_SCHEMA)
+    conn.executescript(CHANGE_TRIGGERS)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def workers(database, tmp_path):
+    """Two workers sharing the database and gallery directory, as uvicorn --workers would"""
+    gallery_dir = str(tmp_path / "gallery")
+    return SharedGallery(database, gallery_dir), SharedGallery(database, gallery_dir)
+
+
+def test_changes_are_appended_to_the_delta_and_seen_by_other_workers(database, workers):
+    writer, reader = workers
+    for index in range(3):
+        enroll(database, index)
+    generation = writer.sync(MODEL).generation
+    assert students(reader.view(MODEL)) == ["S0", "S1", "S2"]
+
+    enroll(database, 3)
+    unenroll(database, 0)
+    view = writer.sync(MODEL)
+
+    # No new snapshot, just delta records on top of the published one
+    assert view.generation == generation
+    assert view.delta_count > 0
+    seen = reader.view(MODEL)
+    assert (seen.generation, seen.sequence) == (view.generation, view.sequence)
+    assert students(seen) == ["S1", "S2", "S3"]
+    assert seen.best_match(embedding(3, variant=1))["student_id"] == "S3"
+    assert seen.best_match(embedding(0, variant=1))["student_id"] != "S0"
+
+
+def test_compaction_publishes_a_new_generation_to_other_workers(database, workers):
+    writer, reader = workers
+    for index in range(4):
+        enroll(database, index)
+    writer.sync(MODEL)
+    unenroll(database, 1)
+    enroll(database, 4)
+    before = writer.sync(MODEL)
+    assert students(reader.view(MODEL)) == ["S0", "S2", "S3", "S4"]
+
+    generation = writer.compact(MODEL)
+
+    assert generation == before.generation + 1
+    seen = reader.view(MODEL)
+    assert (seen.generation, seen.delta_count) == (generation, 0)
+    assert students(seen) == ["S0", "S2", "S3", "S4"]
+    assert seen.best_match(embedding(4, variant=2))["student_id"] == "S4"
+
+    # Later changes go to the new generation's delta
+    unenroll(database, 2)
+    assert students(writer.sync(MODEL)) == ["S0", "S3", "S4"]
+    assert students(reader.view(MODEL)) == ["S0", "S3", "S4"]
+
+
+def test_update_from_another_process(database, workers, tmp_path):
+    _, reader = workers
+    for index in range(2):
+        enroll(database, index)
+    reader.sync(MODEL)
+
+    enroll(database, 2)
+    script = (
+        "import sys; from gallery import SharedGallery; "
+        "SharedGallery(sys.argv[1], sys.argv[2]).sync(sys.argv[3])"
+    )
+    subprocess.run(
+        [sys.executable, "-c", script, database, str(tmp_path / "gallery"), MODEL],
+        cwd=BACKEND_DIR, check=True
+    )
+
+    # Picked up from the shared counter file, without reading the change log
+    assert students(reader.view(MODEL)) == ["S0", "S1", "S2"]
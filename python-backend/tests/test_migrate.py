@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+from loadtest import ENROLLMENTS_SCHEMA
+from migrate import enrollments_keyed_per_photo, migrate, pending
+
+# photo_face_enrollments as older reset scripts created it
+LEGACY_SCHEMA = ENROLLMENTS_SCHEMA.replace("UNIQUE(student_id, model_name, photo_hash)", "UNIQUE(student_id)")
+
+INSERT = """
+    INSERT INTO photo_face_enrollments (student_id, photo_path, photo_hash, deepface_embedding,
+                                        face_confidence, photo_quality_score, model_name)
+    VALUES (?, 'photo.jpg', ?, '[]', 0.9, 0.8, ?)
+"""
+
+
+@pytest.fixture
+def legacy_database(tmp_path):
+    path = str(tmp_path / "attendance.db")
+    conn = sqlite3.connect(path)
+    conn.execute(LEGACY_SCHEMA)
+    conn.execute("CREATE INDEX idx_photo_enrollments_student_id ON photo_face_enrollments(student_id)")
+    conn.execute("""
+        CREATE TRIGGER enrollments_touch AFTER UPDATE ON photo_face_enrollments
+        BEGIN SELECT 1; END
+    """)
+    for student_id in ("S1", "S2", "S3"):
+        conn.execute(INSERT, (student_id, f"{student_id}-front", "Facenet512"))
+    conn.execute("DELETE FROM photo_face_enrollments WHERE student_id = 'S3'")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_migration_keeps_rows_and_allows_one_row_per_photo_and_model(legacy_database):
+    conn = sqlite3.connect(legacy_database)
+    assert not enrollments_keyed_per_photo(conn)
+    conn.close()
+
+    assert migrate(legacy_database) == ["enrollments_unique_per_photo"]
+
+    conn = sqlite3.connect(legacy_database)
+    assert enrollments_keyed_per_photo(conn)
+    assert conn.execute("SELECT id, student_id FROM photo_face_enrollments ORDER BY id").fetchall() == [(1, "S1"), (2, "S2")]
+    names = {name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE tbl_name = 'photo_face_enrollments' AND type IN ('index', 'trigger')"
+    )}
+    assert {"idx_photo_enrollments_student_id", "enrollments_touch"} <= names
+
+    conn.execute(INSERT, ("S1", "S1-profile", "Facenet512"))
+    conn.execute(INSERT, ("S1", "S1-front", "Facenet"))
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute(INSERT, ("S1", "S1-front", "Facenet512"))
+    # The deleted row's id is never reused
+    assert conn.execute("SELECT MIN(id) FROM photo_face_enrollments WHERE student_id = 'S1' AND id > 2").fetchone()[0] == 4
+    conn.close()
+
+
+def test_migrations_run_once(legacy_database):
+    migrate(legacy_database)
+    assert migrate(legacy_database) == []
+
+    conn = sqlite3.connect(legacy_database)
+    assert pending(conn) == []
+    conn.close()
+
+
+def test_current_schema_is_recorded_without_a_rebuild(tmp_path):
+    path = str(tmp_path / "attendance.db")
+    conn = sqlite3.connect(path)
+    conn.execute(ENROLLMENTS_SCHEMA)
+    conn.commit()
+    conn.close()
+
+    assert migrate(path) == ["enrollments_unique_per_photo"]
+
+
+def test_missing_table_stays_pending(tmp_path):
+    path = str(tmp_path / "attendance.db")
+
+    assert migrate(path) == []
+
+    conn = sqlite3.connect(path)
+    assert pending(conn) == [(1, "enrollments_unique_per_photo")]
+    conn.close()
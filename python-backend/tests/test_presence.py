@@ -0,0 +1,67 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import presence
+from presence import PresenceCache
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.setattr(presence, "today", lambda: "2026-01-05")
+    path = str(tmp_path / "attendance.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE daily_attendance (student_id TEXT, date DATE, status TEXT, UNIQUE(student_id, date))")
+    conn.execute("INSERT INTO daily_attendance VALUES ('S1', '2026-01-05', 'present')")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def record(database, student_id, day="2026-01-05"):
+    conn = sqlite3.connect(database)
+    conn.execute("INSERT INTO daily_attendance VALUES (?, ?, 'present')", (student_id, day))
+    conn.commit()
+    conn.close()
+
+
+def eventually(check, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not check():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_requests_read_memory_and_reload_in_background(database, monkeypatch):
+    cache = PresenceCache(database, refresh_interval=3600)
+    assert cache.warm() == 1
+    record(database, "S2")
+
+    loads = []
+    load = cache._load
+    monkeypatch.setattr(cache, "_load", lambda day: loads.append(threading.current_thread().name) or load(day))
+
+    assert cache.is_present("S1") and not cache.is_present("S2")
+    cache.mark("S3")
+    assert cache.is_present("S3")
+    assert loads == []
+
+    cache.invalidate()
+    cache.is_present("S2")
+    eventually(lambda: cache.is_present("S2"))
+    assert cache.stats()["present"] == 3
+    # Only the reload thread touched SQLite
+    assert set(loads) == {"presence-refresh"}
+
+
+def test_rollover_drops_yesterday(database, monkeypatch):
+    cache = PresenceCache(database, refresh_interval=3600)
+    cache.warm()
+    cache.mark("S3")
+    record(database, "S4", day="2026-01-06")
+
+    monkeypatch.setattr(presence, "today", lambda: "2026-01-06")
+    assert not cache.is_present("S1") and not cache.is_present("S3")
+    eventually(lambda: cache.is_present("S4"))
@@ -0,0 +1,29 @@
+import sqlite3
+
+from reembed import CHECKPOINT_SCHEMA, job_key, read_checkpoint
+
+
+def test_reading_a_missing_checkpoint_creates_nothing(tmp_path):
+    database = str(tmp_path / "attendance.db")
+
+    assert read_checkpoint(database, job_key("Facenet")) == {"job_key": "*->Facenet", "status": "not_started"}
+
+    conn = sqlite3.connect(database)
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+    conn.close()
+
+
+def test_read_checkpoint(tmp_path):
+    database = str(tmp_path / "attendance.db")
+    conn = sqlite3.connect(database)
+    conn.execute(CHECKPOINT_SCHEMA)
+    conn.execute("""
+        INSERT INTO face_reembedding_checkpoints (job_key, source_model, target_model, last_enrollment_id, processed)
+        VALUES (?, 'Facenet512', 'Facenet', 42, 40)
+    """, (job_key("Facenet", "Facenet512"),))
+    conn.commit()
+    conn.close()
+
+    checkpoint = read_checkpoint(database, "Facenet512->Facenet")
+
+    assert (checkpoint["status"], checkpoint["last_enrollment_id"], checkpoint["processed"]) == ("running", 42, 40)
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+from budget import DeadlineExceeded, RequestBudget
+from scheduler import ENROLL, MAINTENANCE, VERIFY, InferenceScheduler
+
+
+def eventually(check, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class Holder:
+    """Occupies one slot of a workload class until released"""
+
+    def __init__(self, scheduler, workload):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.thread = threading.Thread(target=scheduler.run_sync, args=(workload, self._hold), daemon=True)
+        self.thread.start()
+
+    def _hold(self):
+        self.started.set()
+        self.release.wait(5)
+
+    def finish(self):
+        self.release.set()
+        self.thread.join(5)
+
+
+def waiting(scheduler, workload):
+    return scheduler.stats()["classes"][workload]["waiting"]
+
+
+def test_waiting_verification_runs_before_earlier_lower_classes():
+    scheduler = InferenceScheduler(max_concurrency=1, reserved_for_verify=0)
+    holder = Holder(scheduler, MAINTENANCE)
+    assert holder.started.wait(2)
+
+    order = []
+    threads = []
+    for workload in (MAINTENANCE, ENROLL, VERIFY):
+        thread = threading.Thread(target=scheduler.run_sync, args=(workload, order.append, workload), daemon=True)
+        thread.start()
+        threads.append(thread)
+        # Queue them in this order, lowest priority first
+        assert eventually(lambda: waiting(scheduler, workload) == 1)
+
+    holder.finish()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == [VERIFY, ENROLL, MAINTENANCE]
+
+
+def test_reserved_slot_is_kept_for_verification():
+    scheduler = InferenceScheduler(max_concurrency=2, reserved_for_verify=1)
+    holder = Holder(scheduler, MAINTENANCE)
+    assert holder.started.wait(2)
+
+    # The only unreserved slot is taken, so enrollment waits...
+    enrolled = threading.Event()
+    enroll = threading.Thread(target=scheduler.run_sync, args=(ENROLL, enrolled.set), daemon=True)
+    enroll.start()
+    assert eventually(lambda: waiting(scheduler, ENROLL) == 1)
+    assert not enrolled.is_set()
+
+    # ...while verification still gets the reserved one
+    assert scheduler.run_sync(VERIFY, lambda: "verified") == "verified"
+
+    holder.finish()
+    enroll.join(5)
+    assert enrolled.is_set()
+    assert scheduler.stats()["running"] == 0
+
+
+def test_class_limit_caps_a_workload():
+    scheduler = InferenceScheduler(max_concurrency=3, class_limits={MAINTENANCE: 1}, reserved_for_verify=0)
+    holder = Holder(scheduler, MAINTENANCE)
+    assert holder.started.wait(2)
+
+    second = threading.Thread(target=scheduler.run_sync, args=(MAINTENANCE, lambda: None), daemon=True)
+    second.start()
+    assert eventually(lambda: waiting(scheduler, MAINTENANCE) == 1)
+    assert scheduler.run_sync(ENROLL, lambda: "enrolled") == "enrolled"
+
+    holder.finish()
+    second.join(5)
+    assert scheduler.stats()["classes"][MAINTENANCE]["completed"] == 2
+
+
+def test_queueing_gives_up_at_the_deadline():
+    scheduler = InferenceScheduler(max_concurrency=1, reserved_for_verify=0)
+    holder = Holder(scheduler, ENROLL)
+    assert holder.started.wait(2)
+
+    with pytest.raises(DeadlineExceeded):
+        scheduler.run_sync(VERIFY, lambda: None, budget=RequestBudget(50))
+
+    holder.finish()
+    assert scheduler.stats()["classes"][VERIFY]["timed_out"] == 1
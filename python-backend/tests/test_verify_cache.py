@@ -0,0 +1,66 @@
+import cv2
+import numpy as np
+
+from loadtest import student_frame
+from verify_cache import EXACT, PERCEPTUAL, VerificationCache
+
+MODEL = "Facenet512"
+RESULT = {"success": True, "embedding": [0.1, 0.2]}
+
+
+def reencoded(frame, quality=80):
+    """The same picture with different bytes, as a camera resending a frame would produce"""
+    image = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    assert ok
+    return encoded.tobytes()
+
+
+def test_exact_hit():
+    cache = VerificationCache()
+    key, phash = cache.key("S1", MODEL, student_frame(1, 0))
+    assert cache.get(key, phash) == (None, None)
+    cache.put(key, phash, RESULT)
+
+    assert cache.get(*cache.key("S1", MODEL, student_frame(1, 0))) == (RESULT, EXACT)
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["misses"]) == (1, 1)
+
+
+def test_perceptual_hit_for_a_near_identical_frame():
+    cache = VerificationCache()
+    frame = student_frame(1, 0)
+    cache.put(*cache.key("S1", MODEL, frame), RESULT)
+
+    key, phash = cache.key("S1", MODEL, reencoded(frame))
+    assert key != cache.key("S1", MODEL, frame)[0]
+    assert cache.get(key, phash) == (RESULT, PERCEPTUAL)
+
+
+def test_perceptual_hits_stay_within_student_and_model():
+    cache = VerificationCache()
+    frame = student_frame(1, 0)
+    cache.put(*cache.key("S1", MODEL, frame), RESULT)
+
+    assert cache.get(*cache.key("S2", MODEL, reencoded(frame))) == (None, None)
+    assert cache.get(*cache.key("S1", "Facenet", reencoded(frame))) == (None, None)
+    # A different student's frame is too far apart
+    assert cache.get(*cache.key("S1", MODEL, student_frame(2, 0))) == (None, None)
+
+
+def test_failures_only_hit_exactly():
+    cache = VerificationCache()
+    frame = student_frame(1, 0)
+    failure = {"success": False, "error": "No face detected"}
+    cache.put(*cache.key("S1", MODEL, frame), failure)
+
+    assert cache.get(*cache.key("S1", MODEL, frame)) == (failure, EXACT)
+    assert cache.get(*cache.key("S1", MODEL, reencoded(frame))) == (None, None)
+
+
+def test_timed_out_results_are_not_cached():
+    cache = VerificationCache()
+    key, phash = cache.key("S1", MODEL, student_frame(1, 0))
+    cache.put(key, phash, {"success": False, "timed_out": True})
+
+    assert cache.get(key, phash) == (None, None)
@@ -0,0 +1,110 @@
+"""Short-lived cache for repeated verification frames.
+
+Kiosk cameras often resend the same (or a nearly identical) frame when a
+student retries after an error. Entries are keyed by (student_id, model_name,
+SHA-256 of the upload) and also indexed by a 64-bit difference hash (dHash) of
+the frame, so a near-identical frame (a few bits apart) hits as well.
+
+What is cached is the result of detection and embedding, the expensive part.
+Matching against the gallery still runs on every request, so a hit always
+uses the current enrollments and thresholds. Perceptual hits only reuse
+successful results; a failed frame is reused only for the exact same bytes.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+EXACT = "exact"
+PERCEPTUAL = "perceptual"
+
+
+def perceptual_hash(image_data: bytes) -> Optional[int]:
+    """64-bit difference hash of an encoded image, or None if it can't be decoded"""
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+class VerificationCache:
+    """TTL + LRU cache of embedding results for verification frames"""
+
+    def __init__(self, ttl_seconds: float = 10.0, max_entries: int = 2048, max_hash_distance: int = 4):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_hash_distance = max_hash_distance
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[float, Optional[int], Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = {EXACT: 0, PERCEPTUAL: 0}
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    def key(self, student_id: str, model_name: str, image_data: bytes) -> Tuple[Tuple[str, str, str], Optional[int]]:
+        """Exact cache key and perceptual hash for a frame"""
+        digest = hashlib.sha256(image_data).hexdigest()
+        phash = perceptual_hash(image_data) if self.max_hash_distance >= 0 else None
+        return (student_id, model_name, digest), phash
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            oldest_key, (expires, _, _) = next(iter(self._entries.items()))
+            if expires > now:
+                break
+            del self._entries[oldest_key]
+
+    def get(self, key: Tuple[str, str, str], phash: Optional[int]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """(cached result, "exact" or "perceptual"), or (None, None) on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._hits[EXACT] += 1
+                return entry[2], EXACT
+
+            if phash is not None:
+                student_id, model_name, _ = key
+                for (other_student, other_model, _), (_, other_hash, result) in reversed(self._entries.items()):
+                    if (other_student == student_id and other_model == model_name and other_hash is not None
+                            and result.get("success") and bin(phash ^ other_hash).count("1") <= self.max_hash_distance):
+                        self._hits[PERCEPTUAL] += 1
+                        return result, PERCEPTUAL
+
+            self._misses += 1
+            return None, None
+
+    def put(self, key: Tuple[str, str, str], phash: Optional[int], result: Dict[str, Any]) -> None:
+        if result.get("timed_out"):
+            # Depends on the request's budget, not on the frame
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (now + self.ttl_seconds, phash, result)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.monotonic())
+            lookups = self._hits[EXACT] + self._hits[PERCEPTUAL] + self._misses
+            return {
+                "enabled": self.enabled,
+                "ttl_seconds": self.ttl_seconds,
+                "entries": len(self._entries),
+                "exact_hits": self._hits[EXACT],
+                "perceptual_hits": self._hits[PERCEPTUAL],
+                "misses": self._misses,
+                "hit_rate": round((lookups - self._misses) / lookups, 4) if lookups else None,
+            }